@@ -0,0 +1,68 @@
+from dexy.version import DEXY_VERSION
+import dexy.utils
+import os
+
+class AstCache(object):
+    """
+    Saves the AbstractSyntaxTree built from config files, so a run whose
+    config files are unchanged can skip parsing them.
+
+    The snapshot is reused only if the digests of the config files, the
+    settings which affect parsing, and the availability of each file path
+    which the parsers looked up in the filemap are all the same.
+    """
+    ast_attributes = ('lookup_table', 'tree', 'root_nodes_ordered',
+            'default_args_for_directory', 'environment_for_directory',)
+
+    def __init__(self, wrapper):
+        self.wrapper = wrapper
+
+    def filepath(self):
+        return os.path.join(self.wrapper.artifacts_dir, "ast.pickle")
+
+    def settings(self):
+        w = self.wrapper
+        return (DEXY_VERSION, w.parsers, w.recurse, w.configs, w.siblings,)
+
+    def load(self):
+        return dexy.utils.load_pickle(self.wrapper, self.filepath())
+
+    def restore(self, ast, digests):
+        """
+        Populates ast from the saved snapshot and returns True, or returns
+        False if there is no snapshot which is still valid.
+        """
+        snapshot = self.load()
+        if not snapshot:
+            return False
+
+        if snapshot['settings'] != self.settings():
+            return False
+
+        if snapshot['digests'] != digests:
+            return False
+
+        for filepath, available in snapshot['probes'].iteritems():
+            if self.wrapper.file_available(filepath) != available:
+                return False
+
+        for attr in self.ast_attributes:
+            setattr(ast, attr, snapshot[attr])
+        return True
+
+    def save(self, ast, digests, probes):
+        snapshot = {
+                'settings' : self.settings(),
+                'digests' : digests,
+                'probes' : probes
+                }
+        for attr in self.ast_attributes:
+            snapshot[attr] = getattr(ast, attr)
+
+        dexy.utils.save_pickle(self.wrapper, self.filepath(), snapshot)
+
+    def remove(self):
+        try:
+            os.remove(self.filepath())
+        except OSError:
+            pass
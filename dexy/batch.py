@@ -7,6 +7,7 @@ class Batch(object):
         self.wrapper = wrapper
         self.docs = {}
         self.doc_keys = {}
+        self.datas = {} # data objects by (doc key, 'input' or 'output'), see data()
         self.filters_used = []
         self.uuid = str(uuid.uuid4())
         self.start_time = None
@@ -33,7 +34,10 @@ class Batch(object):
             self.filters_used.extend(doc.filter_aliases)
 
     def update_doc_info(self, doc):
-        self.docs[doc.key_with_class()] = doc.batch_info()
+        doc_key = doc.key_with_class()
+        self.docs[doc_key] = doc.batch_info()
+        self.datas.pop((doc_key, 'input',), None)
+        self.datas.pop((doc_key, 'output',), None)
 
     def output_data(self, doc_key):
         return self.data(doc_key, 'output')
@@ -57,15 +61,18 @@ class Batch(object):
 
     def data(self, doc_key, input_or_output='output'):
         """
-        Retrieves a data object given the doc key.
+        Retrieves a data object given the doc key. Data objects are created
+        once and reused, storage which needs connecting connects on first use.
         """
-        doc_info = self.doc_info(doc_key)["%s-data" % input_or_output]
-        args = list(doc_info)
-        args.append(self.wrapper)
-        data = dexy.data.Data.create_instance(*args)
-        data.setup_storage()
-        if hasattr(data.storage, 'connect'):
-            data.storage.connect()
+        key = (doc_key, input_or_output,)
+        data = self.datas.get(key)
+        if data is None:
+            doc_info = self.doc_info(doc_key)["%s-data" % input_or_output]
+            args = list(doc_info)
+            args.append(self.wrapper)
+            data = dexy.data.Data.create_instance(*args)
+            data.setup_storage()
+            self.datas[key] = data
         return data
 
     def elapsed(self):
@@ -109,6 +116,7 @@ class Batch(object):
             d = pickle.load(f)
             for k, v in d.iteritems():
                 setattr(self, k, v)
+        self.datas = {}
 
     @classmethod
     def load_most_recent(klass, wrapper):
@@ -0,0 +1,72 @@
+import dexy.utils
+import os
+
+class CacheIndex(object):
+    """
+    In-memory index of the files in the this/ cache dir, with the mtime, size
+    and inode of each, so checking the cache doesn't need a filesystem call
+    per data object.
+
+    The index is saved at the end of each run and loaded once by the next.
+    The saved copy is removed when a run starts, so if a run is interrupted
+    the next one rebuilds the index by scanning the cache dir.
+    """
+    def __init__(self, wrapper):
+        self.wrapper = wrapper
+        self.entries = {}
+
+    def filepath(self):
+        return os.path.join(self.wrapper.artifacts_dir, "cache-manifest.pickle")
+
+    def load(self):
+        self.entries = dexy.utils.load_pickle(self.wrapper, self.filepath())
+        if not isinstance(self.entries, dict):
+            self.scan()
+
+    def scan(self):
+        self.wrapper.log.debug("scanning cache dir to rebuild cache index")
+        self.entries = {}
+        for dirpath, dirnames, filenames in os.walk(self.wrapper.this_cache_dir()):
+            for filename in filenames:
+                self.record(os.path.join(dirpath, filename))
+
+    def invalidate(self):
+        """
+        Removes the saved index, called when a run starts.
+        """
+        try:
+            os.remove(self.filepath())
+        except OSError:
+            pass
+
+    def save(self):
+        dexy.utils.save_pickle(self.wrapper, self.filepath(), self.entries)
+
+    def record(self, filepath):
+        """
+        Updates the entry for filepath after it has been written or removed.
+        """
+        name = os.path.basename(filepath)
+        try:
+            st = os.stat(filepath)
+            self.entries[name] = (st.st_mtime, st.st_size, st.st_ino, st.st_dev,)
+        except OSError:
+            self.entries.pop(name, None)
+
+    def remove(self, name):
+        self.entries.pop(name, None)
+
+    def contains(self, name):
+        return name in self.entries
+
+    def mtime(self, name):
+        return self.entries[name][0]
+
+    def size(self, name):
+        return self.entries[name][1]
+
+    def inode(self, name):
+        return self.entries[name][2:4]
+
+    def names(self):
+        return set(self.entries)
@@ -10,20 +10,24 @@ import time
 def dexy_command(
         __cli_options=False,
         artifactsdir=defaults['artifacts_dir'], # location of directory in which to store artifacts
+        cachebackend=defaults['cache_backend'], # 'files' to cache each artifact in its own file, 'pack' to store small artifacts together in pack files
         conf=defaults['config_file'], # name to use for configuration file
         configs=defaults['configs'], # list of doc config files to parse
+        datacache=defaults['data_cache_mb'], # megabytes of loaded doc contents to keep in memory during a run
         debug=defaults['debug'], # Prints stack traces, other debug stuff.
         directory=defaults['directory'], # Allow processing just a subdirectory.
         dryrun=defaults['dry_run'], # if True, just parse config and print batch info, don't run dexyT
         encoding=defaults['encoding'], # Default encoding. Set to 'chardet' to use chardet auto detection.
         exclude=defaults['exclude'], # comma-separated list of directory names to exclude from dexy processing
         excludealso=defaults['exclude_also'], # comma-separated list of directory names to exclude from dexy processing
+        filterjobs=defaults['filter_jobs'], # number of processes used to run pure filters ahead of the docs which use them
         full=defaults['full'], # Whether to do a full run including tasks marked default: False
         globals=defaults['globals'], # global values to make available within dexy documents, should be KEY=VALUE pairs separated by spaces
         help=False, #nodoc
         h=False, #nodoc
         hashfunction=defaults['hashfunction'], # What hash function to use, set to crc32 or adler32 for more speed but less reliability
         include=defaults['include'], # Locations to include which would normally be excluded.
+        ingestmode=defaults['ingest_mode'], # how changed source files are stored in the cache: 'copy', 'link' (hard links) or 'reflink' (copy-on-write clones), falling back to 'copy'
         logdir=defaults['log_dir'], # DEPRECATED
         logfile=defaults['log_file'], # name of log file
         logformat=defaults['log_format'], # format of log entries
@@ -36,6 +40,8 @@ def dexy_command(
         profile=defaults['profile'], # whether to run with cProfile. Arg can be a boolean, in which case profile saved to 'dexy.prof', or a filename to save to.
         r=False, # whether to clear cache before running dexy
         recurse=defaults['recurse'], # whether to include doc config files in subdirectories
+        publishmode=defaults['publish_mode'], # how reports publish cached files: 'copy', 'link' (hard links) or 'reflink' (copy-on-write clones), falling back to 'copy'
+        reportjobs=defaults['report_jobs'], # number of processes the website reporter uses to render pages
         reports=defaults['reports'], # reports to be run after dexy runs, enclose in quotes and separate with spaces
         reset=False, # whether to clear cache before running dexy
         silent=defaults['silent'], # Whether to not print any output when running dexy
@@ -77,6 +83,9 @@ def dexy_command(
             wrapper.run_from_new()
             elapsed = time.time() - start
             print "dexy run finished in %0.3f%s" % (elapsed, wrapper.state_message())
+            highlight_cache_summary = wrapper.highlight_cache_summary()
+            if highlight_cache_summary:
+                print highlight_cache_summary
 
     except dexy.exceptions.UserFeedback as e:
         handle_user_feedback_exception(wrapper, e)
@@ -1,75 +1,339 @@
+import BaseHTTPServer
 import SimpleHTTPServer
 import SocketServer
+import StringIO
 import dexy.reporter
+import email.utils
+import gzip
 import socket
 import os
+import re
 import sys
+import threading
 from dexy.utils import file_exists
 from dexy.commands.utils import init_wrapper
 import dexy.load_plugins
 
+try:
+    from sendfile import sendfile
+except ImportError:
+    sendfile = getattr(os, 'sendfile', None)
+
 NO_OUTPUT_MSG = """Please run dexy first, or specify a directory to serve. \
 For help run 'dexy help -on serve'"""
 
-class SimpleHTTPAuthRequestHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
-    def send_head(self):
-        """Common code for GET and HEAD commands.
+COMPRESSIBLE_TYPES = (
+        'application/javascript',
+        'application/json',
+        'application/x-javascript',
+        'application/xml',
+        'image/svg+xml',
+        )
+
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+class ThreadedHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    Handles each connection in its own thread, so slow or kept-alive
+    connections don't hold up other requests.
+    """
+    daemon_threads = True
+
+class DexyHTTPRequestHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
+    """
+    Serves files with keep-alive, ETag and Last-Modified validators and
+    304 Not Modified responses, gzip compression of text types, single byte
+    range requests and optional HTTP basic auth.
+
+    Compressed text is read from a fresh 'name.gz' file next to the file
+    if there is one, otherwise it is compressed once and kept in memory
+    until the file changes.
+    """
+    protocol_version = "HTTP/1.1"
+
+    authcode = None
+    realm = None
+
+    copy_buffer_size = 64 * 1024
+    sendfile_min_size = 256 * 1024
+    max_compress_size = 4 * 1024 * 1024
+    max_gzip_cache_size = 64 * 1024 * 1024
 
-        This sends the response code and MIME headers.
+    gzip_cache = {}
+    gzip_cache_size = [0]
+    gzip_cache_lock = threading.Lock()
+
+    def do_GET(self):
+        response = self.send_head()
+        if response:
+            f, offset, length = response
+            try:
+                self.send_body(f, offset, length)
+            finally:
+                f.close()
 
-        Return value is either a file object (which has to be copied
-        to the outputfile by the caller unless the command was HEAD,
-        and must be closed by the caller under all circumstances), or
-        None, in which case the caller has nothing further to do.
+    def do_HEAD(self):
+        response = self.send_head()
+        if response:
+            response[0].close()
 
+    def send_body(self, f, offset, length):
         """
-        if self.headers.getheader('Authorization') == None:
-            self.send_response(401)
-            self.send_header('WWW-Authenticate', 'Basic realm="%s"' % self.__class__.realm)
-            self.send_header('Content-type', 'text/html')
-            self.end_headers()
-            self.wfile.write("no authorization received")
+        Writes length bytes of f starting at offset to the client, using
+        sendfile for large files when it is available.
+        """
+        if sendfile and length >= self.sendfile_min_size and isinstance(f, file):
+            self.wfile.flush()
+            out_fd = self.connection.fileno()
+            in_fd = f.fileno()
+            while length > 0:
+                sent = sendfile(out_fd, in_fd, offset, min(length, 1024 * 1024))
+                if not sent:
+                    # file shrank, so the promised Content-Length can't be met
+                    self.close_connection = 1
+                    break
+                offset += sent
+                length -= sent
+        else:
+            f.seek(offset)
+            while length > 0:
+                buf = f.read(min(length, self.copy_buffer_size))
+                if not buf:
+                    # file shrank, so the promised Content-Length can't be met
+                    self.close_connection = 1
+                    break
+                self.wfile.write(buf)
+                length -= len(buf)
 
-        elif self.headers.getheader('Authorization') != "Basic %s" % self.__class__.authcode:
-            self.send_response(401)
-            self.send_header('WWW-Authenticate', 'Basic realm="%s"' % self.__class__.realm)
-            self.send_header('Content-type', 'text/html')
-            self.end_headers()
-            self.wfile.write("not authenticated")
+    def send_unauthorized(self, msg):
+        self.send_response(401)
+        self.send_header('WWW-Authenticate', 'Basic realm="%s"' % self.realm)
+        self.send_header('Content-type', 'text/html')
+        self.send_header('Content-Length', str(len(msg)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(msg)
 
+    def is_authorized(self):
+        if not self.authcode:
+            return True
+
+        authorization = self.headers.getheader('Authorization')
+        if authorization is None:
+            self.send_unauthorized("no authorization received")
+            return False
+        elif authorization != "Basic %s" % self.authcode:
+            self.send_unauthorized("not authenticated")
+            return False
         else:
-            path = self.translate_path(self.path)
-            f = None
-            if os.path.isdir(path):
-                if not self.path.endswith('/'):
-                    # redirect browser - doing basically what apache does
-                    self.send_response(301)
-                    self.send_header("Location", self.path + "/")
-                    self.end_headers()
-                    return None
-                for index in "index.html", "index.htm":
-                    index = os.path.join(path, index)
-                    if os.path.exists(index):
-                        path = index
-                        break
-                else:
-                    return self.list_directory(path)
-            ctype = self.guess_type(path)
-            try:
-                # Always read in binary mode. Opening files in text mode may cause
-                # newline translations, making the actual size of the content
-                # transmitted *less* than the content-length!
-                f = open(path, 'rb')
-            except IOError:
-                self.send_error(404, "File not found")
+            return True
+
+    def send_head(self):
+        """
+        Sends the response code and headers for GET and HEAD requests.
+
+        Returns None if there is no body to send, otherwise a tuple of a file
+        object, which the caller must close, the offset to start sending from
+        and the number of bytes to send.
+        """
+        if not self.is_authorized():
+            return None
+
+        path = self.translate_path(self.path)
+        if os.path.isdir(path):
+            if not self.path.split('?', 1)[0].endswith('/'):
+                # redirect browser - doing basically what apache does
+                self.send_response(301)
+                self.send_header("Location", self.path + "/")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
                 return None
-            self.send_response(200)
-            self.send_header("Content-type", ctype)
+            for index in "index.html", "index.htm":
+                index = os.path.join(path, index)
+                if os.path.exists(index):
+                    path = index
+                    break
+            else:
+                f = self.list_directory(path)
+                if f:
+                    return (f, 0, len(f.getvalue()),)
+                return None
+
+        ctype = self.guess_type(path)
+        try:
+            # Always read in binary mode. Opening files in text mode may cause
+            # newline translations, making the actual size of the content
+            # transmitted *less* than the content-length!
+            f = open(path, 'rb')
+        except IOError:
+            self.send_error(404, "File not found")
+            return None
+
+        try:
             fs = os.fstat(f.fileno())
-            self.send_header("Content-Length", str(fs[6]))
-            self.send_header("Last-Modified", self.date_time_string(fs.st_mtime))
+            etag = '"%x-%x-%x"' % (fs.st_ino, fs.st_size, int(fs.st_mtime * 1000000))
+            last_modified = self.date_time_string(fs.st_mtime)
+
+            compressible = self.is_compressible(ctype)
+            gzipped = None
+            if compressible and self.accepts_gzip():
+                gzipped = self.gzipped(path, f, fs, etag)
+                if gzipped:
+                    etag = etag[:-1] + '-gz"'
+
+            if self.is_not_modified(etag, fs.st_mtime):
+                f.close()
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.send_header("Last-Modified", last_modified)
+                if compressible:
+                    self.send_header("Vary", "Accept-Encoding")
+                self.end_headers()
+                return None
+
+            if gzipped:
+                f.close()
+                f = gzipped
+                size = len(gzipped.getvalue())
+                byte_range = None
+            else:
+                size = fs.st_size
+                byte_range = self.requested_range(size, etag, fs.st_mtime)
+
+            if byte_range == 'invalid':
+                f.close()
+                self.send_response(416)
+                self.send_header("Content-Range", "bytes */%s" % size)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return None
+            elif byte_range:
+                start, end = byte_range
+                self.send_response(206)
+                self.send_header("Content-Range", "bytes %s-%s/%s" % (start, end, size))
+            else:
+                start, end = 0, size - 1
+                self.send_response(200)
+
+            self.send_header("Content-type", ctype)
+            self.send_header("Content-Length", str(end - start + 1))
+            self.send_header("Last-Modified", last_modified)
+            self.send_header("ETag", etag)
+            self.send_header("Accept-Ranges", "bytes")
+            if compressible:
+                self.send_header("Vary", "Accept-Encoding")
+            if gzipped:
+                self.send_header("Content-Encoding", "gzip")
             self.end_headers()
-            return f
+            return (f, start, end - start + 1,)
+        except:
+            f.close()
+            raise
+
+    def is_compressible(self, ctype):
+        return ctype.startswith('text/') or ctype in COMPRESSIBLE_TYPES
+
+    def accepts_gzip(self):
+        accept_encoding = self.headers.getheader('Accept-Encoding') or ''
+        for coding in accept_encoding.split(","):
+            parts = [part.strip() for part in coding.split(";")]
+            if parts[0].lower() in ('gzip', 'x-gzip'):
+                return not "q=0" in parts and not "q=0.0" in parts
+        return False
+
+    def gzipped(self, path, f, fs, etag):
+        """
+        Returns a StringIO holding the gzipped contents of the file at path,
+        or None if the file is too large to be compressed in memory.
+        """
+        sidecar = "%s.gz" % path
+        try:
+            sidecar_mtime = os.stat(sidecar).st_mtime
+        except OSError:
+            sidecar_mtime = None
+
+        if sidecar_mtime is not None and sidecar_mtime >= fs.st_mtime:
+            with open(sidecar, 'rb') as g:
+                return StringIO.StringIO(g.read())
+
+        if fs.st_size > self.max_compress_size:
+            return None
+
+        with self.gzip_cache_lock:
+            cached = self.gzip_cache.get(path)
+        if cached and cached[0] == etag:
+            return StringIO.StringIO(cached[1])
+
+        buf = StringIO.StringIO()
+        g = gzip.GzipFile(fileobj=buf, mode='wb', mtime=0)
+        g.write(f.read())
+        g.close()
+        compressed = buf.getvalue()
+
+        with self.gzip_cache_lock:
+            if self.gzip_cache_size[0] + len(compressed) > self.max_gzip_cache_size:
+                self.gzip_cache.clear()
+                self.gzip_cache_size[0] = 0
+            previous = self.gzip_cache.pop(path, None)
+            if previous:
+                self.gzip_cache_size[0] -= len(previous[1])
+            self.gzip_cache[path] = (etag, compressed,)
+            self.gzip_cache_size[0] += len(compressed)
+        return StringIO.StringIO(compressed)
+
+    def is_not_modified(self, etag, mtime):
+        """
+        Returns True if the client's cached copy, as given by If-None-Match
+        or otherwise If-Modified-Since, is still current.
+        """
+        if_none_match = self.headers.getheader('If-None-Match')
+        if if_none_match:
+            tags = [tag.strip() for tag in if_none_match.split(",")]
+            return etag in tags or "*" in tags
+
+        if_modified_since = self.headers.getheader('If-Modified-Since')
+        if if_modified_since:
+            since = email.utils.parsedate_tz(if_modified_since)
+            if since:
+                return int(mtime) <= email.utils.mktime_tz(since)
+
+        return False
+
+    def requested_range(self, size, etag, mtime):
+        """
+        Returns (start, end) of a satisfiable single byte range request,
+        'invalid' for a range which can't be satisfied, or None to send the
+        whole file. Multiple ranges are answered with the whole file.
+        """
+        range_header = self.headers.getheader('Range')
+        if not range_header:
+            return None
+
+        if_range = self.headers.getheader('If-Range')
+        if if_range and if_range.strip() not in (etag, self.date_time_string(mtime)):
+            return None
+
+        m = RANGE_RE.match(range_header.strip())
+        if not m:
+            return None
+
+        first, last = m.groups()
+        if first:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+            if last and int(last) < start:
+                return None
+        elif last:
+            start = max(size - int(last), 0)
+            end = size - 1
+            if not int(last):
+                return 'invalid'
+        else:
+            return None
+
+        if start >= size:
+            return 'invalid'
+        return (start, end,)
 
 def serve_command(
         port=-1,
@@ -88,6 +352,11 @@ def serve_command(
     can also specify another directory to be served. The port defaults to 8085,
     this can also be customized. If a username and password are provided, uses
     HTTP auth to access pages.
+
+    Requests are handled in parallel threads with keep-alive connections,
+    unchanged files get 304 Not Modified responses, text is sent gzipped to
+    clients which accept it (using a fresh 'name.gz' file alongside if there
+    is one) and byte range requests are supported.
     """
 
     if not directory:
@@ -114,15 +383,13 @@ def serve_command(
     p = None
     for p in ports:
         try:
+            Handler = DexyHTTPRequestHandler
             if username and password:
                 import base64
                 authcode = base64.b64encode("%s:%s" % (username, password))
-                Handler = SimpleHTTPAuthRequestHandler
                 Handler.authcode = authcode
                 Handler.realm = realm
-            else:
-                Handler = SimpleHTTPServer.SimpleHTTPRequestHandler
-            httpd = SocketServer.TCPServer(("", p), Handler)
+            httpd = ThreadedHTTPServer(("", p), Handler)
         except socket.error:
             print "port %s already in use" % p
             p = None
@@ -16,19 +16,25 @@ class NullHandler(logging.Handler):
 
 RENAME_PARAMS = {
         'artifactsdir' : 'artifacts_dir',
+        'cachebackend' : 'cache_backend',
         'conf' : 'config_file',
+        'datacache' : 'data_cache_mb',
         'dbalias' : 'db_alias',
         'dbfile' : 'db_file',
         'disabletests' : 'disable_tests',
         'dryrun' : 'dry_run',
         'excludealso' : 'exclude_also',
+        'filterjobs' : 'filter_jobs',
         'ignore' : 'ignore_nonzero_exit',
+        'ingestmode' : 'ingest_mode',
         'logfile' : 'log_file',
         'logformat' : 'log_format',
         'loglevel' : 'log_level',
         'logdir' : 'log_dir',
         'nocache' : 'dont_use_cache',
-        'outputroot' : 'output_root'
+        'outputroot' : 'output_root',
+        'publishmode' : 'publish_mode',
+        'reportjobs' : 'report_jobs'
         }
 
 def default_config():
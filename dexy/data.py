@@ -1,4 +1,5 @@
 from dexy.exceptions import InternalDexyProblem
+import collections
 import dexy.plugin
 import dexy.storage
 import dexy.utils
@@ -6,7 +7,6 @@ import dexy.wrapper
 import inflection
 import os
 import posixpath
-import shutil
 import urllib
 
 class Data(dexy.plugin.Plugin):
@@ -37,7 +37,7 @@ class Data(dexy.plugin.Plugin):
 
     def add_to_lookup_sections(self):
         if self.setting('canonical-output'):
-            for section_name in self.keys():
+            for section_name in self.section_names():
                 if not section_name == '1':
                     self.wrapper.add_data_to_lookup_sections(section_name, self)
 
@@ -51,6 +51,9 @@ class Data(dexy.plugin.Plugin):
         self.update_settings(settings)
 
         self._data = None
+        self._decoded = None # (data, text) once data has been decoded, see Generic
+        self.save_deferred = False
+        self.unsaved = False
         self.state = None
         self.name = self.setting('canonical-name')
         if not self.name:
@@ -61,12 +64,34 @@ class Data(dexy.plugin.Plugin):
 
         self.transition('new')
         
+    def section_names(self):
+        """
+        Returns the names of sections, for the lookup of sections.
+        """
+        return self.keys()
+
+    def recorded_section_names(self):
+        """
+        Returns the section names recorded in the section index when the
+        data was saved, falling back to loading the data if there are none.
+        """
+        section_names = self.storage.section_names()
+        if section_names is None:
+            return self.keys()
+        else:
+            return section_names
+
     def transition(self, new_state):
         """
         Transition between states in a state machine.
         """
         dexy.utils.transition(self, new_state)
 
+    def update_settings(self, new_settings):
+        dexy.plugin.Plugin.update_settings(self, new_settings)
+        # title and output name are worked out from settings when first used
+        self._names = {}
+
     def args_to_data_init(self):
         """
         Returns tuple of attributes to pass to create_instance.
@@ -116,6 +141,8 @@ class Data(dexy.plugin.Plugin):
     def data(self):
         if (not self._data) or self._data == [{}]:
             self.load_data()
+        else:
+            self.wrapper.data_cache().touch(self)
         return self._data
 
     def load_data(self, this=None):
@@ -126,19 +153,37 @@ class Data(dexy.plugin.Plugin):
             msgargs = (self.storage.data_file(), self.key,
                     self.wrapper.state, self.state)
             raise dexy.exceptions.InternalDexyProblem(msg % msgargs)
+        self._decoded = None
+        self.wrapper.data_cache().add(self)
 
     def clear_data(self):
         self._data = None
+        self._decoded = None
+        self.wrapper.data_cache().remove(self)
+
+    def loaded_size(self):
+        """
+        Returns the size of contents loaded in memory which can be released,
+        see dexy.data_cache, or None.
+        """
+        return None
+
+    def is_releasable(self):
+        """
+        Whether loaded contents can be dropped from memory and read back from
+        the cache when next used.
+        """
+        return False
 
     def clear_cache(self):
         self._size = None
-        try:
-            os.remove(self.storage.data_file())
-        except os.error as e:
-            self.wrapper.log.warn(unicode(e))
+        if self.storage.is_packed():
+            self.wrapper.pack().remove(self.storage.data_filename())
+        else:
+            self.storage.remove_data_file()
 
     def copy_from_file(self, filename):
-        shutil.copyfile(filename, self.storage.data_file())
+        self.storage.copy_from_file(filename)
 
     def output_to_file(self, filepath):
         """
@@ -147,21 +192,52 @@ class Data(dexy.plugin.Plugin):
         if not self.storage.copy_file(filepath):
             self.storage.write_data(self.data(), filepath)
 
+    def publish_to_file(self, filepath):
+        """
+        Write canonical output to a file in a report dir, linking instead of
+        copying if the wrapper's publish mode allows it.
+        """
+        if not self.storage.publish_file(filepath):
+            if os.path.lexists(filepath):
+                os.remove(filepath)
+            self.storage.write_data(self.data(), filepath)
+
     def has_data(self):
         has_loaded_data = (self._data) and (self._data != [{}])
         return has_loaded_data or self.is_cached()
 
     def set_data(self, data):
         """
-        Shortcut to set and save data.
+        Shortcut to set and save data. While saving is deferred, data is only
+        kept in memory until flush() is called.
         """
         self._data = data
-        self.save()
+        self._decoded = None
+        # empty data is saved now, as data() reads it back from the cache
+        if self.save_deferred and data:
+            self.unsaved = True
+        else:
+            self.save()
+        self.wrapper.data_cache().add(self)
+
+    def defer_save(self):
+        """
+        Keeps data passed to set_data in memory instead of saving it, for
+        data which is only read in memory until the doc has finished running.
+        """
+        self.save_deferred = True
+
+    def flush(self):
+        """
+        Saves data set while saving was deferred.
+        """
+        self.save_deferred = False
+        if self.unsaved:
+            self.unsaved = False
+            self.save()
 
-    def is_cached(self, this=None):
-        if this is None:
-            this = (self.wrapper.state in ('walked', 'running'))
-        return self.storage.data_file_exists(this)
+    def is_cached(self):
+        return self.storage.data_file_exists()
 
     # Filename-related Attributes
 
@@ -217,6 +293,11 @@ class Data(dexy.plugin.Plugin):
 
         Tries to guess from document name if `title` setting not provided.
         """
+        if not 'title' in self._names:
+            self._names['title'] = self.calculate_title()
+        return self._names['title']
+
+    def calculate_title(self):
         if self.setting('title'):
             return self.setting('title')
 
@@ -261,6 +342,11 @@ class Data(dexy.plugin.Plugin):
         Canonical name to output to, relative to output root. Returns None if
         artifact not in output_root.
         """
+        if not 'output-name' in self._names:
+            self._names['output-name'] = self.calculate_output_name()
+        return self._names['output-name']
+
+    def calculate_output_name(self):
         output_root = self.wrapper.output_root
 
         def relativize(path):
@@ -281,13 +367,11 @@ class Data(dexy.plugin.Plugin):
         """
         return os.path.dirname(self.output_name())
         
-    def filesize(self, this=None):
+    def filesize(self):
         """
         Returns size of file stored on disk.
         """
-        if this is None:
-            this = (self.wrapper.state in ('walked', 'running'))
-        return self.storage.data_file_size(this)
+        return self.storage.data_file_size()
 
     def is_canonical_output(self):
         """
@@ -322,6 +406,16 @@ class Generic(Data):
     """
     aliases = ['generic']
 
+    def loaded_size(self):
+        if isinstance(self._data, basestring):
+            if self._decoded:
+                return len(self._data) + len(self._decoded[1])
+            else:
+                return len(self._data)
+
+    def is_releasable(self):
+        return not self.unsaved
+
     def save(self):
         if isinstance(self._data, unicode):
             self.storage.write_data(self._data.encode("utf-8"))
@@ -332,12 +426,44 @@ class Generic(Data):
             self.storage.write_data(self._data)
 
     def __unicode__(self):
-        if isinstance(self.data(), unicode):
-            return self.data()
-        elif not self.data():
+        data = self.data()
+        if isinstance(data, unicode):
+            return data
+        elif not data:
             return unicode(None)
+        elif self._decoded and self._decoded[0] is data:
+            return self._decoded[1]
         else:
-            return self.wrapper.decode_encoded(self.data())
+            text = self.decode(data)
+            self._decoded = (data, text,)
+            self.wrapper.data_cache().add(self)
+            return text
+
+    def decode(self, data):
+        """
+        Decodes bytes of data. When detecting encodings with chardet, the
+        encoding detected for a data file is kept until the file changes.
+        """
+        if self.wrapper.encoding != 'chardet':
+            return self.wrapper.decode_encoded(data)
+
+        stamp = None
+        if not self.unsaved:
+            try:
+                stamp = self.storage.data_file_stamp()
+            except KeyError:
+                pass
+
+        store = self.wrapper.runtime_info_store()
+        encoding = None
+        if stamp:
+            encoding = store.detected_encoding(self.storage_key, stamp)
+
+        text, encoding = self.wrapper.decode_detected(data, encoding)
+
+        if stamp:
+            store.set_detected_encoding(self.storage_key, stamp, encoding)
+        return text
 
     def iteritems(self):
         """
@@ -403,6 +529,33 @@ class Generic(Data):
         """
         return self.from_json()
 
+class DataSet(object):
+    """
+    Ordered set of data objects in which data objects with the same storage
+    key are the same data, used for lookups of docs and sections.
+    """
+    def __init__(self):
+        self.datas = collections.OrderedDict()
+
+    def add(self, data):
+        if not data.storage_key in self.datas:
+            self.datas[data.storage_key] = data
+
+    def __contains__(self, data):
+        return data.storage_key in self.datas
+
+    def __len__(self):
+        return len(self.datas)
+
+    def __iter__(self):
+        return self.datas.itervalues()
+
+    def __getitem__(self, index):
+        return self.datas.values()[index]
+
+    def __repr__(self):
+        return "DataSet(%r)" % self.datas.values()
+
 class SectionValue(object):
     def __init__(self, data, parent, parentindex):
         assert isinstance(data, dict)
@@ -476,6 +629,16 @@ class Sectioned(Data):
     def keys(self):
         return [a['name'] for a in self.data()[1:]]
 
+    def section_names(self):
+        """
+        Returns the names of sections without loading the data, if they were
+        recorded in the section index when the data was saved.
+        """
+        if self._data and self._data != [{}]:
+            return self.keys()
+        else:
+            return self.recorded_section_names()
+
     def values(self):
         return [SectionValue(a, self, i) for i, a in enumerate(self.data()[1:])]
 
@@ -486,6 +649,15 @@ class Sectioned(Data):
         with open(filepath, "wb") as f:
             f.write(unicode(self).encode("utf-8"))
 
+    def publish_to_file(self, filepath):
+        """
+        Write canonical output to a file in a report dir. This is generated
+        from the structured data so is never linked.
+        """
+        if os.path.lexists(filepath):
+            os.remove(filepath)
+        self.output_to_file(filepath)
+
     def keyindex(self, key):
         if self._data == [{}]:
             return -1
@@ -571,6 +743,13 @@ class KeyValue(Data):
     def keys(self):
         return self.storage.keys()
 
+    def section_names(self):
+        """
+        Returns the keys without querying the data, if they were recorded in
+        the section index when the data was saved.
+        """
+        return self.recorded_section_names()
+
     def items(self):
         """
         List of available keys.
@@ -0,0 +1,106 @@
+import collections
+import dexy.doc
+
+class DataCache(object):
+    """
+    Limits the memory used by loaded Data contents during a run.
+
+    Data whose contents are loaded or set is tracked in least recently used
+    order, and the least recently used contents are dropped when the total
+    size goes over the wrapper's data_cache_mb. Contents of a doc are also
+    dropped as soon as the doc and every doc which has it as an input have
+    run. Dropped contents are read back from the cache if used again.
+    """
+    def __init__(self, wrapper):
+        self.wrapper = wrapper
+        self.loaded = collections.OrderedDict()
+        self.total = 0
+        self.consumers = {}
+        self.inputs = {}
+
+    def max_size(self):
+        return self.wrapper.data_cache_mb * 1024 * 1024
+
+    def add(self, data):
+        """
+        Records that the contents of data have been loaded or set, then drops
+        least recently used contents if over budget.
+        """
+        self.remove(data)
+        size = data.loaded_size()
+        if size:
+            self.loaded[data] = size
+            self.total += size
+            self.evict()
+
+    def touch(self, data):
+        size = self.loaded.pop(data, None)
+        if size is not None:
+            self.loaded[data] = size
+
+    def remove(self, data):
+        size = self.loaded.pop(data, None)
+        if size is not None:
+            self.total -= size
+
+    def evict(self):
+        """
+        Drops least recently used contents until the total size is within
+        budget, never dropping the most recently used data.
+        """
+        max_size = self.max_size()
+        if self.total <= max_size or len(self.loaded) < 2:
+            return
+
+        # release() removes entries, so pick them before releasing any
+        newest = next(reversed(self.loaded))
+        releasable = []
+        excess = self.total - max_size
+        for data in iter(self.loaded):
+            if excess <= 0 or data is newest:
+                break
+            if data.is_releasable():
+                releasable.append(data)
+                excess -= self.loaded[data]
+
+        for data in releasable:
+            self.release(data)
+
+    def release(self, data):
+        if data.is_releasable():
+            self.remove(data)
+            data.clear_data()
+
+    def count_consumers(self, nodes):
+        """
+        Counts, for each doc, the docs about to run which read it, including
+        the doc itself.
+        """
+        self.consumers = {}
+        self.inputs = {}
+        for node in nodes:
+            if isinstance(node, dexy.doc.Doc) and node.state == 'uncached':
+                inputs = list(node.walk_input_docs())
+                self.inputs[node] = inputs
+                for doc in [node] + inputs:
+                    self.consumers[doc] = self.consumers.get(doc, 0) + 1
+
+    def doc_ran(self, doc):
+        """
+        Called when doc has run, releases the contents of doc and its inputs
+        if no other doc which reads them is still to run.
+        """
+        for consumed in [doc] + self.inputs.pop(doc, []):
+            if not consumed in self.consumers:
+                continue
+            self.consumers[consumed] -= 1
+            if self.consumers[consumed] == 0:
+                del self.consumers[consumed]
+                for data in consumed.datas():
+                    self.release(data)
+
+    def clear(self):
+        self.loaded.clear()
+        self.total = 0
+        self.consumers = {}
+        self.inputs = {}
@@ -2,7 +2,6 @@ import dexy.exceptions
 import dexy.filter
 import dexy.node
 import os
-import shutil
 import stat
 import time
 
@@ -157,14 +156,12 @@ class Doc(dexy.node.Node):
         if self.state == 'cached':
             self.setup_datas()
 
-            # move cache files to new cache
-            for d in self.datas():
-                if os.path.exists(d.storage.last_data_file()):
-                    shutil.move(d.storage.last_data_file(), d.storage.this_data_file())
-                    self.log_debug("Moving %s from %s to %s" % (d.key, d.storage.last_data_file(), d.storage.this_data_file()))
-
-            if os.path.exists(self.runtime_info_filename(False)):
-                shutil.move(self.runtime_info_filename(False), self.runtime_info_filename(True))
+            # cache files stay where they are, only packed entries need to be
+            # moved to this run's generation
+            pack = self.wrapper.pack()
+            if pack:
+                for d in self.datas():
+                    pack.move_to_this(d.storage.data_filename())
 
             self.apply_runtime_info()
 
@@ -173,6 +170,18 @@ class Doc(dexy.node.Node):
                     d.storage.connect()
             self.transition('consolidated')
 
+        elif self.state == 'uncached':
+            # Remove data cached by previous runs so it isn't mistaken for
+            # output of this run. Initial data from an unchanged file is
+            # still valid.
+            self.setup_datas()
+            stale = [f.output_data for f in self.filters]
+            if not self.name in self.wrapper.filemap:
+                stale.append(self.initial_data)
+            for d in stale:
+                d.storage.remove_data_file()
+            self.wrapper.runtime_info_store().remove_runtime_info(self.hashid)
+
     def apply_runtime_info(self):
             runtime_info = self.load_runtime_info()
             if runtime_info:
@@ -206,10 +215,7 @@ class Doc(dexy.node.Node):
             if d.state == 'new':
                 d.setup()
 
-        return all(
-                os.path.exists(d.storage.last_data_file()) or
-                os.path.exists(d.storage.this_data_file())
-                for d in self.datas())
+        return all(d.storage.data_file_exists() for d in self.datas())
 
     def check_doc_changed(self):
         if self.name in self.wrapper.filemap:
@@ -217,18 +223,18 @@ class Doc(dexy.node.Node):
 
             self.initial_data.setup()
 
-            in_this_cache = os.path.exists(self.initial_data.storage.this_data_file())
-            in_last_cache = os.path.exists(self.initial_data.storage.last_data_file())
+            storage = self.initial_data.storage
+            if storage.data_file_exists():
+                if storage.is_linked_to(live_stat):
+                    # cached file was hard linked to the source when ingested,
+                    # so edits made in place change both
+                    changed = self.wrapper.ingest_index().changed(storage.data_filename(), live_stat)
+                    self.log_debug("    cache is hard link to source, changed %s" % changed)
+                    return changed
 
-            if in_this_cache or in_last_cache:
                 # we have a file in the cache from a previous run, compare its
                 # mtime to filemap to determine whether it has changed
-                if in_this_cache:
-                    cache_stat = os.stat(self.initial_data.storage.this_data_file())
-                else:
-                    cache_stat = os.stat(self.initial_data.storage.last_data_file())
-
-                cache_mtime = cache_stat[stat.ST_MTIME]
+                cache_mtime = storage.data_file_mtime()
                 live_mtime = live_stat[stat.ST_MTIME]
                 msg = "    cache mtime %s live mtime %s now %s changed (live gt cache) %s"
                 msgargs = (cache_mtime, live_mtime, time.time(), live_mtime > cache_mtime)
@@ -260,10 +266,6 @@ class Doc(dexy.node.Node):
         return contents
 
     # Runtime Info
-    def runtime_info_filename(self, this=True):
-        name = "%s.runtimeargs.pickle" % self.hashid
-        return os.path.join(self.initial_data.storage.storage_dir(this), name)
-
     def save_runtime_info(self):
         """
         Save runtime changes to metadata so they can be reapplied when node has
@@ -275,31 +277,10 @@ class Doc(dexy.node.Node):
             'additional-docs' : self.additional_doc_info()
             }
 
-        with open(self.runtime_info_filename(), 'wb') as f:
-            pickle = self.wrapper.pickle_lib()
-            pickle.dump(info, f)
+        self.wrapper.runtime_info_store().set_runtime_info(self.hashid, info)
 
     def load_runtime_info(self):
-        info = None
-
-        # Load from 'this' first
-        try:
-            with open(self.runtime_info_filename(), 'rb') as f:
-                pickle = self.wrapper.pickle_lib()
-                info = pickle.load(f)
-        except IOError:
-            pass
-
-        # Load from 'last' if there's nothing in 'this'
-        if not info:
-            try:
-                with open(self.runtime_info_filename(False), 'rb') as f:
-                    pickle = self.wrapper.pickle_lib()
-                    info = pickle.load(f)
-            except IOError:
-                pass
-
-        return info
+        return self.wrapper.runtime_info_store().runtime_info(self.hashid)
 
     def run(self):
         if self.wrapper.directory != '.':
@@ -320,16 +301,45 @@ class Doc(dexy.node.Node):
             else:
                 self.initial_data.set_data(self.get_contents())
 
-        for f in self.filters:
+        if self.wrapper.filter_pool:
+            outputs = self.wrapper.filter_pool.outputs(self)
+        else:
+            outputs = []
+
+        deferred = []
+        for i, f in enumerate(self.filters):
             f.start_time = time.time()
             if f.output_data.state == 'new':
                 f.output_data.setup()
             if hasattr(f.output_data.storage, 'connect'):
                 f.output_data.storage.connect()
-            f.process()
+
+            if f.next_filter and f.next_filter.can_run_ahead():
+                # The next filter only reads this output as text, so hand it
+                # over in memory and save it once the whole chain has run.
+                f.output_data.defer_save()
+
+            work_key = f.work_key()
+            same_work = self.wrapper.work_outputs.get(work_key)
+            if same_work and f.output_data.storage.link_from(same_work.storage):
+                f.log_debug("reusing output of %s" % same_work.key)
+            elif i < len(outputs):
+                f.output_data.set_data(outputs[i])
+            else:
+                f.process()
+
+            if f.output_data.save_deferred:
+                deferred.append((f, work_key, same_work,))
+            else:
+                self.sync_filter_output(f, work_key, same_work)
+
             f.finish_time = time.time()
             f.elapsed = f.finish_time - f.start_time
 
+        for f, work_key, same_work in deferred:
+            f.output_data.flush()
+            self.sync_filter_output(f, work_key, same_work)
+
         self.finish_time = time.time()
         self.elapsed_time = self.finish_time - self.start_time
         self.wrapper.batch.add_doc(self)
@@ -341,6 +351,17 @@ class Doc(dexy.node.Node):
             for task in doc:
                 task()
 
+        self.wrapper.data_cache().doc_ran(self)
+
+    def sync_filter_output(self, f, work_key, same_work):
+        """
+        Updates the cache after the output of filter f has been saved, and
+        makes it available to docs doing the same work.
+        """
+        f.output_data.storage.sync_data_file()
+        if work_key and not same_work:
+            self.wrapper.work_outputs[work_key] = f.output_data
+
     def output_data(self):
         """
         Returns a reference to the final data object for this document.
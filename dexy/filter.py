@@ -1,5 +1,6 @@
 from dexy.utils import copy_or_link
 from dexy.utils import os_to_posix
+from dexy.version import DEXY_VERSION
 from operator import attrgetter
 import dexy.doc
 import dexy.exceptions
@@ -66,6 +67,11 @@ class Filter(dexy.plugin.Plugin):
             'mkdirs' : (
                 "A list of directories which should be created in working dir.",
                 []),
+            'needs-workspace' : (
+                """Whether the filter needs input docs to be available in its
+                working dir. If False, only the filter's own input is written
+                to the working dir.""",
+                True),
             'nodoc' : (
                 "Whether filter should be excluded from documentation.",
                 False),
@@ -82,6 +88,11 @@ class Filter(dexy.plugin.Plugin):
             'preserve-prior-data-class' : (
                 "Whether output data class should be set to match the input data class.",
                 False),
+            'pure' : (
+                """Whether process_text output depends only on the input text
+                and settings, with no side effects such as adding docs, so it
+                can be run ahead of time in a worker process.""",
+                False),
             'require-output' : (
                 "Should dexy raise an exception if no output is produced by this filter?",
                 True),
@@ -277,6 +288,20 @@ class Filter(dexy.plugin.Plugin):
         """
         pass
 
+    def can_run_ahead(self):
+        """
+        Whether this filter's output can be computed from the text of its
+        input alone, see DexyFilter.
+        """
+        return False
+
+    def work_key(self):
+        """
+        Returns a digest identifying the work done by process(), so docs doing
+        identical work can share one output, or None if it can't be known.
+        """
+        return None
+
     def calculate_canonical_name(self):
         name_without_ext = posixpath.splitext(self.doc.name)[0]
         return "%s%s" % (name_without_ext, self.ext)
@@ -501,8 +526,13 @@ class Filter(dexy.plugin.Plugin):
 
         self.makedirs()
 
-        self.log_debug("input docs %s" % list(self.doc.walk_input_docs()))
-        for inpt in self.doc.walk_input_docs():
+        if self.setting('needs-workspace'):
+            input_docs = list(self.doc.walk_input_docs())
+        else:
+            input_docs = []
+
+        self.log_debug("input docs %s" % input_docs)
+        for inpt in input_docs:
             if not self.include_input_in_workspace(inpt):
                 self.log_debug("not populating workspace with input '%s'" % inpt.key)
                 continue
@@ -581,6 +611,49 @@ class DexyFilter(Filter):
         else:
             self.output_data.copy_from_file(self.input_data.storage.data_file())
 
+    def can_run_ahead(self):
+        """
+        Whether this filter's output can be computed in a worker process from
+        the text of its input, see dexy.filter_pool.
+        """
+        return (self.setting('pure') and
+                hasattr(self, 'process_text') and
+                self.__class__.process.im_func is DexyFilter.process.im_func and
+                self.output_data.alias == 'generic')
+
+    def work_key(self):
+        """
+        Returns a digest of everything which determines the output of a
+        filter which can run ahead: its input bytes, the filter aliases
+        leading to it, its settings and its code version. Docs with the same
+        work key can share one output. Returns None for other filters.
+        """
+        if not self.can_run_ahead() or self.input_data.alias != 'generic':
+            return None
+
+        # input may not be saved yet, see Doc.run
+        input_bytes = self.input_data.data()
+        if isinstance(input_bytes, unicode):
+            input_bytes = input_bytes.encode("utf-8")
+
+        aliases = []
+        f = self
+        while f:
+            aliases.insert(0, f.alias)
+            f = f.prev_filter
+
+        work = [
+                DEXY_VERSION,
+                self.__class__.__module__,
+                self.__class__.__name__,
+                "|".join(aliases),
+                self.input_data.ext,
+                self.ext,
+                repr(sorted(self.setting_values().items())),
+                dexy.utils.md5_hash(input_bytes)
+                ]
+        return dexy.utils.md5_hash("\n".join(work))
+
 class AliasFilter(DexyFilter):
     """
     Filter to be used when an Alias is specified. Should not change input.
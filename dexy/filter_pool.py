@@ -0,0 +1,142 @@
+import dexy.doc
+import multiprocessing
+import os
+import traceback
+
+forked_wrapper = None
+
+def init_forked_worker():
+    forked_wrapper.after_fork()
+
+def run_ahead_in_forked_worker(doc_key, n, input_text):
+    """
+    Runs the first n filters of a doc, which can all run ahead, on
+    input_text. Returns a tuple of the list of outputs and None, or of the
+    outputs computed before an error and a tuple of (error message,
+    traceback).
+    """
+    outputs = []
+    try:
+        doc = forked_wrapper.nodes[doc_key]
+        text = input_text
+        for f in doc.filters[0:n]:
+            if not isinstance(text, unicode):
+                text = forked_wrapper.decode_encoded(text)
+            text = f.process_text(text)
+            outputs.append(text)
+            if not text:
+                # an empty output is read back by the next filter as u'None'
+                break
+        return (outputs, None,)
+    except Exception as e:
+        message = getattr(e, 'message', None) or unicode(e)
+        error = ("%s: %s" % (e.__class__.__name__, message), traceback.format_exc(),)
+        return (outputs, error,)
+
+class FilterPool(object):
+    """
+    Runs filters declared as pure ahead of time in a pool of forked worker
+    processes, so that docs whose first filters only transform text are
+    processed in parallel while the main process works through the run.
+
+    Outputs are only used when the doc reaches those filters, errors are
+    left for the filter to raise again when it runs normally.
+    """
+    def __init__(self, wrapper):
+        self.wrapper = wrapper
+        self.pool = None
+        self.results = {}
+
+    def start(self, nodes):
+        global forked_wrapper
+
+        jobs = []
+        for doc in self.docs_to_run(nodes):
+            n = self.run_ahead_count(doc)
+            if n:
+                input_text = self.input_text(doc)
+                if input_text:
+                    jobs.append((doc.key_with_class(), n, input_text,))
+
+        if not jobs:
+            return
+
+        msg = "running pure filters for %s docs ahead using %s processes"
+        self.wrapper.log.debug(msg % (len(jobs), self.wrapper.filter_jobs))
+
+        forked_wrapper = self.wrapper
+        self.pool = multiprocessing.Pool(self.wrapper.filter_jobs, init_forked_worker)
+        forked_wrapper = None
+
+        for job in jobs:
+            self.results[job[0]] = self.pool.apply_async(run_ahead_in_forked_worker, job)
+        self.pool.close()
+
+    def docs_to_run(self, nodes):
+        seen = set()
+        nodes = list(nodes)
+        while nodes:
+            node = nodes.pop()
+            if node in seen:
+                continue
+            seen.add(node)
+            nodes.extend(node.input_nodes(True))
+            if isinstance(node, dexy.doc.Doc) and node.state == 'uncached':
+                yield node
+
+    def run_ahead_count(self, doc):
+        """
+        Returns the number of filters at the start of the doc's filter chain
+        which can run ahead.
+        """
+        n = 0
+        for f in doc.filters:
+            if not f.can_run_ahead():
+                break
+            n += 1
+        return n
+
+    def input_text(self, doc):
+        """
+        Returns the raw input which the doc's first filter will read, or None
+        if it can't be known before the doc runs.
+        """
+        if doc.initial_data.alias != 'generic':
+            return None
+        elif doc.name in self.wrapper.filemap:
+            with open(self.wrapper.filemap[doc.name]['ospath'], 'rb') as f:
+                return f.read()
+        else:
+            contents = doc.get_contents()
+            if contents != 'dummy contents':
+                return contents
+
+    def outputs(self, doc):
+        """
+        Returns the list of outputs computed ahead of time for the first
+        filters of doc, which may be empty.
+        """
+        result = self.results.pop(doc.key_with_class(), None)
+        if result is None:
+            return []
+
+        outputs, error = result.get()
+        if error:
+            message, tb = error
+            doc.log_debug("error running filters ahead: %s\n%s" % (message, tb))
+        return outputs
+
+    def stop(self):
+        if self.pool:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+        self.results = {}
+
+def create_filter_pool(wrapper):
+    """
+    Returns a FilterPool if the wrapper is configured to run pure filters in
+    more than one process, otherwise None.
+    """
+    if wrapper.filter_jobs > 1 and hasattr(os, 'fork'):
+        return FilterPool(wrapper)
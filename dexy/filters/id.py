@@ -1,6 +1,5 @@
 from dexy.exceptions import UserFeedback, InternalDexyProblem
 from dexy.filters.pyg import PygmentsFilter
-from pygments import highlight
 import ply.lex as lex
 import ply.yacc as yacc
 
@@ -93,6 +92,7 @@ class Id(PygmentsFilter):
             else:
                 do_highlight = True
 
+        highlight = self.doc.wrapper.highlight_cache().highlight
         for section in parser_output:
             if do_highlight:
                 section['contents'] = highlight(section['contents'], pyg_lexer, pyg_formatter)
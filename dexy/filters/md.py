@@ -24,6 +24,7 @@ class MarkdownFilter(DexyFilter):
             'examples' : ['markdown'],
             'input-extensions' : ['.*'],
             'output-extensions' : ['.html'],
+            'pure' : True,
             'extensions' : ("Which Markdown extensions to enable.", { 'toc' : {} }),
             }
 
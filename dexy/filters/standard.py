@@ -12,6 +12,7 @@ class Resub(DexyFilter):
     """
     aliases = ['resub']
     _settings = {
+            'pure' : True,
             'expressions' : ("Tuples of (regexp, replacement) to apply.", []),
             }
 
@@ -143,6 +144,7 @@ class MarkupTagsFilter(DexyFilter):
     """
     aliases = ['tags']
     _settings = {
+            'pure' : True,
             'tags' : ("Tags.", {})
             }
 
@@ -243,6 +245,7 @@ class PrettyPrintJsonFilter(DexyFilter):
     """
     aliases = ['ppjson']
     _settings = {
+            'pure' : True,
             'output-extensions' : ['.json']
             }
 
@@ -269,6 +272,9 @@ class HeadFilter(DexyFilter):
     Returns just the first 10 lines of input.
     """
     aliases = ['head']
+    _settings = {
+            'pure' : True
+            }
 
     def process_text(self, input_text):
         return "\n".join(input_text.split("\n")[0:10]) + "\n"
@@ -280,6 +286,7 @@ class WordWrapFilter(DexyFilter):
     """
     aliases = ['ww', 'wrap']
     _settings = {
+            'pure' : True,
             'width' : ("Width of text to wrap to.", 79)
             }
 
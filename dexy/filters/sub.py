@@ -109,6 +109,7 @@ class TidyCheck(SubprocessFilter):
         'tags' : ['html'],
         'executable' : 'tidy',
         'command-string' : '%(prog)s -errors -quiet "%(script_file)s"',
+        'needs-workspace' : False,
         'input-extensions' : ['.html'],
         'output-extensions' : ['.txt']
         }
@@ -131,6 +132,7 @@ class PdfToCairo(SubprocessFormatFlagFilter):
     _settings = {
         'command-string': '%(prog)s %(format)s %(args)s "%(script_file)s" "%(output_file)s"',
         'executable': 'pdftocairo',
+        'needs-workspace' : False,
         'tags' : ['pdf', 'image'],
         'input-extensions' : ['.pdf'],
         'output-extensions' : ['.svg', '.png', '.jpg', '.ps', '.eps', '.pdf'],
@@ -177,6 +179,7 @@ class Pdf2ImgSubprocessFilter(SubprocessExtToFormatFilter):
             'res' : ("Resolution of image.", 300),
             'page' : ("Which page of the PDF to return as an image", 1),
             'executable' : 'gs',
+            'needs-workspace' : False,
             'version-command' : 'gs --version',
             'tags' : ['pdf', 'gs'],
             'input-extensions' : ['.pdf'],
@@ -63,7 +63,7 @@ class TemplateFilter(DexyFilter):
         env = {}
         for plugin in self.template_plugins():
             self.log_debug("Running template plugin %s" % plugin.__class__.__name__)
-            new_env_vars = plugin.run()
+            new_env_vars = plugin.run_cached(self.doc.wrapper.template_plugin_output)
             if new_env_vars is None:
                 msg = "%s did not return any values"
                 raise dexy.exceptions.InternalDexyProblem(msg % plugin.alias)
@@ -145,7 +145,7 @@ class JinjaFilter(TemplateFilter):
             'comment_end_string': '#>>'
             }
 
-    def setup_jinja_env(self, loader=None):
+    def jinja_env_attrs(self):
         env_attrs = {}
 
         for k, v in self.setting_values().iteritems():
@@ -169,6 +169,12 @@ class JinjaFilter(TemplateFilter):
                     self.log_debug("setting %s to %s" % (underscore_k, v))
                     env_attrs[underscore_k] = v
 
+        return env_attrs
+
+    def setup_jinja_env(self, loader=None):
+        env_attrs = self.jinja_env_attrs()
+        env_attrs['bytecode_cache'] = self.doc.wrapper.jinja_bytecode_cache()
+
         if loader:
             env_attrs['loader'] = loader
 
@@ -176,6 +182,23 @@ class JinjaFilter(TemplateFilter):
         self.log_debug("creating jinja2 environment with: %s" % debug_attr_string)
         return jinja2.Environment(**env_attrs)
 
+    def shared_jinja_env(self):
+        """
+        Returns a jinja environment, with template filters, which is shared by
+        all docs using the same jinja settings during this run.
+        """
+        key = repr((sorted(self.jinja_env_attrs().iteritems()), self.setting('filters'),))
+        environments = self.doc.wrapper.jinja_environments
+
+        if not key in environments:
+            self.log_debug("setting up jinja environment")
+            env = self.setup_jinja_env()
+            self.log_debug("setting up jinja template filters")
+            env.filters.update(self.jinja_template_filters())
+            environments[key] = env
+
+        return environments[key]
+
     def handle_jinja_exception(self, e, input_text, template_data):
         result = []
         input_lines = input_text.splitlines()
@@ -238,7 +261,7 @@ class JinjaFilter(TemplateFilter):
                 self.log_debug("    skipping %s - not active" % alias)
                 continue
         
-            methods = template_plugin.run()
+            methods = template_plugin.run_cached(self.doc.wrapper.template_plugin_output)
 
             for k, v in methods.iteritems():
                 if not k in template_plugin.setting('no-jinja-filter'):
@@ -257,10 +280,7 @@ class JinjaFilter(TemplateFilter):
         self.log_debug("setting up jinja FileSystemLoader with dirs %s" % ", ".join(dirs))
         loader = FileSystemLoader(dirs)
 
-        self.log_debug("setting up jinja environment")
-        env = self.setup_jinja_env(loader=loader)
-        self.log_debug("setting up jinja template filters")
-        env.filters.update(self.jinja_template_filters())
+        env = self.shared_jinja_env().overlay(loader=loader)
 
         self.log_debug("initializing template")
 
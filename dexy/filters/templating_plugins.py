@@ -6,6 +6,7 @@ from dexy.plugin import TemplatePlugin
 from dexy.utils import levenshtein
 from dexy.version import DEXY_VERSION
 from pygments.styles import get_all_styles
+import bisect
 import calendar
 import dexy.commands
 import dexy.commands.cite
@@ -31,6 +32,9 @@ class Etree(TemplatePlugin):
     Exposes element tree as ET.
     """
     aliases = ['etree']
+    _settings = {
+            'scope' : 'run'
+            }
     def run(self):
         return { 'ET' : ("The xml.etree.ElementTree module.", ET,) }
 
@@ -39,13 +43,22 @@ class Markdown(TemplatePlugin):
     Exposes markdown.
     """
     aliases = ['md', 'markdown']
+    _settings = {
+            'scope' : 'run'
+            }
 
     def run(self):
         md = markdown.Markdown()
+
+        def convert(text):
+            # reset so reference links and other state don't carry over
+            # between the docs sharing this instance
+            return md.reset().convert(text)
+
         h = "Function which converts markdown to HTML."
         return {
-                'markdown' : (h, md.convert),
-                'md' : (h, md.convert)
+                'markdown' : (h, convert),
+                'md' : (h, convert)
                 }
 
 class Uuid(TemplatePlugin):
@@ -53,6 +66,9 @@ class Uuid(TemplatePlugin):
     Exposes the UUID module.
     """
     aliases = ['uuid']
+    _settings = {
+            'scope' : 'run'
+            }
     def run(self):
         return { 'uuid' : ("The Python uuid module. http://docs.python.org/2/library/uuid.html", uuid) }
 
@@ -61,6 +77,9 @@ class Time(TemplatePlugin):
     Exposes time module.
     """
     aliases = ['time']
+    _settings = {
+            'scope' : 'run'
+            }
     def run(self):
         return { 'time' : ("The Python time module.", time) }
 
@@ -69,6 +88,9 @@ class Operator(TemplatePlugin):
     Exposes features of the operator module.
     """
     aliases = ['operator']
+    _settings = {
+            'scope' : 'run'
+            }
     keys = ['attrgetter', 'itemgetter']
     def run(self):
         d = {}
@@ -83,6 +105,7 @@ class PrettyPrintHtml(TemplatePlugin):
     """
     aliases = ['bs4']
     _settings = {
+            'scope' : 'run',
             'no-jinja-filter' : ['BeautifulSoup']
             }
 
@@ -101,6 +124,9 @@ class LoadYaml(TemplatePlugin):
     Loads YAML from a file.
     """
     aliases = ['loadyaml']
+    _settings = {
+            'scope' : 'run'
+            }
 
     def load_yaml(self, filename):
         import yaml
@@ -117,6 +143,9 @@ class ParseYaml(TemplatePlugin):
     Parse YAML from a string.
     """
     aliases = ['parseyaml']
+    _settings = {
+            'scope' : 'run'
+            }
 
     def parse_yaml(self, yamltext):
         import yaml
@@ -161,6 +190,9 @@ class Bibtex(TemplatePlugin):
     """
     Produces a bibtex entry for dexy.
     """
+    _settings = {
+            'scope' : 'run'
+            }
     def run(self):
         return { 'dexy_bibtex' : dexy.commands.cite.bibtex_text() }
 
@@ -170,6 +202,7 @@ class Inflection(TemplatePlugin):
     """
     aliases = ['inflection']
     _settings = {
+            'scope' : 'run',
             'methods' : ("Methods of the inflection module to expose.",
                 ['camelize', 'dasherize', 'humanize', 'ordinal',
                 'ordinalize', 'parameterize', 'pluralize', 'singularize',
@@ -185,6 +218,7 @@ class StripJavadocHTML(TemplatePlugin):
     """
     aliases = ['stripjavadochtml']
     _settings = {
+            'scope' : 'run',
             'escape' : ("Escape characters.", ['\\']),
             'remove' : ("Remove characters.", ['<p>', '<P>'])
             }
@@ -208,6 +242,9 @@ class PrettyPrint(TemplatePlugin):
     Exposes pprint (really pformat).
     """
     aliases = ['pp', 'pprint']
+    _settings = {
+            'scope' : 'run'
+            }
 
     def run(self):
         import pprint
@@ -221,6 +258,9 @@ class PrettyPrintJson(TemplatePlugin):
     Exposes ppjson command.
     """
     aliases = ['ppjson']
+    _settings = {
+            'scope' : 'run'
+            }
 
     def ppjson(self, json_string):
         return json.dumps(json.loads(json_string), sort_keys = True, indent = 4)
@@ -235,6 +275,9 @@ class ReplaceJinjaFilters(TemplatePlugin):
     Replace some jinja filters so they call unicode() first.
     """
     aliases = ['replacejinjafilters']
+    _settings = {
+            'scope' : 'run'
+            }
 
     def do_indent(self, data, width=4, indentfirst=False):
         return jinja2.filters.do_indent(unicode(data), width, indentfirst)
@@ -346,6 +389,9 @@ class Head(TemplatePlugin):
     Provides a 'head' method.
     """
     aliases = ['head']
+    _settings = {
+            'scope' : 'run'
+            }
 
     def head(self, text, n=15):
         """
@@ -363,6 +409,9 @@ class Tail(TemplatePlugin):
     Provides a 'tail' method.
     """
     aliases = ['tail']
+    _settings = {
+            'scope' : 'run'
+            }
 
     def tail(self, text, n=15):
         """
@@ -380,6 +429,9 @@ class RstCode(TemplatePlugin):
     Indents code n spaces (defaults to 4) and wraps in .. code:: directive.
     """
     aliases = ['rstcode']
+    _settings = {
+            'scope' : 'run'
+            }
 
     def rstcode(self, text, n=4, language='python'):
         output = inspect.cleandoc("""
@@ -398,6 +450,9 @@ class PythonDatetime(TemplatePlugin):
     Exposes python datetime and calendar functions.
     """
     aliases = ['datetime', 'calendar']
+    _settings = {
+            'scope' : 'run'
+            }
     def run(self):
         today = datetime.today()
         month = today.month
@@ -420,6 +475,9 @@ class DexyVersion(TemplatePlugin):
     Exposes the current dexy version
     """
     aliases = ['dexyversion']
+    _settings = {
+            'scope' : 'run'
+            }
     def run(self):
         return { "DEXY_VERSION" : ("The active dexy version. Currently %s." % DEXY_VERSION, DEXY_VERSION) }
 
@@ -428,6 +486,9 @@ class SimpleJson(TemplatePlugin):
     Exposes the json module.
     """
     aliases = ['json']
+    _settings = {
+            'scope' : 'run'
+            }
     def run(self):
         return { 'json' : ("The Python json module.", json,) }
 
@@ -436,6 +497,9 @@ class RegularExpressions(TemplatePlugin):
     Exposes re_match and re_search.
     """
     aliases = ['regex']
+    _settings = {
+            'scope' : 'run'
+            }
     def run(self):
         return { 're' : ("The Python re module.", re,), }
 
@@ -444,6 +508,9 @@ class PythonBuiltins(TemplatePlugin):
     Exposes python builtins.
     """
     aliases = ['builtins']
+    _settings = {
+            'scope' : 'run'
+            }
     # Intended to be all builtins that make sense to run within a document.
     PYTHON_BUILTINS = [abs, all, any, basestring, bin, bool, bytearray,
             callable, chr, cmp, complex, dict, dir, divmod, enumerate, filter,
@@ -460,16 +527,33 @@ class PygmentsStylesheet(TemplatePlugin):
     Inserts pygments style codes.
     """
     aliases = ['pygments']
+    _settings = {
+            'scope' : 'run'
+            }
 
     # TODO rewrite this so it's a function rather than pre-generating all
     # of the stylesheets. Detect document format automatically.
 
-    def generate_stylesheets(self):
-        pygments_stylesheets = {}
+    def formatter_args(self):
         if hasattr(self, 'filter_instance') and self.filter_instance.doc.args.has_key('pygments'):
-            formatter_args = self.filter_instance.doc.args['pygments']
+            return dict(self.filter_instance.doc.args['pygments'])
+        else:
+            return {}
+
+    def cache_key(self):
+        """
+        Stylesheets only depend on the formatter args, so docs with the same
+        'pygments' args can share them.
+        """
+        key = TemplatePlugin.cache_key(self)
+        if key is None:
+            return None
         else:
-            formatter_args = {}
+            return key + (repr(sorted(self.formatter_args().iteritems())),)
+
+    def generate_stylesheets(self):
+        pygments_stylesheets = {}
+        formatter_args = self.formatter_args()
 
         for style_name in get_all_styles():
             for formatter_class in [pygments.formatters.LatexFormatter, pygments.formatters.HtmlFormatter]:
@@ -506,7 +590,11 @@ class PygmentsHighlight(TemplatePlugin):
         formatter_options = { "lineanchors" : lineanchors, "noclasses" : noclasses }
         lexer = pygments.lexers.get_lexer_by_name(lexer_name)
         formatter = pygments.formatters.get_formatter_by_name(fmt, **formatter_options)
-        return pygments.highlight(text, lexer, formatter)
+        if hasattr(self, 'filter_instance'):
+            highlight_cache = self.filter_instance.doc.wrapper.highlight_cache()
+            return highlight_cache.highlight(text, lexer, formatter)
+        else:
+            return pygments.highlight(text, lexer, formatter)
 
     def run(self):
         return {
@@ -556,6 +644,9 @@ class Globals(TemplatePlugin):
     using the --globals option
     """
     aliases = ['globals']
+    _settings = {
+            'scope' : 'run'
+            }
     def run(self):
         raw_globals = self.filter_instance.doc.wrapper.globals
         env = {}
@@ -597,27 +688,69 @@ class Inputs(TemplatePlugin):
             }
 
 class D(object):
+    """
+    The 'd' object which makes input docs available to templates by key, long
+    name, title or unique key prefix. Indexes are built the first time they
+    are needed.
+    """
     def __init__(self, doc, input_docs):
         self._artifact = doc
         self._parent_dir = doc.output_data().parent_dir()
         self._input_docs = input_docs.values()
         self._input_doc_keys = [d.key for d in self._input_docs]
-        self._input_doc_names = [d.output_data().long_name() for d in self._input_docs]
-        self._input_doc_titles = ["title:%s" % d.output_data().title() for d in self._input_docs]
 
+        self._keys_index = None
+        self._names_index = None
+        self._titles_index = None
+        self._sorted_keys = None
         self._ref_cache = {}
 
     def keys(self):
         return self._input_doc_keys
 
+    def build_index(self, values):
+        """
+        Returns a dict mapping each value to its position in the list of
+        input docs, keeping the first position if a value is repeated.
+        """
+        index = {}
+        for i, value in enumerate(values):
+            index.setdefault(value, i)
+        return index
+
+    def keys_index(self):
+        if self._keys_index is None:
+            self._keys_index = self.build_index(self._input_doc_keys)
+        return self._keys_index
+
+    def names_index(self):
+        if self._names_index is None:
+            names = (d.output_data().long_name() for d in self._input_docs)
+            self._names_index = self.build_index(names)
+        return self._names_index
+
+    def titles_index(self):
+        if self._titles_index is None:
+            titles = ("title:%s" % d.output_data().title() for d in self._input_docs)
+            self._titles_index = self.build_index(titles)
+        return self._titles_index
+
     def key_or_name_index(self, ref):
-        if ref in self._input_doc_keys:
-            return self._input_doc_keys.index(ref)
-        elif ref in self._input_doc_names:
-            return self._input_doc_names.index(ref)
+        index = self.keys_index().get(ref)
+        if index is None:
+            index = self.names_index().get(ref)
+        return index
 
     def matching_keys(self, ref):
-        return [(i, k) for (i, k) in enumerate(self._input_doc_keys) if k.startswith(ref)]
+        if self._sorted_keys is None:
+            self._sorted_keys = sorted((k, i) for (i, k) in enumerate(self._input_doc_keys))
+
+        matches = []
+        for k, i in self._sorted_keys[bisect.bisect_left(self._sorted_keys, (ref,)):]:
+            if not k.startswith(ref):
+                break
+            matches.append((i, k))
+        return sorted(matches)
 
     def unique_matching_key(self, ref):
         """
@@ -628,8 +761,7 @@ class D(object):
             return matching_keys[0]
 
     def title_index(self, ref):
-        if ref in self._input_doc_titles:
-            return self._input_doc_titles[ref]
+        return self.titles_index().get(ref)
 
     def __getitem__(self, ref):
         try:
@@ -1,5 +1,4 @@
 from dexy.filter import DexyFilter
-from pygments import highlight
 from pygments.formatters.html import HtmlFormatter
 from pygments.formatters.latex import LatexFormatter
 from pygments.lexers import get_lexer_for_filename
@@ -50,8 +49,8 @@ class XmlSectionFilter(DexyFilter):
         self.output_data.append("%s:attrib" % element_key, json.dumps(safe_attrib))
 
         if self.setting('pygments'):
-            self.output_data.append("%s:html-source" % element_key, highlight(source, self.lexer, self.html_formatter))
-            self.output_data.append("%s:latex-source" % element_key, highlight(source, self.lexer, self.latex_formatter))
+            self.output_data.append("%s:html-source" % element_key, self.highlight(source, self.lexer, self.html_formatter))
+            self.output_data.append("%s:latex-source" % element_key, self.highlight(source, self.lexer, self.latex_formatter))
 
     def process(self):
         assert self.output_data.state == 'ready'
@@ -60,6 +59,7 @@ class XmlSectionFilter(DexyFilter):
             self.lexer = get_lexer_for_filename(self.input_data.storage.data_file())
             self.html_formatter = HtmlFormatter(lineanchors=self.output_data.web_safe_document_key())
             self.latex_formatter = LatexFormatter()
+            self.highlight = self.doc.wrapper.highlight_cache().highlight
 
         if self.input_data.ext in ('.xml', '.txt'):
             parser = etree.XMLParser()
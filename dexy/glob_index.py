@@ -0,0 +1,117 @@
+import bisect
+import dexy.utils
+import fnmatch
+import posixpath
+import re
+
+magic_chars = re.compile("[*?[\]]")
+
+compiled_patterns = {}
+
+def compile_pattern(pattern):
+    """
+    Returns a compiled regex for the fnmatch pattern. The fnmatch module only
+    caches 100 of these, which is fewer than large projects use.
+    """
+    regex = compiled_patterns.get(pattern)
+    if regex is None:
+        regex = re.compile(fnmatch.translate(pattern))
+        compiled_patterns[pattern] = regex
+    return regex
+
+def extension(path):
+    """
+    Returns the part of the file name from the last '.', so unlike
+    splitext, the extension of '.txt' is '.txt'.
+    """
+    name = posixpath.basename(path)
+    i = name.rfind('.')
+    if i < 0:
+        return ''
+    else:
+        return name[i:]
+
+class GlobIndex(object):
+    """
+    Index of the paths in a filemap by extension and in sorted order, so
+    paths matching a glob pattern can be found without testing the pattern
+    against every path.
+
+    In fnmatch patterns '*' also matches '/', so files in a directory are
+    found by the literal prefix of the pattern rather than by dirname.
+    """
+    def __init__(self, filemap):
+        self.filemap = filemap
+        self.size = len(filemap)
+        self.paths = sorted(filemap)
+        self.by_extension = {}
+        for path in self.paths:
+            self.by_extension.setdefault(extension(path), []).append(path)
+
+    def is_current(self, filemap):
+        return filemap is self.filemap and len(filemap) == self.size
+
+    def literal_prefix(self, pattern):
+        m = magic_chars.search(pattern)
+        if m:
+            return pattern[:m.start()]
+        else:
+            return pattern
+
+    def literal_extension(self, pattern):
+        """
+        Returns the extension which every path matching pattern must have,
+        or None if this can't be determined from the pattern.
+        """
+        ext = extension(pattern)
+        if ext and not magic_chars.search(ext):
+            return ext
+
+    def prefix_range(self, prefix):
+        """
+        Returns the range of indexes in paths of the paths starting with
+        prefix.
+        """
+        if isinstance(prefix, unicode):
+            end = prefix + u"\uffff"
+        else:
+            end = prefix + "\xff"
+        return (bisect.bisect_left(self.paths, prefix),
+                bisect.bisect_left(self.paths, end),)
+
+    def candidates(self, pattern):
+        """
+        Returns a list of paths which includes all paths matching pattern.
+        """
+        prefix = self.literal_prefix(pattern)
+        if prefix == pattern:
+            if pattern in self.filemap:
+                return [pattern]
+            else:
+                return []
+
+        candidates = self.paths
+
+        if prefix:
+            start, end = self.prefix_range(prefix)
+            candidates = self.paths[start:end]
+
+        ext = self.literal_extension(pattern)
+        if ext is not None:
+            with_ext = self.by_extension.get(ext, [])
+            if len(with_ext) < len(candidates):
+                candidates = with_ext
+
+        return candidates
+
+    def matches(self, pattern):
+        """
+        Returns the paths matching pattern in sorted order, equivalent to
+        filtering the filemap using fnmatch.fnmatch.
+        """
+        if dexy.utils.is_windows:
+            # fnmatch is case insensitive here
+            return [p for p in self.paths if fnmatch.fnmatch(p, pattern)]
+
+        regex = compile_pattern(pattern)
+        return [p for p in self.candidates(pattern) if regex.match(p)]
@@ -0,0 +1,162 @@
+import hashlib
+import os
+import pygments
+import sqlite3
+import time
+
+def qualified_name(obj):
+    return "%s.%s" % (obj.__class__.__module__, obj.__class__.__name__)
+
+class HighlightCache(object):
+    """
+    Remembers pygments output across runs so sections whose text, lexer and
+    formatter options have not changed are not highlighted again.
+
+    Entries are stored in a sqlite3 database in the artifacts dir, keyed by a
+    digest of everything which determines the output.
+    """
+    max_entries = 100000
+
+    def __init__(self, wrapper):
+        self.wrapper = wrapper
+        self.hits = 0
+        self.misses = 0
+        self._db = None
+        self._new = {}
+        self._used = set()
+        self._exported = {}
+
+    def filepath(self):
+        return os.path.join(self.wrapper.artifacts_dir, "highlight.sqlite3")
+
+    def db(self):
+        if not self._db:
+            self._db = sqlite3.connect(self.filepath())
+            self._db.execute("""CREATE TABLE IF NOT EXISTS highlights
+                (digest TEXT PRIMARY KEY, output TEXT, used REAL)""")
+        return self._db
+
+    def digest(self, text, lexer, formatter):
+        if isinstance(text, unicode):
+            text = text.encode("utf-8")
+
+        # filter instances have default reprs which change between runs
+        lexer_filters = [(qualified_name(f), sorted(f.options.items()),)
+                for f in lexer.filters]
+
+        h = hashlib.md5()
+        h.update(pygments.__version__)
+        h.update(qualified_name(lexer))
+        h.update(repr(sorted(lexer.options.items())))
+        h.update(repr(lexer_filters))
+        h.update(qualified_name(formatter))
+        h.update(repr(sorted(formatter.options.items())))
+        h.update(text)
+        return h.hexdigest()
+
+    def lookup(self, digest):
+        if digest in self._new:
+            return self._new[digest]
+        elif digest in self._exported:
+            return self._exported[digest]
+
+        row = self.db().execute("SELECT output FROM highlights WHERE digest = ?",
+                (digest,)).fetchone()
+        if row:
+            self._used.add(digest)
+            return row[0]
+
+    def highlight(self, text, lexer, formatter):
+        """
+        Drop-in replacement for pygments.highlight which uses cached output
+        where available.
+        """
+        digest = self.digest(text, lexer, formatter)
+        output = self.lookup(digest)
+
+        if output is None:
+            self.misses += 1
+            output = pygments.highlight(text, lexer, formatter)
+            # Only text output is cached, not images or encoded output.
+            if isinstance(output, unicode):
+                self._new[digest] = output
+        else:
+            self.hits += 1
+
+        return output
+
+    def after_fork(self):
+        """
+        Called in forked worker processes. Drops the inherited database
+        connection and starts counting afresh, so export_changes() only
+        returns what the worker did. Entries not yet saved by the parent
+        are still used for lookups but not exported again.
+        """
+        self._db = None
+        self._exported.update(self._new)
+        self._new = {}
+        self._used = set()
+        self.hits = 0
+        self.misses = 0
+
+    def export_changes(self):
+        """
+        Returns new entries, used digests and hit and miss counts since the
+        last call, for a worker process to hand back to the parent.
+        """
+        changes = (self._new, self._used, self.hits, self.misses,)
+        self._exported.update(self._new)
+        self._new = {}
+        self._used = set()
+        self.hits = 0
+        self.misses = 0
+        return changes
+
+    def merge_changes(self, changes):
+        """
+        Merges changes returned by export_changes() in a worker process, so
+        they are saved and counted as if the parent had done the work.
+        """
+        new, used, hits, misses = changes
+        self._new.update(new)
+        self._used.update(used)
+        self.hits += hits
+        self.misses += misses
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        if lookups:
+            return float(self.hits) / lookups
+
+    def summary(self):
+        """
+        One line description of cache effectiveness for the run summary, or
+        None if nothing was highlighted.
+        """
+        if self.hits + self.misses:
+            msg = "highlight cache: %s hits, %s misses (%0.1f%% hit rate)"
+            return msg % (self.hits, self.misses, 100 * self.hit_rate())
+
+    def save(self):
+        """
+        Writes new entries, records when entries were last used, and prunes
+        the least recently used entries if there are more than max_entries.
+        """
+        if not (self._new or self._used):
+            return
+
+        now = time.time()
+        db = self.db()
+        db.executemany("INSERT OR REPLACE INTO highlights VALUES (?, ?, ?)",
+                [(digest, output, now,) for digest, output in self._new.iteritems()])
+        db.executemany("UPDATE highlights SET used = ? WHERE digest = ?",
+                [(now, digest,) for digest in self._used])
+        count = db.execute("SELECT COUNT(*) FROM highlights").fetchone()[0]
+        if count > self.max_entries:
+            db.execute("""DELETE FROM highlights WHERE digest NOT IN
+                (SELECT digest FROM highlights ORDER BY used DESC LIMIT ?)""",
+                (self.max_entries,))
+        db.commit()
+
+        self._new = {}
+        self._used = set()
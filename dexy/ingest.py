@@ -0,0 +1,46 @@
+import dexy.utils
+import os
+
+class IngestIndex(object):
+    """
+    Remembers the mtime and size of source files which were hard linked into
+    the cache when they were ingested.
+
+    A hard linked cache file is the same file as the source, so an edit made
+    in place changes both and can't be detected by comparing their mtimes.
+    Comparing against the stat recorded at ingestion time catches this.
+    """
+    def __init__(self, wrapper):
+        self.wrapper = wrapper
+        self.stamps = {}
+        self.dirty = False
+
+    def filepath(self):
+        return os.path.join(self.wrapper.artifacts_dir, "ingested.pickle")
+
+    def load(self):
+        self.stamps = dexy.utils.load_pickle(self.wrapper, self.filepath(), {})
+
+    def save(self):
+        if not self.dirty:
+            return
+
+        dexy.utils.save_pickle(self.wrapper, self.filepath(), self.stamps)
+        self.dirty = False
+
+    def stamp(self, st):
+        return (st.st_mtime, st.st_size,)
+
+    def record(self, name, filepath):
+        """
+        Records the stat of filepath, which has just been linked into the
+        cache as the source of doc name.
+        """
+        self.stamps[name] = self.stamp(os.stat(filepath))
+        self.dirty = True
+
+    def changed(self, name, live_stat):
+        """
+        Whether the source of doc name has changed since it was linked.
+        """
+        return self.stamps.get(name) != self.stamp(live_stat)
@@ -0,0 +1,92 @@
+import dexy.utils
+import hashlib
+import jinja2
+
+class BytecodeCache(jinja2.FileSystemBytecodeCache):
+    """
+    Stores compiled jinja templates in the artifacts dir so unchanged
+    templates are not compiled again on later runs. Compiled code is also
+    kept in memory, so templates shared by many docs, like the dexy macros,
+    are only read from disk once per run.
+
+    One cache is shared by all jinja environments, so cache keys include a
+    digest of the environment settings which change how a template is
+    compiled, such as the tag delimiters used for latex and wiki files.
+    """
+    def __init__(self, directory):
+        jinja2.FileSystemBytecodeCache.__init__(self, directory)
+        self._code = {}
+        self._dumped = None
+
+    def environment_digest(self, environment):
+        undefined = environment.undefined
+        settings = (
+                environment.block_start_string,
+                environment.block_end_string,
+                environment.variable_start_string,
+                environment.variable_end_string,
+                environment.comment_start_string,
+                environment.comment_end_string,
+                environment.line_statement_prefix,
+                environment.line_comment_prefix,
+                environment.trim_blocks,
+                environment.lstrip_blocks,
+                environment.newline_sequence,
+                environment.keep_trailing_newline,
+                environment.optimized,
+                "%s.%s" % (undefined.__module__, undefined.__name__),
+                sorted(environment.extensions),
+                )
+        return hashlib.sha1(repr(settings)).hexdigest()
+
+    def get_bucket(self, environment, name, filename, source):
+        key = "%s-%s" % (self.get_cache_key(name, filename),
+                self.environment_digest(environment))
+        checksum = self.get_source_checksum(source)
+        bucket = jinja2.bccache.Bucket(environment, key, checksum)
+        self.load_bytecode(bucket)
+        return bucket
+
+    def load_bytecode(self, bucket):
+        if bucket.key in self._code:
+            checksum, code = self._code[bucket.key]
+            if checksum == bucket.checksum:
+                bucket.code = code
+                return
+
+        jinja2.FileSystemBytecodeCache.load_bytecode(self, bucket)
+        if bucket.code is not None:
+            self._code[bucket.key] = (bucket.checksum, bucket.code,)
+
+    def dump_bytecode(self, bucket):
+        if self._dumped is None:
+            jinja2.FileSystemBytecodeCache.dump_bytecode(self, bucket)
+        else:
+            self._dumped[self._get_cache_filename(bucket)] = bucket.bytecode_to_string()
+        self._code[bucket.key] = (bucket.checksum, bucket.code,)
+
+    def after_fork(self):
+        """
+        Called in forked worker processes. Compiled templates are then kept
+        for export_dumped() instead of being written to the cache dir, so
+        workers never write the same cache file at once.
+        """
+        self._dumped = {}
+
+    def export_dumped(self):
+        """
+        Returns compiled templates dumped since the last call, as a dict of
+        cache filenames and bytecode.
+        """
+        dumped = self._dumped or {}
+        self._dumped = {}
+        return dumped
+
+    def merge_dumped(self, dumped):
+        """
+        Writes compiled templates returned by export_dumped() in a worker
+        process to the cache dir.
+        """
+        for filename, bytecode in dumped.iteritems():
+            with dexy.utils.atomic_file(filename) as f:
+                f.write(bytecode)
@@ -2,7 +2,6 @@ from dexy.utils import md5_hash
 from dexy.utils import os_to_posix
 import dexy.doc
 import dexy.plugin
-import fnmatch
 import json
 import re
 
@@ -112,15 +111,15 @@ class Node(dexy.plugin.Plugin):
         Checks if args have changed by comparing calculated hash against the
         archived calculated hash from last run.
         """
-        saved_args = self.wrapper.saved_args.get(self.key_with_class())
-        if not saved_args:
+        store = self.wrapper.runtime_info_store()
+        saved_digest = store.args_digest(self.key_with_class())
+        if not saved_digest:
             self.log_debug("no saved args, will return True for args_changed")
             return True
         else:
-            self.log_debug("    saved args '%s' (%s)" % (saved_args, saved_args.__class__))
-            self.log_debug("    sorted args '%s' (%s)" % (self.sorted_arg_string(), self.sorted_arg_string().__class__))
-            self.log_debug("  args unequal: %s" % (saved_args != self.sorted_arg_string()))
-            return saved_args != self.sorted_arg_string()
+            digest = self.args_digest()
+            self.log_debug("    saved args digest %s, args digest %s" % (saved_digest, digest))
+            return saved_digest != digest
 
     def sorted_args(self, skip=['contents']):
         """
@@ -141,6 +140,12 @@ class Node(dexy.plugin.Plugin):
         """
         return unicode(json.dumps(self.sorted_args()))
 
+    def args_digest(self):
+        """
+        Returns a short digest of sorted_arg_string.
+        """
+        return md5_hash(self.sorted_arg_string())
+
     def additional_doc_info(self):
         additional_doc_info = []
         for doc in self.additional_docs:
@@ -162,9 +167,6 @@ class Node(dexy.plugin.Plugin):
 
             new_doc.check_is_cached()
             new_doc.consolidate_cache_files()
-
-            new_doc.initial_data.load_data()
-            new_doc.output_data().load_data()
             self.add_additional_doc(new_doc)
 
     def add_additional_doc(self, doc):
@@ -320,24 +322,26 @@ class PatternNode(Node):
         file_pattern = self.key.split("|")[0]
         filter_aliases = self.key.split("|")[1:]
 
-        for filepath, fileinfo in self.wrapper.filemap.iteritems():
-            if fnmatch.fnmatch(filepath, file_pattern):
-                except_p = self.args.get('except')
-                if except_p and re.search(except_p, filepath):
-                    msg = "not creating child of patterndoc for file '%s' because it matches except '%s'"
-                    msgargs = (filepath, except_p)
-                    self.log_debug(msg % msgargs)
+        except_p = self.args.get('except')
+        if except_p:
+            except_re = re.compile(except_p)
+
+        for filepath in self.wrapper.glob_index().matches(file_pattern):
+            if except_p and except_re.search(filepath):
+                msg = "not creating child of patterndoc for file '%s' because it matches except '%s'"
+                msgargs = (filepath, except_p)
+                self.log_debug(msg % msgargs)
+            else:
+                if len(filter_aliases) > 0:
+                    doc_key = "%s|%s" % (filepath, "|".join(filter_aliases))
                 else:
-                    if len(filter_aliases) > 0:
-                        doc_key = "%s|%s" % (filepath, "|".join(filter_aliases))
-                    else:
-                        doc_key = filepath
-
-                    msg = "creating child of patterndoc %s: %s"
-                    msgargs = (self.key, doc_key)
-                    self.log_debug(msg % msgargs)
-                    doc = dexy.doc.Doc(doc_key, self.wrapper, [], **self.args)
-                    doc.parent = self
-                    self.children.append(doc)
-                    self.wrapper.add_node(doc)
-                    self.wrapper.batch.add_doc(doc)
+                    doc_key = filepath
+
+                msg = "creating child of patterndoc %s: %s"
+                msgargs = (self.key, doc_key)
+                self.log_debug(msg % msgargs)
+                doc = dexy.doc.Doc(doc_key, self.wrapper, [], **self.args)
+                doc.parent = self
+                self.children.append(doc)
+                self.wrapper.add_node(doc)
+                self.wrapper.batch.add_doc(doc)
@@ -0,0 +1,297 @@
+import dexy.exceptions
+import dexy.utils
+import os
+import time
+import uuid
+
+class Pack(object):
+    """
+    Stores small cached artifacts in a few append-only pack files instead of
+    one file per artifact.
+
+    Entries are tracked in an index of name -> (pack filename, offset,
+    length, mtime) which is split into 'this' and 'last' generations,
+    mirroring the this/ and last/ cache directories. Moving an entry between
+    generations is an index update, the bytes are never rewritten.
+    """
+    max_packed_size = 64 * 1024
+    max_pack_file_size = 128 * 1024 * 1024
+
+    def __init__(self, wrapper):
+        self.wrapper = wrapper
+        self.this = {}
+        self.last = {}
+        self.current = None
+        self._writer = None
+        self._writer_filename = None
+        self._readers = {}
+
+    def pack_dir(self):
+        return os.path.join(self.wrapper.artifacts_dir, "packs")
+
+    def index_filepath(self):
+        return os.path.join(self.pack_dir(), "index.pickle")
+
+    def materialized_dir(self):
+        return os.path.join(self.wrapper.work_cache_dir(), "packed")
+
+    def load(self):
+        index = dexy.utils.load_pickle(self.wrapper, self.index_filepath(), {})
+        self.this = index.get('this', {})
+        self.last = index.get('last', {})
+        self.current = index.get('current')
+
+    def save(self):
+        """
+        Writes the index, compacting pack files first if most of their
+        contents are no longer referenced.
+        """
+        self.close()
+        self.compact()
+
+        if not os.path.exists(self.pack_dir()):
+            os.makedirs(self.pack_dir())
+
+        index = {
+                'this' : self.this,
+                'last' : self.last,
+                'current' : self.current
+                }
+        dexy.utils.save_pickle(self.wrapper, self.index_filepath(), index)
+
+    def close(self):
+        if self._writer:
+            self._writer.close()
+            self._writer = None
+        for f in self._readers.values():
+            f.close()
+        self._readers = {}
+
+    def generation(self, this):
+        if this:
+            return self.this
+        else:
+            return self.last
+
+    def fits(self, length):
+        return length <= self.max_packed_size
+
+    def contains(self, name, this):
+        return name in self.generation(this)
+
+    def size(self, name, this):
+        return self.generation(this)[name][2]
+
+    def mtime(self, name, this):
+        return self.generation(this)[name][3]
+
+    def writer(self):
+        """
+        Returns an open handle to the pack file currently being appended to,
+        starting a new pack file when the current one is full.
+        """
+        if self._writer and self._writer.tell() > self.max_pack_file_size:
+            self._writer.close()
+            self._writer = None
+            self.current = None
+
+        if not self._writer:
+            if not os.path.exists(self.pack_dir()):
+                os.makedirs(self.pack_dir())
+            if not self.current:
+                self.current = "%s.pack" % uuid.uuid4()
+            filepath = os.path.join(self.pack_dir(), self.current)
+            self._writer = open(filepath, 'ab')
+            self._writer.seek(0, os.SEEK_END)
+            self._writer_filename = self.current
+
+        return self._writer
+
+    def write(self, name, data):
+        """
+        Appends data to the current pack file and records it in the 'this'
+        generation under name.
+        """
+        if isinstance(data, unicode):
+            data = data.encode("utf-8")
+
+        f = self.writer()
+        offset = f.tell()
+        f.write(data)
+        self.this[name] = (self._writer_filename, offset, len(data), time.time(),)
+        self.remove_materialized(name)
+
+    def write_file(self, name, filepath):
+        """
+        Packs the contents of filepath under name, then keeps the file as the
+        materialized copy of the entry. Returns the new location of the file.
+        """
+        with open(filepath, 'rb') as f:
+            self.write(name, f.read())
+
+        if not os.path.exists(self.materialized_dir()):
+            os.makedirs(self.materialized_dir())
+        materialized_filepath = self.materialized_filepath(name)
+        os.rename(filepath, materialized_filepath)
+        return materialized_filepath
+
+    def read(self, name, this):
+        return self.read_entry(self.generation(this)[name])
+
+    def read_entry(self, entry):
+        pack_filename, offset, length, _ = entry
+
+        if self._writer and pack_filename == self._writer_filename:
+            self._writer.flush()
+
+        if not pack_filename in self._readers:
+            filepath = os.path.join(self.pack_dir(), pack_filename)
+            self._readers[pack_filename] = open(filepath, 'rb')
+
+        f = self._readers[pack_filename]
+        f.seek(offset)
+        return f.read(length)
+
+    def remove(self, name):
+        """
+        Drops name from the 'this' generation, e.g. because the artifact has
+        been written to an individual file instead.
+        """
+        if name in self.this:
+            del self.this[name]
+            self.remove_materialized(name)
+
+    def move_to_this(self, name):
+        """
+        Moves an entry from the 'last' generation to 'this', returns whether
+        there was an entry to move.
+        """
+        if name in self.last:
+            self.this[name] = self.last.pop(name)
+            self.remove_materialized(name)
+            return True
+        else:
+            return False
+
+    def share(self, name, source_name):
+        """
+        Records name in the 'this' generation as an entry for the same bytes
+        as source_name, without writing them again.
+        """
+        if source_name in self.this:
+            self.this[name] = self.this[source_name]
+        else:
+            self.this[name] = self.last[source_name]
+        self.remove_materialized(name)
+
+    def drop_last(self):
+        """
+        Forgets entries from the previous run which were not moved to 'this'.
+        """
+        self.last = {}
+
+    def this_to_last(self):
+        self.last = self.this
+        self.this = {}
+
+    def materialized_filepath(self, name):
+        return os.path.join(self.materialized_dir(), name)
+
+    def materialize(self, name, this):
+        """
+        Writes a packed entry out to a scratch file in the work dir and
+        returns its path, for code which needs a real file to read from.
+        """
+        filepath = self.materialized_filepath(name)
+        if not os.path.exists(filepath):
+            try:
+                os.makedirs(self.materialized_dir())
+            except OSError:
+                pass
+
+            # other processes must never see a partial file
+            with dexy.utils.atomic_file(filepath) as f:
+                f.write(self.read(name, this))
+        return filepath
+
+    def remove_materialized(self, name):
+        try:
+            os.remove(self.materialized_filepath(name))
+        except OSError:
+            pass
+
+    def live_entries(self):
+        """
+        Returns the entries of both generations, with entries which share
+        the same bytes, see share(), returned once.
+        """
+        entries = {}
+        for entry in self.this.values() + self.last.values():
+            entries.setdefault(entry[0:2], entry)
+        return entries.values()
+
+    def pack_filenames(self):
+        try:
+            return [f for f in os.listdir(self.pack_dir()) if f.endswith(".pack")]
+        except OSError:
+            return []
+
+    def compact(self):
+        """
+        Rewrites live entries into fresh pack files and deletes the old pack
+        files if more than half of the packed bytes are unreferenced.
+        """
+        pack_filenames = self.pack_filenames()
+        total = sum(os.path.getsize(os.path.join(self.pack_dir(), f))
+                for f in pack_filenames)
+        total_live = sum(entry[2] for entry in self.live_entries())
+
+        if total <= 2 * total_live + self.max_packed_size:
+            return
+
+        msg = "compacting %s pack files, %s of %s bytes are live"
+        self.wrapper.log.debug(msg % (len(pack_filenames), total_live, total))
+
+        self.current = None
+        locations = {}
+        self.this = self.rewrite_entries(self.this, locations)
+        self.last = self.rewrite_entries(self.last, locations)
+        self.close()
+
+        new_pack_filenames = set(entry[0] for entry in self.live_entries())
+        for pack_filename in pack_filenames:
+            if not pack_filename in new_pack_filenames:
+                os.remove(os.path.join(self.pack_dir(), pack_filename))
+
+    def rewrite_entries(self, entries, locations):
+        """
+        Writes the bytes of entries into the current pack file. locations
+        maps (pack filename, offset) of bytes already rewritten to their new
+        location, so bytes shared by several names are only written once.
+        """
+        rewritten = {}
+        for name, entry in entries.iteritems():
+            location = entry[0:2]
+            if not location in locations:
+                data = self.read_entry(entry)
+                f = self.writer()
+                locations[location] = (self._writer_filename, f.tell(),)
+                f.write(data)
+            pack_filename, offset = locations[location]
+            rewritten[name] = (pack_filename, offset, entry[2], entry[3],)
+        return rewritten
+
+def create_pack(wrapper):
+    """
+    Returns a loaded Pack if the wrapper is configured to use the 'pack' cache
+    backend, otherwise None.
+    """
+    if wrapper.cache_backend == 'pack':
+        pack = Pack(wrapper)
+        pack.load()
+        return pack
+    elif wrapper.cache_backend == 'files':
+        return None
+    else:
+        msg = "'%s' is not a valid cache backend, should be 'files' or 'pack'"
+        raise dexy.exceptions.UserFeedback(msg % wrapper.cache_backend)
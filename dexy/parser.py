@@ -2,8 +2,54 @@ import copy
 import dexy.doc
 import dexy.exceptions
 import dexy.plugin
+import os
 import posixpath
 
+class DirectorySettings(object):
+    """
+    Trie of settings keyed by path components, where settings for a
+    directory also apply to all directories below it.
+
+    Merged settings are memoized per directory, so all docs in a directory
+    share one dict which callers must not modify.
+    """
+    def __init__(self, entries):
+        self.size = len(entries)
+        self.root = ({}, [],)
+        self.merged = {}
+
+        for d, settings in entries:
+            children, settings_list = self.root
+            for component in self.components(d):
+                children, settings_list = children.setdefault(component, ({}, [],))
+            settings_list.append(settings)
+
+    def components(self, d):
+        d = posixpath.normpath(d.replace(os.sep, "/"))
+        if d == ".":
+            return []
+        else:
+            return d.split("/")
+
+    def for_directory(self, d):
+        """
+        Returns settings for directory d merged from the project root down,
+        so settings for deeper directories take precedence.
+        """
+        if not d in self.merged:
+            merged = {}
+            node = self.root
+            for settings in node[1]:
+                merged.update(settings)
+            for component in self.components(d):
+                node = node[0].get(component)
+                if node is None:
+                    break
+                for settings in node[1]:
+                    merged.update(settings)
+            self.merged[d] = merged
+        return self.merged[d]
+
 class AbstractSyntaxTree():
     def __init__(self, wrapper):
         self.wrapper = wrapper
@@ -17,6 +63,10 @@ class AbstractSyntaxTree():
         self.default_args_for_directory = []
         self.environment_for_directory = []
 
+        # DirectorySettings built from the lists above on first use
+        self._default_args = None
+        self._environment = None
+
     def all_inputs(self):
         """
         Returns a set of all node keys identified as inputs of some other
@@ -89,24 +139,24 @@ class AbstractSyntaxTree():
         return self.lookup_table[node_key]['inputs']
 
     def calculate_default_args_for_directory(self, path):
-        dir_path = posixpath.dirname(posixpath.abspath(path))
-        default_kwargs = {}
-
-        for d, args in self.default_args_for_directory:
-            if posixpath.abspath(d) in dir_path:
-                default_kwargs.update(args)
-
-        return default_kwargs
+        """
+        Returns the default args which apply to path, shared by all paths in
+        the same directory.
+        """
+        entries = self.default_args_for_directory
+        if self._default_args is None or self._default_args.size != len(entries):
+            self._default_args = DirectorySettings(entries)
+        return self._default_args.for_directory(posixpath.dirname(path))
 
     def calculate_environment_for_directory(self, path):
-        dir_path = posixpath.dirname(posixpath.abspath(path))
-        env = {}
-
-        for d, args in self.environment_for_directory:
-            if posixpath.abspath(d) in dir_path:
-                env.update(args)
-
-        return env
+        """
+        Returns the environment which applies to path, shared by all paths in
+        the same directory.
+        """
+        entries = self.environment_for_directory
+        if self._environment is None or self._environment.size != len(entries):
+            self._environment = DirectorySettings(entries)
+        return self._environment.for_directory(posixpath.dirname(path))
 
     def walk(self):
         """
@@ -127,7 +177,7 @@ class AbstractSyntaxTree():
                 alias, pattern = self.wrapper.qualify_key(key)
                 node_environment = self.calculate_environment_for_directory(pattern)
                 
-                kwargs_with_defaults = self.calculate_default_args_for_directory(pattern)
+                kwargs_with_defaults = dict(self.calculate_default_args_for_directory(pattern))
                 kwargs_with_defaults.update(kwargs)
                 kwargs_with_defaults.update({'environment' : node_environment })
 
@@ -181,6 +231,10 @@ class Parser(dexy.plugin.Plugin):
     _settings = {}
     __metaclass__ = dexy.plugin.PluginMeta
 
+    # whether the result of parsing depends only on the config text and the
+    # filemap, so it can be saved and reused while they are unchanged
+    cacheable = True
+
     def __init__(self, wrapper, ast):
         self.wrapper = wrapper
         self.ast = ast
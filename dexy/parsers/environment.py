@@ -28,6 +28,7 @@ class PythonEnvironment(Environment):
     Loads environment variables from a python script.
     """
     aliases = ['dexy-env.py']
+    cacheable = False
 
     @classmethod
     def parse_environment_from_text(klass, text):
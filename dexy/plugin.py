@@ -1,5 +1,6 @@
-import cashew
 from cashew import Plugin
+import cashew
+import dexy.exceptions
 
 class PluginMeta(cashew.PluginMeta):
     """
@@ -58,7 +59,11 @@ class TemplatePlugin(Plugin):
     __metaclass__ = PluginMeta
     aliases = []
     _settings = {
-            'no-jinja-filter' : ("Listed entries should not be made into jinja filters.")
+            'no-jinja-filter' : ("Listed entries should not be made into jinja filters."),
+            'scope' : ("""Whether the output of run() is the same for the whole
+                dexy 'run', for each 'doc', or needs to be computed for each
+                'filter' which uses the plugin. Output for 'run' and 'doc'
+                scopes is cached.""", 'filter')
             }
 
     def is_active(self):
@@ -70,3 +75,33 @@ class TemplatePlugin(Plugin):
 
     def run(self):
         return {}
+
+    def cache_key(self):
+        """
+        Returns the key to cache the output of run() under according to the
+        plugin's scope, or None if the output should not be cached.
+        """
+        scope = self.setting('scope')
+        settings = repr(sorted(self.setting_values().items()))
+        if scope == 'run':
+            return (self.__class__.__name__, settings,)
+        elif scope == 'doc' and hasattr(self, 'filter_instance'):
+            return (self.__class__.__name__, settings, self.filter_instance.doc.key_with_class(),)
+        elif scope in ('doc', 'filter',):
+            return None
+        else:
+            msg = "'%s' is not a valid scope for template plugin %s"
+            msgargs = (scope, self.__class__.__name__)
+            raise dexy.exceptions.InternalDexyProblem(msg % msgargs)
+
+    def run_cached(self, cache):
+        """
+        Returns the output of run(), reusing output stored in the cache dict
+        if the plugin's scope allows it.
+        """
+        key = self.cache_key()
+        if key is None:
+            return self.run()
+        elif not key in cache:
+            cache[key] = self.run()
+        return cache[key]
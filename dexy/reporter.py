@@ -1,5 +1,6 @@
 from dexy.utils import file_exists
 import dexy.plugin
+import dexy.utils
 import os
 import shutil
 import sys
@@ -63,7 +64,7 @@ class Reporter(dexy.plugin.Plugin):
             self.log_debug("Running template plugin %s" % plugin.__class__.__name__)
 
             try:
-                new_env_vars = plugin.run()
+                new_env_vars = plugin.run_cached(self.wrapper.template_plugin_output)
             except Exception:
                 print "error occurred processing template plugin '%s'" % alias
                 raise
@@ -147,6 +148,101 @@ class Reporter(dexy.plugin.Plugin):
         if self.readme_filepath():
             self.write_readme_file()
 
+    def manifest_filepath(self):
+        return os.path.join(self.cache_reports_dir(), "%s-manifest.pickle" % self.aliases[0])
+
+    def load_manifest(self):
+        """
+        Loads the manifest of files written to the report dir by the previous
+        run. Returns False if there is no usable manifest.
+        """
+        self.manifest = {'files' : {}}
+        self.new_manifest = {'files' : {}}
+
+        if not self.report_dir() or not file_exists(self.safety_filepath()):
+            return False
+
+        pickle = dexy.utils.pickle_lib(self.wrapper)
+        try:
+            with open(self.manifest_filepath(), 'rb') as f:
+                self.manifest = pickle.load(f)
+            return True
+        except (IOError, EOFError, pickle.UnpicklingError):
+            return False
+
+    def save_manifest(self):
+        self.create_cache_reports_dir()
+        pickle = dexy.utils.pickle_lib(self.wrapper)
+        with open(self.manifest_filepath(), 'wb') as f:
+            pickle.dump(self.new_manifest, f)
+
+    def data_signature(self, data):
+        """
+        Identifies the cached contents of data, for comparing against the
+        signature recorded when a file was written from it.
+        """
+        return repr((data.storage_key, data.storage.data_file_stamp(),))
+
+    def is_current(self, filepath, signature):
+        """
+        Whether filepath was written by the previous run from a source with
+        the same signature and has not been modified since.
+        """
+        entry = self.manifest['files'].get(filepath)
+        if signature is None or not entry or entry['signature'] != signature:
+            return False
+        try:
+            return os.path.getmtime(filepath) == entry['mtime']
+        except OSError:
+            return False
+
+    def keep_file(self, filepath):
+        """
+        Records that filepath, written by the previous run, is still current.
+        """
+        self.new_manifest['files'][filepath] = self.manifest['files'][filepath]
+
+    def record_file(self, filepath, signature, **kwargs):
+        """
+        Records that filepath has been written from a source with signature.
+        """
+        entry = {
+                'signature' : signature,
+                'mtime' : os.path.getmtime(filepath)
+                }
+        entry.update(kwargs)
+        self.new_manifest['files'][filepath] = entry
+
+    def prepare_reports_dir(self):
+        """
+        Loads the manifest so unchanged files can be kept, or clears out the
+        report dir if there is no manifest to say what is in it.
+        """
+        if not self.load_manifest():
+            self.remove_reports_dir(self.wrapper, keep_empty_dir=True)
+        self.create_reports_dir()
+
+    def finish_reports_dir(self):
+        """
+        Removes files left over from the previous run which were not written
+        this time, then saves the manifest. On targeted runs only some docs
+        have been processed, so other files are kept.
+        """
+        for filepath, entry in self.manifest['files'].iteritems():
+            if filepath in self.new_manifest['files']:
+                continue
+            elif self.wrapper.target:
+                self.new_manifest['files'][filepath] = entry
+            else:
+                self.log_debug("  removing stale file %s" % filepath)
+                try:
+                    os.remove(filepath)
+                    os.removedirs(os.path.dirname(filepath))
+                except OSError:
+                    pass
+
+        self.save_manifest()
+
     def remove_reports_dir(self, wrapper, keep_empty_dir=False):
         self.wrapper = wrapper
         if not self.report_dir():
@@ -22,6 +22,12 @@ class Output(Reporter):
                 self.locations[fp] = []
             self.locations[fp].append(doc.key)
 
+            signature = self.data_signature(doc.output_data())
+            if self.is_current(fp, signature):
+                self.log_debug("  %s is up to date" % fp)
+                self.keep_file(fp)
+                return
+
             parent_dir = os.path.dirname(fp)
             try:
                 os.makedirs(parent_dir)
@@ -30,14 +36,14 @@ class Output(Reporter):
 
             self.log_debug("  writing %s to %s" % (doc.key, fp))
 
-            doc.output_data().output_to_file(fp)
+            doc.output_data().publish_to_file(fp)
+            self.record_file(fp, signature)
 
     def run(self, wrapper):
         self.wrapper=wrapper
         self.locations = {}
 
-        self.remove_reports_dir(self.wrapper, keep_empty_dir=True)
-        self.create_reports_dir()
+        self.prepare_reports_dir()
         for doc in wrapper.nodes.values():
             if not doc.key_with_class() in wrapper.batch.docs:
                 continue
@@ -49,6 +55,8 @@ class Output(Reporter):
             if doc.output_data().is_canonical_output():
                 self.write_canonical_data(doc)
 
+        self.finish_reports_dir()
+
 class LongOutput(Reporter):
     """
     Creates complete dexy output with files given long, unique filenames.
@@ -78,4 +86,4 @@ class LongOutput(Reporter):
                 pass
 
             self.log_debug("  writing %s to %s" % (doc.key, fp))
-            doc.output_data().output_to_file(fp)
+            doc.output_data().publish_to_file(fp)
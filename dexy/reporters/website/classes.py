@@ -6,21 +6,64 @@ from dexy.utils import reverse_iter_paths
 from functools import partial
 from jinja2 import Environment
 from jinja2 import FileSystemLoader
+import dexy.batch
 import dexy.data
 import dexy.exceptions
 import dexy.filters.templating_plugins
+import hashlib
 import inspect
 import jinja2
+import jinja2.meta
+import multiprocessing
 import os
 import posixpath
+import traceback
 import urlparse
 
+# The Website reporter rendering pages in parallel, set before worker processes
+# are forked so they inherit it (and its navigation tree) without pickling.
+forked_website = None
+
+def init_forked_worker():
+    forked_website.wrapper.after_fork()
+
+def process_doc_in_forked_worker(doc_key):
+    """
+    Renders a page in a worker process, returns a tuple of the manifest
+    entries for files written, the cache changes made while rendering (see
+    worker_cache_changes) and None or a tuple of (error message, traceback)
+    if rendering failed.
+    """
+    forked_website.new_manifest['files'] = {}
+    try:
+        forked_website.process_doc(forked_website.wrapper.nodes[doc_key])
+        files = forked_website.new_manifest['files']
+        return (files, worker_cache_changes(), None,)
+    except Exception as e:
+        message = getattr(e, 'message', None) or unicode(e)
+        error = ("%s: %s" % (e.__class__.__name__, message), traceback.format_exc(),)
+        return ({}, worker_cache_changes(), error,)
+
+def worker_cache_changes():
+    """
+    Returns highlight cache changes and compiled jinja templates from the
+    worker, which workers leave to the parent process to save.
+    """
+    wrapper = forked_website.wrapper
+    highlights = None
+    if wrapper._highlight_cache:
+        highlights = wrapper._highlight_cache.export_changes()
+    return (highlights, wrapper.jinja_bytecode_cache().export_dumped(),)
+
 class Website(Output):
     """
     Applies a template to create a website from your dexy output.
 
     Templates are applied to all files with .html extension which don't already
     contain "<head" or "<body" tags.
+
+    Pages are only rendered again if their content, template, navigation or
+    the links they contain have changed since the previous run.
     """
     aliases = ['ws']
     _other_class_settings = {
@@ -70,30 +113,102 @@ class Website(Output):
     def run(self, wrapper):
         self.wrapper=wrapper
 
-        self.remove_reports_dir(self.wrapper, keep_empty_dir=True)
-        self.create_reports_dir()
+        self.prepare_reports_dir()
+
+        if self.wrapper.target:
+            msg = "only updating pages for docs matching target '%s'"
+            self.log_debug(msg % self.wrapper.target)
+            batch = self.published_batch()
+            for doc_key in batch.docs:
+                if not doc_key in self.wrapper.batch.docs:
+                    batch.output_data(doc_key).add_to_lookup_nodes()
 
         self.setup()
 
-        if self.wrapper.target:
-            msg = "Not running website reporter because a target has been specified."
-            self.log_warn(msg)
-            return
+        docs = [wrapper.nodes[key] for key in sorted(wrapper.nodes)
+                if self.should_process(wrapper.nodes[key])]
 
-        for doc in wrapper.nodes.values():
-            if self.should_process(doc):
+        if self.wrapper.report_jobs > 1 and len(docs) > 1 and hasattr(os, 'fork'):
+            self.process_docs_in_parallel(docs)
+        else:
+            for doc in docs:
                 self.process_doc(doc)
 
+        self.new_manifest['docs'] = self.published_batch().docs
+        self.finish_reports_dir()
         self.log_debug("finished")
 
+    def process_docs_in_parallel(self, docs):
+        """
+        Renders pages using a pool of forked worker processes. Errors are
+        reported for the first failing page in the same order in which pages
+        would be rendered serially.
+        """
+        global forked_website
+        forked_website = self
+
+        # created before forking so workers share the parent's entries
+        self.wrapper.highlight_cache()
+        self.wrapper.jinja_bytecode_cache()
+
+        jobs = min(self.wrapper.report_jobs, len(docs))
+        self.log_debug("rendering %s pages using %s processes" % (len(docs), jobs))
+
+        pool = multiprocessing.Pool(jobs, init_forked_worker)
+        try:
+            doc_keys = [doc.key_with_class() for doc in docs]
+            results = pool.map(process_doc_in_forked_worker, doc_keys)
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+            forked_website = None
+
+        for files, cache_changes, error in results:
+            self.merge_cache_changes(cache_changes)
+
+        for doc, (files, cache_changes, error) in zip(docs, results):
+            if error:
+                message, tb = error
+                self.log_debug(tb)
+                msg = "error rendering %s in website reporter: %s"
+                raise dexy.exceptions.UserFeedback(msg % (doc.key, message))
+            self.new_manifest['files'].update(files)
+
+    def merge_cache_changes(self, cache_changes):
+        highlights, dumped = cache_changes
+        if highlights:
+            self.wrapper.highlight_cache().merge_changes(highlights)
+        self.wrapper.jinja_bytecode_cache().merge_dumped(dumped)
+
     def setup(self):
         self.keys_to_outfiles = []
         self.locations = {}
+        self._jinja_environments = {}
+        self._template_digests = {}
+        self._links = None
         self.create_reports_dir()
         self.setup_navobj()
 
     def setup_navobj(self):
         self._navobj = self.create_navobj()
+        self._nav_digest = self._navobj.digest()
+
+    def published_batch(self):
+        """
+        Returns a batch of the docs making up the website. On targeted runs
+        this includes docs published by previous runs which were not run this
+        time, so navigation covers the whole site.
+        """
+        if self.wrapper.target and hasattr(self, 'manifest'):
+            batch = dexy.batch.Batch(self.wrapper)
+            batch.docs.update(self.manifest.get('docs', {}))
+            batch.docs.update(self.wrapper.batch.docs)
+            return batch
+        else:
+            return self.wrapper.batch
 
     def should_process(self, doc):
         if not doc.key_with_class() in self.wrapper.batch.docs:
@@ -146,7 +261,7 @@ class Website(Output):
 
     def create_navobj(self):
         navobj = Navigation()
-        navobj.populate_lookup_table(self.wrapper.batch)
+        navobj.populate_lookup_table(self.published_batch())
         navobj.walk()
         return navobj
 
@@ -175,7 +290,8 @@ class Website(Output):
 
     def jinja_environment(self, template_path, additional_args=None):
         """
-        Returns jinja Environment object.
+        Returns jinja Environment object, shared by all pages using templates
+        in the same directory.
         """
         args = {
                 'undefined' : jinja2.StrictUndefined
@@ -184,11 +300,17 @@ class Website(Output):
         if additional_args:
             args.update(additional_args)
 
+        key = repr((os.path.dirname(template_path), sorted(args.iteritems()),))
+        if key in self._jinja_environments:
+            return self._jinja_environments[key]
+
+        args['bytecode_cache'] = self.wrapper.jinja_bytecode_cache()
         env = Environment(**args)
 
         dirs = [".", os.path.dirname(__file__), os.path.dirname(template_path)]
         env.loader = FileSystemLoader(dirs)
 
+        self._jinja_environments[key] = env
         return env
 
     def apply_jinja_to_page_content(self, doc, env_data):
@@ -236,27 +358,108 @@ class Website(Output):
         basename, ext = os.path.splitext(filename)
         return "%s.html" % basename
 
+    def template_digest(self, env, template_path):
+        """
+        Returns a digest of the template source and of all templates it
+        includes, imports or extends, or None if these can't be determined.
+        """
+        if not template_path in self._template_digests:
+            h = hashlib.md5()
+            seen = set()
+            pending = [template_path]
+            while pending:
+                name = pending.pop()
+                if name in seen:
+                    continue
+                seen.add(name)
+
+                try:
+                    source = env.loader.get_source(env, name)[0]
+                except jinja2.TemplateNotFound:
+                    h = None
+                    break
+
+                h.update(name)
+                h.update(source.encode("utf-8"))
+
+                referenced = list(jinja2.meta.find_referenced_templates(env.parse(source)))
+                if None in referenced:
+                    # template names computed at render time
+                    h = None
+                    break
+                pending.extend(referenced)
+
+            self._template_digests[template_path] = h and h.hexdigest()
+        return self._template_digests[template_path]
+
+    def page_signature(self, doc, env, template_path):
+        """
+        Returns a digest of everything a rendered page depends on apart from
+        links to other pages, which are checked separately.
+        """
+        template_digest = self.template_digest(env, template_path)
+        if template_digest:
+            h = hashlib.md5()
+            h.update(self.data_signature(doc.output_data()))
+            h.update(template_digest)
+            h.update(self._nav_digest)
+            return h.hexdigest()
+
+    def links_unchanged(self, data, links):
+        """
+        Whether links created when a page was last rendered would still be
+        rendered the same way.
+        """
+        for args, html in links.iteritems():
+            method_name = args[0]
+            try:
+                if getattr(self, method_name)(data, *args[1:]) != html:
+                    return False
+            except dexy.exceptions.UserFeedback:
+                return False
+        return True
+
+    def record_link(self, args, html):
+        if self._links is not None:
+            self._links[args] = html
+
     def apply_and_render_template(self, doc):
         template_info = self.template_file_and_path(doc)
         template_file, template_path = template_info
-        env_data = self.template_environment(doc, template_path)
 
         self.log_debug("  creating jinja environment")
         env = self.jinja_environment(template_path)
 
-        self.log_debug("  loading jinja template at %s" % template_path)
-        template = env.get_template(template_path)
-       
         output_file = self.fix_ext(doc.output_data().output_name())
         output_path = os.path.join(self.setting('dir'), output_file)
 
+        signature = self.page_signature(doc, env, template_path)
+        if self.is_current(output_path, signature):
+            entry = self.manifest['files'][output_path]
+            if self.links_unchanged(doc.output_data(), entry.get('links', {})):
+                self.log_debug("  %s is up to date" % output_path)
+                self.keep_file(output_path)
+                return
+
+        self._links = {}
+        env_data = self.template_environment(doc, template_path)
+
+        self.log_debug("  loading jinja template at %s" % template_path)
+        template = env.get_template(template_path)
+       
         try:
             os.makedirs(os.path.dirname(output_path))
         except os.error:
             pass
 
+        if os.path.lexists(output_path):
+            # don't write through a hard link made by a previous run
+            os.remove(output_path)
+
         self.log_debug("  writing to %s" % (output_path))
         template.stream(env_data).dump(output_path, encoding="utf-8")
+        self.record_file(output_path, signature, links=self._links)
+        self._links = None
 
     def help(self, data):
         nodoc = ('navobj', 'navigation',)
@@ -353,6 +556,7 @@ class Website(Output):
         Returns an HTML link to section without needing to specify which
         document it is in (section name must be globally unique).
         """
+        link_args = ('section', section_name, url_base, link_text,)
         matching_nodes = self.wrapper.lookup_sections.get(section_name)
 
         if not matching_nodes:
@@ -373,12 +577,15 @@ class Website(Output):
         if not link_text:
             link_text = section_name
 
-        return self.link_for(url_base, data.relative_path_to(link_to_data.output_name()), link_text, anchor)
+        link_html = self.link_for(url_base, data.relative_path_to(link_to_data.output_name()), link_text, anchor)
+        self.record_link(link_args, link_html)
+        return link_html
 
     def link(self, data, doc_key, section_name=None, url_base=None, link_text = None, description=False):
         """
         Returns an HTML link to document, optionally with an anchor linking to section.
         """
+        link_args = ('link', doc_key, section_name, url_base, link_text, description,)
         matching_nodes = self.wrapper.lookup_nodes.get(doc_key)
 
         if not matching_nodes:
@@ -416,9 +623,10 @@ class Website(Output):
         link_html = self.link_for(url_base, relative_link_to, link_text, anchor)
 
         if description and link_to_data.safe_setting('description'):
-            return "%s\n<p>%s</p>" % (link_html, link_to_data.setting('description'))
-        else:
-            return link_html
+            link_html = "%s\n<p>%s</p>" % (link_html, link_to_data.setting('description'))
+
+        self.record_link(link_args, link_html)
+        return link_html
 
     def link_for(self, url_base, link, link_text, anchor=None):
         if url_base:
@@ -480,6 +688,21 @@ class Navigation(object):
             if info.has_key('index-page'):
                 parent.index_page = info['index-page']
 
+    def digest(self):
+        """
+        Returns a digest of the locations, titles and index pages of docs in
+        the navigation tree, which changes if any page's navigation would.
+        """
+        h = hashlib.md5()
+        for path in sorted(self.lookup_table):
+            info = self.lookup_table[path]
+            h.update(path)
+            for data in sorted(info['docs']):
+                h.update(repr((data.output_name(), data.title(),)))
+            if info.has_key('index-page'):
+                h.update(repr(info['index-page'].output_name()))
+        return h.hexdigest()
+
     def debug(self):
         """
         Returns a dump of useful information.
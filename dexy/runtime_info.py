@@ -0,0 +1,100 @@
+import dexy.utils
+import os
+
+class RuntimeInfoStore(object):
+    """
+    Stores a digest of each node's args and the runtime info of each doc in a
+    single file, which is read once per run.
+
+    Arg digests are keyed by node key_with_class and are compared to detect
+    changed args, runtime info is keyed by doc hashid. Encodings detected by
+    chardet are also kept, keyed by data storage key.
+
+    This is kept apart from the CacheIndex, whose saved copy is removed when
+    a run starts and rebuilt by scanning the cache dir after an interrupted
+    run. Runtime info can't be rebuilt from the cache dir, and is saved
+    whenever it changed, also after a failed run.
+    """
+    def __init__(self, wrapper):
+        self.wrapper = wrapper
+        self.args = {}
+        self.runtime = {}
+        self.encodings = {}
+        self.dirty = False
+
+    def filepath(self):
+        return os.path.join(self.wrapper.artifacts_dir, "runtime-info.pickle")
+
+    def load(self):
+        info = dexy.utils.load_pickle(self.wrapper, self.filepath(), {})
+        self.args = info.get('args', {})
+        self.runtime = info.get('runtime', {})
+        self.encodings = info.get('encodings', {})
+
+    def save(self):
+        if not self.dirty:
+            return
+
+        info = {
+                'args' : self.args,
+                'runtime' : self.runtime,
+                'encodings' : self.encodings
+                }
+        dexy.utils.save_pickle(self.wrapper, self.filepath(), info)
+        self.dirty = False
+
+    def args_digest(self, key):
+        return self.args.get(key)
+
+    def set_args_digest(self, key, digest):
+        if self.args.get(key) != digest:
+            self.args[key] = digest
+            self.dirty = True
+
+    def runtime_info(self, hashid):
+        return self.runtime.get(hashid)
+
+    def set_runtime_info(self, hashid, info):
+        self.runtime[hashid] = info
+        self.dirty = True
+
+    def remove_runtime_info(self, hashid):
+        if hashid in self.runtime:
+            del self.runtime[hashid]
+            self.dirty = True
+
+    def detected_encoding(self, storage_key, stamp):
+        """
+        Returns the encoding detected for data with storage_key, if the data
+        file still has the mtime and size in stamp.
+        """
+        detected = self.encodings.get(storage_key)
+        if detected and detected[0] == stamp:
+            return detected[1]
+
+    def set_detected_encoding(self, storage_key, stamp, encoding):
+        if self.encodings.get(storage_key) != (stamp, encoding,):
+            self.encodings[storage_key] = (stamp, encoding,)
+            self.dirty = True
+
+    def prune_args(self, keys):
+        """
+        Forgets arg digests of nodes which are not in keys.
+        """
+        for key in set(self.args) - set(keys):
+            del self.args[key]
+            self.dirty = True
+
+    def prune_runtime_info(self, hashids):
+        """
+        Forgets runtime info of docs which are not in hashids.
+        """
+        for hashid in set(self.runtime) - set(hashids):
+            self.remove_runtime_info(hashid)
+
+        # storage keys start with the doc hashid
+        hashids = set(hashids)
+        for storage_key in list(self.encodings):
+            if not storage_key.split("-")[0] in hashids:
+                del self.encodings[storage_key]
+                self.dirty = True
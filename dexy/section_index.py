@@ -0,0 +1,50 @@
+import dexy.utils
+import os
+
+class SectionIndex(object):
+    """
+    Section names of sectioned data, recorded when the data is saved so that
+    lookups of sections can be built without loading any data.
+
+    Entries are keyed by data filename and hold the mtime and size of the
+    data file they were recorded for, so names are never returned for a data
+    file which has changed since.
+    """
+    def __init__(self, wrapper):
+        self.wrapper = wrapper
+        self.entries = {}
+        self.dirty = False
+
+    def filepath(self):
+        return os.path.join(self.wrapper.artifacts_dir, "section-index.pickle")
+
+    def load(self):
+        self.entries = dexy.utils.load_pickle(self.wrapper, self.filepath(), {})
+
+    def save(self):
+        if not self.dirty:
+            return
+
+        dexy.utils.save_pickle(self.wrapper, self.filepath(), self.entries)
+        self.dirty = False
+
+    def record(self, name, stamp, section_names):
+        self.entries[name] = (stamp, section_names,)
+        self.dirty = True
+
+    def section_names(self, name, stamp):
+        """
+        Returns the section names recorded for the data file, or None if
+        there are none recorded for its current stamp.
+        """
+        entry = self.entries.get(name)
+        if entry and entry[0] == stamp:
+            return entry[1]
+
+    def prune(self, names):
+        """
+        Forgets section names of data files which are not in names.
+        """
+        for name in set(self.entries) - set(names):
+            del self.entries[name]
+            self.dirty = True
@@ -1,9 +1,10 @@
 from dexy.exceptions import UserFeedback
 from dexy.exceptions import InternalDexyProblem
-from dexy.utils import file_exists
 import dexy.exceptions
 import dexy.plugin
+import dexy.utils
 import os
+import re
 import shutil
 import sqlite3
 
@@ -43,49 +44,126 @@ class GenericStorage(Storage):
         Location of data file.
         """
         if read:
-            if os.path.exists(self.this_data_file()):
-                return self.this_data_file()
-            elif os.path.exists(self.last_data_file()):
-                return self.last_data_file()
-            else:
-                return self.this_data_file()
-        else:
-            return self.this_data_file()
+            packed = self.packed_generation()
+            if packed is not None:
+                return self.wrapper.pack().materialize(self.data_filename(), packed)
+        return self.this_data_file()
 
-    def last_data_file(self):
+    def data_filename(self):
         """
-        Location of data file in last/ cache dir.
+        Name of data file, also used as the entry name in pack files.
         """
-        return os.path.join(self.storage_dir(False), "%s%s" % (self.storage_key, self.ext))
+        return "%s%s" % (self.storage_key, self.ext)
 
     def this_data_file(self):
         """
-        Location of data file in this/ cache dir.
+        Location of data file in the cache dir. Data files are not moved
+        between runs, so this is also where data cached by previous runs is.
+        """
+        return os.path.join(self.storage_dir(), self.data_filename())
+
+    def packed_generation(self):
+        """
+        When using the pack cache backend, returns True or False according to
+        whether the data to read is packed in the this or last generation.
+        Returns None if the data should be read from a data file. Packs are
+        the only place where the this and last generations still exist.
+        """
+        pack = self.wrapper.pack()
+        if not pack:
+            return None
+
+        name = self.data_filename()
+        if self.in_cache_dir():
+            return None
+        elif pack.contains(name, True):
+            return True
+        elif pack.contains(name, False):
+            return False
+        else:
+            return None
+
+    def is_packed(self):
+        return self.packed_generation() is not None
+
+    def in_cache_dir(self):
+        """
+        Whether the data file exists in this/, according to the cache index.
         """
-        return os.path.join(self.storage_dir(True), "%s%s" % (self.storage_key, self.ext))
+        return self.wrapper.cache_index().contains(self.data_filename())
 
-    def data_file_exists(self, this):
-        if this:
-            return os.path.exists(self.this_data_file())
+    def data_file_exists(self):
+        return self.in_cache_dir() or self.is_packed()
+
+    def data_file_size(self):
+        packed = self.packed_generation()
+        if packed is not None:
+            return self.wrapper.pack().size(self.data_filename(), packed)
         else:
-            return os.path.exists(self.last_data_file())
+            return self.wrapper.cache_index().size(self.data_filename())
 
-    def data_file_size(self, this):
-        if this:
-            return os.path.getsize(self.this_data_file())
+    def data_file_mtime(self):
+        packed = self.packed_generation()
+        if packed is not None:
+            return int(self.wrapper.pack().mtime(self.data_filename(), packed))
         else:
-            return os.path.getsize(self.last_data_file())
+            return int(self.wrapper.cache_index().mtime(self.data_filename()))
 
-    def storage_dir(self, this=None):
-        if this is None:
-            this = (self.wrapper.state in ('walked', 'running'))
+    def is_linked_to(self, st):
+        """
+        Whether the data file is a hard link to the file with stat st.
+        """
+        if self.is_packed():
+            return False
+        inode = self.wrapper.cache_index().inode(self.data_filename())
+        return inode == (st.st_ino, st.st_dev,)
 
-        if this:
-            cache_dir = self.wrapper.this_cache_dir()
+    def data_file_stamp(self):
+        """
+        Returns the exact mtime and size of the data file, which change
+        whenever the cached data is rewritten.
+        """
+        packed = self.packed_generation()
+        if packed is not None:
+            pack = self.wrapper.pack()
+            return (pack.mtime(self.data_filename(), packed),
+                    pack.size(self.data_filename(), packed),)
         else:
-            cache_dir = self.wrapper.last_cache_dir()
-        
-        return os.path.join(cache_dir, self.storage_key[0:2])
+            index = self.wrapper.cache_index()
+            return (index.mtime(self.data_filename()),
+                    index.size(self.data_filename()),)
+
+    def storage_dir(self):
+        return os.path.join(self.wrapper.this_cache_dir(), self.storage_key[0:2])
+
+    def write_file(self, filepath, data):
+        """
+        Writes bytes to filepath. When using the pack cache backend, small
+        data being written to the cache goes into a pack file instead.
+        """
+        is_data_file = (filepath == self.this_data_file())
+
+        pack = self.wrapper.pack()
+        if pack and is_data_file:
+            if pack.fits(len(data)):
+                pack.write(self.data_filename(), data)
+                self.remove_data_file()
+                return
+            else:
+                pack.remove(self.data_filename())
+
+        # an existing file may be hard linked to a source or report file,
+        # remove it rather than writing through the link
+        if is_data_file:
+            self.remove_data_file()
+        elif os.path.exists(filepath):
+            os.remove(filepath)
+
+        with open(filepath, "wb") as f:
+            f.write(data)
+
+        if is_data_file:
+            self.record_data_file()
 
     def write_data(self, data, filepath=None):
         if not filepath:
@@ -93,18 +171,26 @@ class GenericStorage(Storage):
 
         self.assert_location_is_in_project_dir(filepath)
 
-        if os.path.exists(self.this_data_file()) and not filepath == self.this_data_file():
+        if self.in_cache_dir() and not filepath == self.this_data_file():
             shutil.copyfile(self.this_data_file(), filepath)
+        elif self.is_packed() and not filepath == self.this_data_file():
+            with open(filepath, "wb") as f:
+                f.write(self.read_bytes())
         else:
-             with open(filepath, "wb") as f:
-                 if not isinstance(data, unicode):
-                     f.write(data)
-                 else:
-                     f.write(unicode(data).encode("utf-8"))
+            if isinstance(data, unicode):
+                data = data.encode("utf-8")
+            self.write_file(filepath, data)
+
+    def read_bytes(self):
+        packed = self.packed_generation()
+        if packed is not None:
+            return self.wrapper.pack().read(self.data_filename(), packed)
+        else:
+            with open(self.data_file(read=True), "rb") as f:
+                return f.read()
 
     def read_data(self):
-        with open(self.data_file(read=True), "rb") as f:
-            return f.read()
+        return self.read_bytes()
 
     def copy_file(self, filepath):
         """
@@ -112,12 +198,120 @@ class GenericStorage(Storage):
         """
         try:
             self.assert_location_is_in_project_dir(filepath)
-            this = (self.wrapper.state in ('walked', 'running', 'ran',))
-            shutil.copyfile(self.data_file(this), filepath)
+            if self.is_packed():
+                with open(filepath, "wb") as f:
+                    f.write(self.read_bytes())
+            else:
+                shutil.copyfile(self.this_data_file(), filepath)
             return True
         except:
             return False
 
+    def publish_file(self, filepath):
+        """
+        Publishes data file to filepath for a report using the wrapper's
+        publish mode. Returns False if there is no data file to publish.
+        """
+        self.assert_location_is_in_project_dir(filepath)
+        if self.packed_generation() is not None:
+            if os.path.lexists(filepath):
+                os.remove(filepath)
+            with open(filepath, "wb") as f:
+                f.write(self.read_bytes())
+            return True
+
+        if not self.in_cache_dir():
+            return False
+
+        dexy.utils.publish_file(self.this_data_file(), filepath, self.wrapper.publish_mode)
+        return True
+
+    def copy_from_file(self, filename):
+        """
+        Stores the contents of filename as this data.
+        """
+        pack = self.wrapper.pack()
+        if pack and pack.fits(os.path.getsize(filename)):
+            with open(filename, "rb") as f:
+                self.write_file(self.this_data_file(), f.read())
+        else:
+            if pack:
+                pack.remove(self.data_filename())
+            data_file = self.this_data_file()
+            mode = dexy.utils.publish_file(filename, data_file, self.wrapper.ingest_mode)
+            self.record_data_file()
+            if mode == 'link':
+                self.wrapper.ingest_index().record(self.data_filename(), data_file)
+
+    def link_from(self, other):
+        """
+        Makes the data file hold the same bytes as the data file of other
+        storage, which has been written during this run, by sharing its pack
+        entry or hard linking its file. Returns False if other has no data.
+        """
+        pack = self.wrapper.pack()
+        if other.is_packed():
+            self.remove_data_file()
+            pack.share(self.data_filename(), other.data_filename())
+            return True
+        elif other.in_cache_dir():
+            if pack:
+                pack.remove(self.data_filename())
+            dexy.utils.publish_file(other.this_data_file(), self.this_data_file(), 'link')
+            self.record_data_file()
+            return True
+        else:
+            return False
+
+    def sync_data_file(self):
+        """
+        Called after a filter has run, since filters may write directly to
+        the data file. Updates the cache index, and moves a small data file
+        into the pack if using the pack cache backend.
+        """
+        self.record_data_file()
+
+        pack = self.wrapper.pack()
+        if pack and self.in_cache_dir() and pack.fits(self.data_file_size()):
+            with open(self.this_data_file(), "rb") as f:
+                self.write_file(self.this_data_file(), f.read())
+
+    def record_data_file(self):
+        """
+        Updates the cache index entry for the data file.
+        """
+        self.wrapper.cache_index().record(self.this_data_file())
+
+    def record_section_names(self, section_names):
+        """
+        Records the section names of the data file just saved to this/ in
+        the section index, so lookups of sections don't need to load it.
+        """
+        self.wrapper.section_index().record(self.data_filename(),
+                self.data_file_stamp(), section_names)
+
+    def section_names(self):
+        """
+        Returns the section names recorded when the data was saved, or None
+        if none were recorded or the data file has changed since.
+        """
+        try:
+            stamp = self.data_file_stamp()
+        except KeyError:
+            return None
+        return self.wrapper.section_index().section_names(self.data_filename(), stamp)
+
+    def remove_data_file(self):
+        """
+        Removes the data file from this/, e.g. because it is out of date.
+        """
+        if self.in_cache_dir():
+            try:
+                os.remove(self.this_data_file())
+            except OSError:
+                pass
+            self.wrapper.cache_index().remove(self.data_filename())
+
 # Sectioned Data
 import json
 class JsonSectionedStorage(GenericStorage):
@@ -126,22 +320,22 @@ class JsonSectionedStorage(GenericStorage):
     """
     aliases = ['jsonsectioned']
 
-    def read_data(self, this=True):
-        with open(self.data_file(this), "rb") as f:
-            data = json.load(f)
-            if hasattr(data, 'keys'):
-                msg = "Data storage format has changed. Please clear your dexy cache by running dexy with '-r' option."
-                raise UserFeedback(msg)
-            return data
+    def read_data(self):
+        data = json.loads(self.read_bytes())
+        if hasattr(data, 'keys'):
+            msg = "Data storage format has changed. Please clear your dexy cache by running dexy with '-r' option."
+            raise UserFeedback(msg)
+        return data
 
     def write_data(self, data, filepath=None):
         if not filepath:
-            filepath = self.data_file()
+            filepath = self.data_file(read=False)
 
         self.assert_location_is_in_project_dir(filepath)
+        self.write_file(filepath, json.dumps(data))
 
-        with open(filepath, "wb") as f:
-            json.dump(data, f)
+        if filepath == self.this_data_file():
+            self.record_section_names([section['name'] for section in data[1:]])
 
 # Key Value Data
 class JsonKeyValueStorage(GenericStorage):
@@ -171,9 +365,8 @@ class JsonKeyValueStorage(GenericStorage):
     def iteritems(self):
         return self.data().iteritems()
 
-    def read_data(self, this=True):
-        with open(self.data_file(this), "rb") as f:
-            return json.load(f)
+    def read_data(self):
+        return json.loads(self.read_bytes())
 
     def data(self):
         if len(self._data) == 0:
@@ -185,18 +378,24 @@ class JsonKeyValueStorage(GenericStorage):
 
     def write_data(self, data, filepath=None):
         if not filepath:
-            filepath = self.data_file()
+            filepath = self.data_file(read=False)
 
         self.assert_location_is_in_project_dir(filepath)
+        self.write_file(filepath, json.dumps(data))
 
-        with open(filepath, "wb") as f:
-            json.dump(data, f)
+        if filepath == self.this_data_file():
+            self.record_section_names(list(data.keys()))
 
 class Sqlite3KeyValueStorage(GenericStorage):
     """
     Storage of key value storage in sqlite3 database files.
     """
     aliases = ['sqlite3']
+    _settings = {
+            'batch-size' : ("Number of appended rows to buffer before writing them in a single executemany call.", 5000),
+            }
+
+    BINDABLE_TYPES = (type(None), int, long, float, unicode, buffer,)
 
     def working_file(self):
         sk = self.storage_key[0:2]
@@ -207,88 +406,184 @@ class Sqlite3KeyValueStorage(GenericStorage):
                 )
         return os.path.join(*pathargs)
 
+    def setup(self):
+        self._pending = []
+        self._storage = None
+        self._cursor = None
+        self._connected = False
+
+    def connect_to_file(self, filepath):
+        self._storage = sqlite3.connect(filepath)
+        self._cursor = self._storage.cursor()
+
     def connect(self):
-        self._append_counter = 0
+        self._pending = []
+        self._storage = None
+        self._cursor = None
+        self._connected = True
         if self.wrapper.state in ('walked', 'checked', 'running'):
-            if file_exists(self.this_data_file()):
+            if self.data_file_exists():
                 self.connected_to = 'existing'
-                self._storage = sqlite3.connect(self.this_data_file())
-                self._cursor = self._storage.cursor()
-            elif file_exists(self.last_data_file()):
-                msg ="Should not only have last data file %s"
-                msgargs=(self.last_data_file())
-                raise dexy.exceptions.InternalDexyProblem(msg % msgargs)
             else:
                 assert not os.path.exists(self.working_file())
                 assert os.path.exists(os.path.dirname(self.working_file()))
                 self.connected_to = 'working'
-                self._storage = sqlite3.connect(self.working_file())
-                self._cursor = self._storage.cursor()
+                self.connect_to_file(self.working_file())
+                # The working file is scratch space until persist() renames
+                # it into the cache, so no need to pay for durability.
+                self._cursor.execute("PRAGMA journal_mode = MEMORY")
+                self._cursor.execute("PRAGMA synchronous = OFF")
                 self._cursor.execute("CREATE TABLE kvstore (key TEXT, value TEXT)")
         elif self.wrapper.state == 'walked':
             raise dexy.exceptions.InternalDexyProblem("connect should not be called in 'walked' state")
-        else:
-            if file_exists(self.last_data_file()):
-                self._storage = sqlite3.connect(self.last_data_file())
-                self._cursor = self._storage.cursor()
-            elif file_exists(self.this_data_file()):
-                self._storage = sqlite3.connect(self.this_data_file())
-                self._cursor = self._storage.cursor()
-            else:
-                raise dexy.exceptions.InternalDexyProblem("no data for %s" % self.storage_key)
+        elif not self.data_file_exists():
+            raise dexy.exceptions.InternalDexyProblem("no data for %s" % self.storage_key)
+
+    def cursor(self):
+        """
+        Returns a cursor, opening existing databases on first use since
+        consolidating the cache connects every cached store. Data which has
+        not been connected, e.g. data from the batch, is connected here.
+        Existing databases are opened through the wrapper's shared
+        connections.
+        """
+        if not self._cursor:
+            if not self._connected:
+                self.connect()
+                if self._cursor:
+                    return self._cursor
+
+            self._storage = self.wrapper.sqlite_connection(self.data_file())
+            self._cursor = self._storage.cursor()
+        return self._cursor
+
+    def check_bindable(self, value):
+        """
+        Raises the error sqlite3 would raise when binding value. Rows are
+        inserted in batches, so check when appending to keep errors local to
+        the append() call which caused them. Values of other types are
+        converted by sqlite3's adapters first, like sqlite3 does when binding.
+        """
+        if not isinstance(value, self.BINDABLE_TYPES + (str,)):
+            try:
+                value = sqlite3.adapt(value)
+            except sqlite3.ProgrammingError:
+                raise sqlite3.InterfaceError("Error binding parameter - probably unsupported type.")
+
+        if isinstance(value, str):
+            try:
+                value.decode('ascii')
+            except UnicodeDecodeError:
+                msg = "You must not use 8-bit bytestrings unless you use a text_factory that can interpret 8-bit bytestrings."
+                raise sqlite3.ProgrammingError(msg)
+        elif not isinstance(value, self.BINDABLE_TYPES):
+            raise sqlite3.InterfaceError("Error binding parameter - probably unsupported type.")
 
     def append(self, key, value):
-        self._cursor.execute("INSERT INTO kvstore VALUES (?, ?)", (key, value))
-        self._append_counter += 1
-        if self._append_counter > 1000:
-            self.wrapper.log.debug("intermediate commit to sqlite db, resetting append counter to 0")
-            self._storage.commit()
-            self._append_counter = 0
+        self.check_bindable(key)
+        self.check_bindable(value)
+        self._pending.append((key, value,))
+        if len(self._pending) >= self.setting('batch-size'):
+            self.flush()
+
+    def flush(self):
+        """
+        Writes any buffered rows to the database.
+        """
+        if self._pending:
+            self.cursor().executemany("INSERT INTO kvstore VALUES (?, ?)", self._pending)
+            self._pending = []
 
     def keys(self):
-        self._cursor.execute("SELECT key from kvstore")
-        return [unicode(k[0]) for k in self._cursor.fetchall()]
+        self.flush()
+        self.cursor().execute("SELECT key from kvstore")
+        return [unicode(k[0]) for k in self.cursor().fetchall()]
 
     def iteritems(self):
-        self._cursor.execute("SELECT key, value from kvstore")
-        for k in self._cursor.fetchall():
+        self.flush()
+        self.cursor().execute("SELECT key, value from kvstore")
+        for k in self.cursor().fetchall():
             yield (unicode(k[0]), k[1])
 
     def items(self):
         return [(key, value) for (key, value) in self.iteritems()]
 
     def value(self, key):
-        self._cursor.execute("SELECT value from kvstore where key = ?", (key,))
-        row = self._cursor.fetchone()
+        self.flush()
+        self.cursor().execute("SELECT value from kvstore where key = ?", (key,))
+        row = self.cursor().fetchone()
         if not row:
             raise Exception("No value found for key '%s'" % key)
         else:
             return row[0]
 
+    def like_prefix(self, pattern):
+        """
+        Returns the literal text before the first wildcard in a LIKE pattern.
+        """
+        return re.split("[%_]", pattern, 1)[0]
+
     def like(self, key):
-        self._cursor.execute("SELECT value from kvstore where key LIKE ?", (key,))
-        row = self._cursor.fetchone()
+        self.flush()
+        prefix = self.like_prefix(key)
+        if prefix:
+            # sqlite won't use an index for LIKE with a bound parameter, so
+            # give it an explicit range on the case-insensitive key index.
+            sql = """SELECT value from kvstore where
+                key COLLATE NOCASE >= ? AND key COLLATE NOCASE < ? AND key LIKE ?
+                ORDER BY rowid LIMIT 1"""
+            self.cursor().execute(sql, (prefix, prefix + u"\U0010ffff", key,))
+        else:
+            self.cursor().execute("SELECT value from kvstore where key LIKE ?", (key,))
+        row = self.cursor().fetchone()
         if not row:
             raise Exception("No value found for key '%s'" % key)
         else:
             return row[0]
 
     def query(self, query):
+        self.flush()
         if not '%' in query:
             query = "%%%s%%" % query
-        self._cursor.execute("SELECT * from kvstore where key like ?", (query,))
-        return self._cursor.fetchall()
+        self.cursor().execute("SELECT * from kvstore where key like ?", (query,))
+        return self.cursor().fetchall()
 
     def __getitem__(self, key):
         return self.value(key)
 
+    def create_indexes(self):
+        """
+        Indexes keys so value() and prefix like() lookups don't scan the table.
+        Building the indexes once after all rows are in is cheaper than
+        maintaining them on every insert.
+        """
+        self.cursor().execute("CREATE INDEX IF NOT EXISTS kvstore_key ON kvstore (key)")
+        self.cursor().execute("CREATE INDEX IF NOT EXISTS kvstore_key_nocase ON kvstore (key COLLATE NOCASE)")
+
     def persist(self):
         if self.connected_to == 'existing':
-            assert os.path.exists(self.data_file(read=False))
+            assert self.data_file_exists()
         elif self.connected_to == 'working':
             self.assert_location_is_in_project_dir(self.data_file(read=False))
+            self.flush()
+            self.create_indexes()
             self._storage.commit()
-            shutil.copyfile(self.working_file(), self.data_file(read=False))
+            section_names = self.keys()
+            self._storage.close()
+
+            pack = self.wrapper.pack()
+            if pack and pack.fits(os.path.getsize(self.working_file())):
+                filepath = pack.write_file(self.data_filename(), self.working_file())
+            else:
+                # work/ and this/ are both in the artifacts dir, so this is a
+                # rename rather than a copy.
+                filepath = self.data_file(read=False)
+                os.rename(self.working_file(), filepath)
+                self.record_data_file()
+
+            self.record_section_names(section_names)
+            self.connected_to = 'existing'
+            self.connect_to_file(filepath)
         else:
             msg = "Unexpected 'connected_to' value %s"
             msgargs = self.connected_to
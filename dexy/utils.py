@@ -1,3 +1,4 @@
+import contextlib
 import dexy.exceptions
 import hashlib
 import inspect
@@ -10,23 +11,101 @@ import re
 import shutil
 import tempfile
 import time
+import uuid
 import yaml
 
 is_windows = platform.system() in ('Windows',)
 
+try:
+    import fcntl
+    AVAILABLE_FCNTL = True
+except ImportError:
+    AVAILABLE_FCNTL = False
+
+# use libyaml's much faster loader when pyyaml was built with it
+try:
+    YamlLoader = yaml.CSafeLoader
+except AttributeError:
+    YamlLoader = yaml.SafeLoader
+
+# ioctl request to clone a file's extents (linux/fs.h), supported by
+# copy-on-write filesystems like btrfs and xfs
+FICLONE = 0x40049409
+
+publish_modes = ('copy', 'link', 'reflink',)
+
 def copy_or_link(data, destination, use_links=True, read_only_links=True):
     """
     Copies or makes a hard link. Will copy if on windows or if use_links is False.
+
+    Data files which are already hard linked elsewhere, e.g. to a source file
+    ingested using the 'link' ingest mode, are cloned or copied instead so
+    whatever uses the destination can't modify the original.
     """
     if is_windows or not use_links:
         data.output_to_file(destination)
     else:
-        os.link(data.storage.data_file(), destination)
+        data_file = data.storage.data_file()
+        if os.stat(data_file).st_nlink > 1:
+            publish_file(data_file, destination, 'reflink')
+        else:
+            os.link(data_file, destination)
+
+def reflink_file(source, destination):
+    """
+    Creates destination as a copy-on-write clone of source. Raises IOError if
+    the filesystem doesn't support this.
+    """
+    if not AVAILABLE_FCNTL:
+        raise IOError("reflinks are not supported on this platform")
+
+    with open(source, 'rb') as src:
+        with open(destination, 'wb') as dest:
+            try:
+                fcntl.ioctl(dest.fileno(), FICLONE, src.fileno())
+            except (IOError, OSError):
+                os.remove(destination)
+                raise
+
+def publish_file(source, destination, mode='copy'):
+    """
+    Makes destination a file with the contents of source, using a hard link,
+    a reflink or a copy depending on mode. Falls back to copying if links
+    can't be made, e.g. because destination is on another filesystem.
+
+    Any existing file at destination is removed first, so a file which was
+    hard linked by a previous run is never written through.
+    """
+    if not mode in publish_modes:
+        msg = "'%s' is not a valid publish mode, should be one of %s"
+        msgargs = (mode, ", ".join(publish_modes))
+        raise dexy.exceptions.UserFeedback(msg % msgargs)
+
+    if os.path.lexists(destination):
+        os.remove(destination)
+
+    if mode == 'link' and not is_windows:
+        try:
+            os.link(source, destination)
+            return mode
+        except OSError:
+            pass
+    elif mode == 'reflink':
+        try:
+            reflink_file(source, destination)
+            return mode
+        except (IOError, OSError):
+            pass
+
+    shutil.copyfile(source, destination)
+    return 'copy'
 
 defaults = {
     'artifacts_dir' : '.dexy',
+    'cache_backend' : 'files',
     'config_file' : 'dexy.conf',
     'configs' : '',
+    'data_cache_mb' : 256,
     'debug' : False,
     'directory' : ".",
     'dont_use_cache' : False,
@@ -34,11 +113,13 @@ defaults = {
     'encoding' : 'utf-8',
     'exclude' : '.git, .svn, tmp, cache, .trash, .ipynb_checkpoints',
     'exclude_also' : '',
+    'filter_jobs' : 1,
     'full' : False,
     'globals' : '',
     'hashfunction' : 'md5',
     'ignore_nonzero_exit' : False,
     'include' : '',
+    'ingest_mode' : 'copy',
     'log_dir' : '.dexy',
     'log_file' : 'dexy.log',
     'log_format' : "%(name)s - %(levelname)s - %(message)s",
@@ -48,7 +129,9 @@ defaults = {
     'pickle' : 'c',
     'plugins': 'dexyplugins.py dexyplugin.py dexyplugins.yaml dexyplugin.yaml',
     'profile' : False,
+    'publish_mode' : 'copy',
     'recurse' : True,
+    'report_jobs' : 1,
     'reports' : '',
     'safety_filename' : '.dexy-generated',
     'siblings' : False,
@@ -100,6 +183,46 @@ def pickle_lib(wrapper):
         msg = "'%s' is not a valid value for pickle" % wrapper.pickle
         raise dexy.exceptions.UserFeedback(msg)
 
+@contextlib.contextmanager
+def atomic_file(filepath):
+    """
+    Yields a file to write in place of filepath, which is renamed to
+    filepath once written, so readers never see a partially written file.
+    """
+    tmp_filepath = "%s-%s" % (filepath, uuid.uuid4())
+    try:
+        with open(tmp_filepath, 'wb') as f:
+            yield f
+        if is_windows and os.path.exists(filepath):
+            os.remove(filepath)
+        os.rename(tmp_filepath, filepath)
+    except:
+        if os.path.exists(tmp_filepath):
+            os.remove(tmp_filepath)
+        raise
+
+def save_pickle(wrapper, filepath, obj):
+    """
+    Pickles obj to filepath, replacing any existing file atomically.
+    """
+    pickle = pickle_lib(wrapper)
+    with atomic_file(filepath) as f:
+        pickle.dump(obj, f)
+
+def load_pickle(wrapper, filepath, default=None):
+    """
+    Returns the object pickled in filepath, or default if the file is
+    missing or can't be unpickled, e.g. because it is truncated or was
+    written by an incompatible version.
+    """
+    pickle = pickle_lib(wrapper)
+    try:
+        with open(filepath, 'rb') as f:
+            return pickle.load(f)
+    except (IOError, EOFError, ValueError, TypeError, IndexError, KeyError,
+            AttributeError, ImportError, pickle.UnpicklingError):
+        return default
+
 
 def logging_log_level(log_level):
     try:
@@ -246,12 +369,23 @@ def parse_json_from_file(f):
         msg += unicode(e)
         raise dexy.exceptions.UserFeedback(msg)
 
+def load_yaml(input_text):
+    """
+    Loads a single YAML document using libyaml if available. If libyaml can't
+    load the text it is loaded again with the pure python loader, whose error
+    messages are more helpful.
+    """
+    try:
+        return yaml.load(input_text, Loader=YamlLoader)
+    except yaml.YAMLError:
+        return yaml.load(input_text, Loader=yaml.SafeLoader)
+
 def parse_yaml(input_text):
     """
     Parse a single YAML document.
     """
     try:
-        return yaml.safe_load(input_text)
+        return load_yaml(input_text)
     except (yaml.scanner.ScannerError, yaml.parser.ParserError) as e:
         if "found character '\\t'" in unicode(e):
             msg = "You appear to have hard tabs in your yaml, this is not supported. Please change to using soft tabs instead (your text editor should have this option)."
@@ -268,7 +402,7 @@ def parse_yamls(input_text):
     Parse YAML content that may include more than 1 document.
     """
     try:
-        return yaml.safe_load_all(input_text)
+        return yaml.load_all(input_text, Loader=YamlLoader)
     except (yaml.scanner.ScannerError, yaml.parser.ParserError) as e:
         msg = inspect.cleandoc(u"""Was unable to parse the YAML you supplied.
         Here is information from the YAML parser:""")
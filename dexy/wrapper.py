@@ -4,16 +4,29 @@ from dexy.exceptions import UserFeedback
 from dexy.utils import file_exists
 from dexy.utils import s
 import chardet
+import dexy.ast_cache
 import dexy.batch
+import dexy.cache_index
+import dexy.data
+import dexy.data_cache
 import dexy.doc
+import dexy.filter_pool
+import dexy.glob_index
+import dexy.highlight
+import dexy.ingest
+import dexy.jinja_cache
+import dexy.pack
 import dexy.parser
 import dexy.reporter
+import dexy.runtime_info
+import dexy.section_index
 import dexy.utils
 import logging
 import logging.handlers
 import os
 import posixpath
 import shutil
+import sqlite3
 import sys
 import textwrap
 import time
@@ -26,6 +39,9 @@ class Wrapper(object):
     """
     _required_dirs = ['artifacts_dir']
 
+    # bytes of text which chardet looks at before falling back to all of it
+    chardet_sample_size = 64 * 1024
+
     state_transitions = (
             (None, 'new'),
             ('new', 'valid'),
@@ -85,6 +101,21 @@ class Wrapper(object):
         self.current_task = None
         self.lookup_nodes = {} # map of shortcuts/keys to all nodes which can match
         self.lookup_sections = {} # map of section names to nodes
+        self._pack = None # loaded on first use, see pack()
+        self.file_probes = None # filemap lookups made while parsing configs, see parse_configs()
+        self._cache_index = None # loaded on first use, see cache_index()
+        self._data_cache = None # created on first use, see data_cache()
+        self._glob_index = None # built on first use, see glob_index()
+        self.filter_pool = None # runs pure filters ahead during run(), see dexy.filter_pool
+        self.work_outputs = {} # output data of pure filters by work key during run(), see Doc.run
+        self._highlight_cache = None # created on first use, see highlight_cache()
+        self._ingest_index = None # loaded on first use, see ingest_index()
+        self._runtime_info_store = None # loaded on first use, see runtime_info_store()
+        self._section_index = None # loaded on first use, see section_index()
+        self.sqlite_connections = {} # shared connections to cached databases, see sqlite_connection()
+        self._jinja_bytecode_cache = None # created on first use, see jinja_bytecode_cache()
+        self.jinja_environments = {} # map of jinja settings to shared environments
+        self.template_plugin_output = {} # cached output of template plugins, see TemplatePlugin.run_cached()
         self.transition('new')
 
     def state_message(self):
@@ -127,14 +158,18 @@ class Wrapper(object):
         if not os.path.exists(self.this_cache_dir()):
             self.create_cache_dir_with_sub_dirs(self.this_cache_dir())
 
-        # Load information about arguments from previous batch.
-        self.load_node_argstrings()
+        # Files in this/ will change from here on, so the saved cache index
+        # must not be trusted by a later run unless this one finishes.
+        self.cache_index().invalidate()
 
         self.check_cache()
         self.consolidate_cache()
 
         # Save information about this batch's arguments for next time.
-        self.save_node_argstrings()
+        self.save_node_args_digests()
+
+        if self.pack():
+            self.pack().save()
 
     def check_cache(self):
         """
@@ -145,12 +180,16 @@ class Wrapper(object):
 
     def consolidate_cache(self):
         """
-        Move all cache files from last/ cache to this/ cache
+        Prepare cached nodes for use in this run and remove out of date files
+        belonging to uncached nodes.
         """
         for node in self.roots:
             node.consolidate_cache_files()
 
-        self.trash(self.last_cache_dir())
+        if os.path.exists(self.last_cache_dir()):
+            self.trash(self.last_cache_dir())
+        if self.pack():
+            self.pack().drop_last()
 
     def to_checked(self):
         self.check()
@@ -161,11 +200,165 @@ class Wrapper(object):
         return os.path.join(self.artifacts_dir, "this")
 
     def last_cache_dir(self):
+        """
+        Previous generation of cache files, only created by older versions of
+        dexy which moved all cache files between this/ and last/ each run.
+        """
         return os.path.join(self.artifacts_dir, "last")
 
+    def reachable_docs(self):
+        """
+        Returns all docs in this run, including additional docs created by
+        filters.
+        """
+        docs = []
+        nodes = list(self.nodes.values())
+        while nodes:
+            node = nodes.pop()
+            nodes.extend(node.additional_docs)
+            if isinstance(node, dexy.doc.Doc):
+                docs.append(node)
+        return docs
+
+    def reachable_cache_filenames(self, docs):
+        """
+        Returns the names of all files in this/ which belong to docs.
+        """
+        filenames = set()
+        for doc in docs:
+            doc.setup_datas()
+            filenames.update(d.storage.data_filename() for d in doc.datas())
+        return filenames
+
+    def collect_cache_garbage(self):
+        """
+        Removes files in this/, runtime info and section names which don't
+        belong to any node in this run.
+        """
+        docs = self.reachable_docs()
+        self.runtime_info_store().prune_runtime_info(doc.hashid for doc in docs)
+
+        reachable = self.reachable_cache_filenames(docs)
+        self.section_index().prune(reachable)
+
+        index = self.cache_index()
+        for filename in index.names() - reachable:
+            self.log.debug("removing unreachable cache file %s" % filename)
+            try:
+                os.remove(os.path.join(self.this_cache_dir(), filename[0:2], filename))
+            except OSError:
+                pass
+            index.remove(filename)
+
     def work_cache_dir(self):
         return os.path.join(self.artifacts_dir, "work")
 
+    def pack(self):
+        """
+        Returns the Pack which small cached artifacts are stored in, or None
+        if each artifact is cached in its own file.
+        """
+        if self._pack is None and self.cache_backend != 'files':
+            self._pack = dexy.pack.create_pack(self)
+        return self._pack
+
+    def cache_index(self):
+        """
+        Returns the CacheIndex of files in the this/ cache dir.
+        """
+        if self._cache_index is None:
+            self._cache_index = dexy.cache_index.CacheIndex(self)
+            self._cache_index.load()
+        return self._cache_index
+
+    def highlight_cache(self):
+        """
+        Returns the HighlightCache shared by filters which syntax highlight.
+        """
+        if self._highlight_cache is None:
+            self._highlight_cache = dexy.highlight.HighlightCache(self)
+        return self._highlight_cache
+
+    def data_cache(self):
+        """
+        Returns the DataCache which limits memory used by loaded doc contents.
+        """
+        if self._data_cache is None:
+            self._data_cache = dexy.data_cache.DataCache(self)
+        return self._data_cache
+
+    def runtime_info_store(self):
+        """
+        Returns the RuntimeInfoStore of node arg digests and runtime info.
+        """
+        if self._runtime_info_store is None:
+            self._runtime_info_store = dexy.runtime_info.RuntimeInfoStore(self)
+            self._runtime_info_store.load()
+        return self._runtime_info_store
+
+    def sqlite_connection(self, filepath):
+        """
+        Returns a connection to the existing sqlite3 database at filepath,
+        shared by all data objects which read it.
+        """
+        filepath = os.path.abspath(filepath)
+        connection = self.sqlite_connections.get(filepath)
+        if connection is None:
+            connection = sqlite3.connect(filepath)
+            self.sqlite_connections[filepath] = connection
+        return connection
+
+    def close_sqlite_connections(self):
+        for connection in self.sqlite_connections.itervalues():
+            connection.close()
+        self.sqlite_connections = {}
+
+    def section_index(self):
+        """
+        Returns the SectionIndex of section names of sectioned data.
+        """
+        if self._section_index is None:
+            self._section_index = dexy.section_index.SectionIndex(self)
+            self._section_index.load()
+        return self._section_index
+
+    def ingest_index(self):
+        """
+        Returns the IngestIndex of source files hard linked into the cache.
+        """
+        if self._ingest_index is None:
+            self._ingest_index = dexy.ingest.IngestIndex(self)
+            self._ingest_index.load()
+        return self._ingest_index
+
+    def jinja_bytecode_cache(self):
+        """
+        Returns the bytecode cache for compiled jinja templates.
+        """
+        if self._jinja_bytecode_cache is None:
+            cache_dir = os.path.join(self.artifacts_dir, "jinja")
+            if not os.path.exists(cache_dir):
+                os.mkdir(cache_dir)
+            self._jinja_bytecode_cache = dexy.jinja_cache.BytecodeCache(cache_dir)
+        return self._jinja_bytecode_cache
+
+    def after_fork(self):
+        """
+        Called in forked worker processes to drop open file handles and
+        database connections inherited from the parent process.
+        """
+        if self._pack:
+            self._pack.close()
+        if self._highlight_cache:
+            self._highlight_cache.after_fork()
+        if self._jinja_bytecode_cache:
+            self._jinja_bytecode_cache.after_fork()
+        self.close_sqlite_connections()
+
+    def highlight_cache_summary(self):
+        if self._highlight_cache:
+            return self._highlight_cache.summary()
+
     def trash_dir(self):
         return os.path.join(self.project_root, ".trash")
 
@@ -223,7 +416,16 @@ class Wrapper(object):
         else:
             matches = self.roots
 
+        self.work_outputs = {}
+        self.jinja_environments = {}
+        self.template_plugin_output = {}
+        self.data_cache().count_consumers(self.nodes.values())
+        self.filter_pool = dexy.filter_pool.create_filter_pool(self)
+
         try:
+            if self.filter_pool:
+                self.filter_pool.start(matches)
+
             for node in matches:
                 for task in node:
                     task()
@@ -244,11 +446,40 @@ class Wrapper(object):
         else:
             self.after_successful_run()
 
+        finally:
+            # also when re-raising errors in debug mode, so forked workers
+            # are stopped and this run's cache state is saved
+            if self.filter_pool:
+                self.filter_pool.stop()
+                self.filter_pool = None
+            self.work_outputs = {}
+            self.data_cache().clear()
+
+            if self.pack():
+                self.pack().save()
+
+            if self._cache_index and self.state == 'ran':
+                self._cache_index.save()
+
+            if self._highlight_cache:
+                self._highlight_cache.save()
+
+            if self._ingest_index:
+                self._ingest_index.save()
+
+            if self._runtime_info_store:
+                self._runtime_info_store.save()
+
+            if self._section_index:
+                self._section_index.save()
+
     def after_successful_run(self):
         self.transition('ran')
         self.batch.end_time = time.time()
         self.batch.save_to_file()
-        shutil.move(self.this_cache_dir(), self.last_cache_dir())
+        self.collect_cache_garbage()
+        if self.pack():
+            self.pack().this_to_last()
         self.empty_trash()
         self.add_lookups()
 
@@ -330,33 +561,15 @@ class Wrapper(object):
     def pickle_lib(self):
         return dexy.utils.pickle_lib(self)
 
-    def node_argstrings_filename(self):
-        return os.path.join(self.artifacts_dir, 'batch.args.pickle')
-
-    def save_node_argstrings(self):
+    def save_node_args_digests(self):
         """
-        Save string representation of node args to check if they have changed.
+        Save digests of node args to check if they have changed.
         """
-        arg_info = {}
-
+        store = self.runtime_info_store()
         for node in self.nodes.values():
-            arg_info[node.key_with_class()] = node.sorted_arg_string()
-
-        with open(self.node_argstrings_filename(), 'wb') as f:
-            pickle = self.pickle_lib()
-            pickle.dump(arg_info, f)
-
-    def load_node_argstrings(self):
-        """
-        Load saved node arg strings into a hash so nodes can check if their
-        args have changed.
-        """
-        try:
-            with open(self.node_argstrings_filename(), 'rb') as f:
-                pickle = self.pickle_lib()
-                self.saved_args = pickle.load(f)
-        except IOError:
-            self.saved_args = {}
+            store.set_args_digest(node.key_with_class(), node.args_digest())
+        store.prune_args(self.nodes)
+        store.save()
 
     # Dexy Dirs
     def iter_dexy_dirs(self):
@@ -581,11 +794,23 @@ class Wrapper(object):
 
         return filemap
 
+    def glob_index(self):
+        """
+        Returns a GlobIndex of the filemap, rebuilt if the filemap has been
+        replaced.
+        """
+        if self._glob_index is None or not self._glob_index.is_current(self.filemap):
+            self._glob_index = dexy.glob_index.GlobIndex(self.filemap)
+        return self._glob_index
+
     def file_available(self, filepath):
         """
         Does the file exist and is it available to dexy?
         """
-        return filepath in self.filemap
+        available = filepath in self.filemap
+        if self.file_probes is not None:
+            self.file_probes[filepath] = available
+        return available
 
     # Running Dexy
     def add_node(self, node):
@@ -597,15 +822,13 @@ class Wrapper(object):
 
     def add_data_to_lookup_nodes(self, key, data):
         if not key in self.lookup_nodes:
-            self.lookup_nodes[key] = []
-        if not data in self.lookup_nodes[key]:
-            self.lookup_nodes[key].append(data)
+            self.lookup_nodes[key] = dexy.data.DataSet()
+        self.lookup_nodes[key].add(data)
 
     def add_data_to_lookup_sections(self, key, data):
         if not key in self.lookup_sections:
-            self.lookup_sections[key] = []
-        if not data in self.lookup_sections[key]:
-            self.lookup_sections[key].append(data)
+            self.lookup_sections[key] = dexy.data.DataSet()
+        self.lookup_sections[key].add(data)
 
     def qualify_key(self, key):
         """
@@ -684,33 +907,49 @@ class Wrapper(object):
         """
         ast = dexy.parser.AbstractSyntaxTree(self)
 
-        processed_configs = []
-
+        configs = []
         for alias in self.parsers.split():
-            parser = dexy.parser.Parser.create_instance(alias, self, ast)
-
             for filepath, fileinfo in self.filemap.iteritems():
                 if fileinfo['dir'] == '.' or self.recurse or self.is_explicit_config(filepath):
                     if os.path.split(filepath)[1] == alias:
                         self.log.info("using config file '%s'" % filepath)
-
-                        config_file = fileinfo['ospath']
-                        dirname = fileinfo['dir']
-
-                        with open(config_file, "r") as f:
+                        with open(fileinfo['ospath'], "r") as f:
                             config_text = f.read()
+                        configs.append((alias, filepath, fileinfo, config_text,))
 
-                        try:
-                            processed_configs.append(filepath)
-                            parser.parse(dirname, config_text)
-                        except UserFeedback:
-                            sys.stderr.write("Problem occurred while parsing %s\n" % config_file)
-                            raise
-
-        if len(processed_configs) == 0:
+        if len(configs) == 0:
             msg = "didn't find any document config files (like %s)"
             self.printmsg(msg % self.parsers)
 
+        digests = [(config_path, dexy.utils.md5_hash(text))
+                for _, config_path, _, text in configs]
+
+        ast_cache = dexy.ast_cache.AstCache(self)
+        if ast_cache.restore(ast, digests):
+            self.log.debug("config files unchanged, using saved syntax tree")
+            return ast
+
+        self.file_probes = {}
+        cacheable = True
+
+        for alias, filepath, fileinfo, config_text in configs:
+            parser = dexy.parser.Parser.create_instance(alias, self, ast)
+            cacheable = cacheable and parser.cacheable
+            try:
+                parser.parse(fileinfo['dir'], config_text)
+            except UserFeedback:
+                self.file_probes = None
+                sys.stderr.write("Problem occurred while parsing %s\n" % fileinfo['ospath'])
+                raise
+
+        probes = self.file_probes
+        self.file_probes = None
+
+        if cacheable:
+            ast_cache.save(ast, digests, probes)
+        else:
+            ast_cache.remove()
+
         return ast
 
     def report(self):
@@ -733,13 +972,35 @@ class Wrapper(object):
     def is_location_in_project_dir(self, filepath):
         return self.writeanywhere or (self.project_root_ts in os.path.abspath(filepath))
 
+    def detect_encoding(self, text):
+        """
+        Returns chardet's guess of the encoding of text, or None. Only the
+        start of long text is examined unless chardet is unsure about it.
+        """
+        sample = text[0:self.chardet_sample_size]
+        result = chardet.detect(sample)
+        if len(sample) < len(text) and (result['confidence'] or 0) < 0.5:
+            result = chardet.detect(text)
+        return result['encoding']
+
+    def decode_detected(self, text, encoding=None):
+        """
+        Decodes text using chardet, or using encoding if it has already been
+        detected. Returns the decoded text and the encoding used.
+        """
+        if not encoding:
+            encoding = self.detect_encoding(text)
+
+        try:
+            return (text.decode(encoding or "utf-8"), encoding,)
+        except (UnicodeDecodeError, LookupError):
+            # the sample or the earlier detection didn't fit all of text
+            encoding = chardet.detect(text)['encoding']
+            return (text.decode(encoding or "utf-8"), encoding,)
+
     def decode_encoded(self, text):
         if self.encoding == 'chardet':
-            encoding = chardet.detect(text)['encoding']
-            if not encoding:
-                return text.decode("utf-8")
-            else:
-                return text.decode(encoding)
+            return self.decode_detected(text)[0]
         else:
             return text.decode(self.encoding)
 
@@ -82,3 +82,72 @@ def test_pygments_line_numbering_latex_alt():
                 )
         wrapper.run_docs(doc)
         assert "firstnumber=1" in str(doc.output_data())
+
+def test_highlight_cache():
+    from dexy.highlight import HighlightCache
+    from pygments.formatters import HtmlFormatter
+    from pygments.lexers import get_lexer_by_name
+
+    with wrap() as wrapper:
+        lexer = get_lexer_by_name("python")
+
+        cache = wrapper.highlight_cache()
+        output = cache.highlight("print 'hello'", lexer, HtmlFormatter())
+        assert """<div class="highlight">""" in output
+        assert cache.misses == 1
+        cache.save()
+
+        cache = HighlightCache(wrapper)
+        assert cache.highlight("print 'hello'", lexer, HtmlFormatter()) == output
+        assert cache.hits == 1
+
+        # different formatter options
+        cache.highlight("print 'hello'", lexer, HtmlFormatter(linenos=True))
+        assert cache.misses == 1
+        assert cache.summary() == "highlight cache: 1 hits, 1 misses (50.0% hit rate)"
+
+def test_highlight_cache_digest_includes_lexer_filters_and_version():
+    from pygments.formatters import HtmlFormatter
+    from pygments.lexers import get_lexer_by_name
+    import pygments
+
+    with wrap() as wrapper:
+        cache = wrapper.highlight_cache()
+        plain = cache.digest("x = 1", get_lexer_by_name("python"), HtmlFormatter())
+        assert plain == cache.digest("x = 1", get_lexer_by_name("python"), HtmlFormatter())
+
+        lexer = get_lexer_by_name("python")
+        lexer.add_filter("keywordcase", case="upper")
+        assert cache.digest("x = 1", lexer, HtmlFormatter()) != plain
+
+        version = pygments.__version__
+        pygments.__version__ = "0.0"
+        try:
+            assert cache.digest("x = 1", get_lexer_by_name("python"), HtmlFormatter()) != plain
+        finally:
+            pygments.__version__ = version
+
+def test_highlight_cache_changes_merged_from_worker():
+    from dexy.highlight import HighlightCache
+    from pygments.formatters import HtmlFormatter
+    from pygments.lexers import get_lexer_by_name
+
+    with wrap() as wrapper:
+        lexer = get_lexer_by_name("python")
+        parent = wrapper.highlight_cache()
+        parent.highlight("x = 1", lexer, HtmlFormatter())
+
+        # a forked worker starts from the parent's state
+        worker = wrapper.highlight_cache()
+        worker.after_fork()
+        worker.highlight("x = 1", lexer, HtmlFormatter())
+        worker.highlight("y = 2", lexer, HtmlFormatter())
+        changes = worker.export_changes()
+        assert changes[2:] == (1, 1,)
+        assert worker.export_changes()[2:] == (0, 0,)
+
+        parent = HighlightCache(wrapper)
+        parent.merge_changes(changes)
+        assert parent.summary() == "highlight cache: 1 hits, 1 misses (50.0% hit rate)"
+        parent.save()
+        assert HighlightCache(wrapper).lookup(parent.digest("y = 2", lexer, HtmlFormatter()))
@@ -1,6 +1,10 @@
 import os
 from dexy.doc import Doc
+from dexy.exceptions import UserFeedback
+from dexy.utils import tempdir
+from dexy.wrapper import Wrapper
 from tests.utils import wrap
+import time
 
 def test_output_reporter():
     with wrap() as wrapper:
@@ -10,3 +14,141 @@ def test_output_reporter():
         wrapper.report()
         assert os.path.exists("output")
         assert os.path.exists("output/hello.txt")
+
+def test_output_reporter_publish_mode_link():
+    with tempdir():
+        wrapper = Wrapper(log_level='DEBUG', reports='output', publish_mode='link')
+        wrapper.create_dexy_dirs()
+        with open("hello.txt", "w") as f:
+            f.write("hello")
+        doc = Doc("hello.txt", wrapper)
+        wrapper.run_docs(doc)
+        wrapper.report()
+
+        cache_file = doc.output_data().storage.data_file()
+        assert os.stat("output/hello.txt").st_ino == os.stat(cache_file).st_ino
+
+def write_files(contents):
+    for name, text in contents.iteritems():
+        if os.path.dirname(name) and not os.path.exists(os.path.dirname(name)):
+            os.makedirs(os.path.dirname(name))
+        changed = os.path.exists(name)
+        if changed:
+            with open(name, "r") as f:
+                if f.read() == text:
+                    continue
+        with open(name, "w") as f:
+            f.write(text)
+        if changed:
+            # make sure the change is seen within the same second
+            later = time.time() + 10
+            os.utime(name, (later, later,))
+
+def test_output_reporter_incremental():
+    with tempdir():
+        Wrapper().create_dexy_dirs()
+
+        def run_output_reporter(contents):
+            write_files(contents)
+            wrapper = Wrapper(log_level='DEBUG', reports='output')
+            docs = [Doc(name, wrapper) for name in contents]
+            wrapper.run_docs(*docs)
+            wrapper.report()
+            return dict((name, os.path.getmtime(os.path.join("output", name)))
+                    for name in contents)
+
+        first = run_output_reporter({'a.txt' : 'a', 'b.txt' : 'b', 'sub/c.txt' : 'c'})
+        second = run_output_reporter({'a.txt' : 'a', 'b.txt' : 'changed'})
+
+        assert second['a.txt'] == first['a.txt']
+        with open("output/b.txt", "r") as f:
+            assert f.read() == "changed"
+        assert not os.path.exists("output/sub")
+
+def run_website_reporter(report_jobs, template="{{ content }} {{ root.children|length }}", target=None, changed=None, pages=5):
+    with open("_template.html", "w") as f:
+        f.write(template)
+
+    wrapper = Wrapper(log_level='DEBUG', reports='ws', report_jobs=report_jobs, target=target)
+    contents = dict(("page%s.html" % i, "page %s" % i) for i in range(pages))
+    contents.update(changed or {})
+    write_files(contents)
+    docs = [Doc(name, wrapper) for name in sorted(contents)]
+    wrapper.run_docs(*docs)
+    wrapper.report()
+
+    output = {}
+    for filename in sorted(os.listdir("output-site")):
+        with open(os.path.join("output-site", filename), "r") as f:
+            output[filename] = f.read()
+    return output
+
+def test_website_reporter_in_parallel():
+    with tempdir():
+        Wrapper().create_dexy_dirs()
+        serial = run_website_reporter(1)
+        parallel = run_website_reporter(3)
+        assert parallel == serial
+        assert parallel['page3.html'] == "page 3 0"
+
+def test_website_reporter_in_parallel_saves_compiled_templates():
+    with tempdir():
+        Wrapper().create_dexy_dirs()
+        run_website_reporter(3)
+        assert os.listdir(Wrapper().jinja_bytecode_cache().directory)
+
+def test_website_reporter_in_parallel_error():
+    with tempdir():
+        Wrapper().create_dexy_dirs()
+
+        # pages 1 and 3 fail, the error should be for whichever of them would
+        # be rendered first when rendering serially
+        template = "{{ content }} {% if content[-1] in '13' %}{{ missing }}{% endif %}"
+        try:
+            run_website_reporter(3, template)
+            assert False, 'should raise UserFeedback'
+        except UserFeedback as e:
+            parallel = e
+
+        assert isinstance(parallel, UserFeedback)
+        assert "'missing' is undefined" in parallel.message
+
+        wrapper = Wrapper()
+        keys = [Doc("page%s.html" % i, wrapper).key_with_class() for i in range(5)]
+        failing = [key.split(":")[1] for key in sorted(keys) if key[-6] in '13']
+        assert "error rendering %s in website reporter" % failing[0] in parallel.message
+
+def test_website_reporter_incremental():
+    with tempdir():
+        Wrapper().create_dexy_dirs()
+        template = "{{ content }} {{ root.docs|length }} {{ link('page0.html') }}"
+
+        def mtimes():
+            return dict((filename, os.path.getmtime(os.path.join("output-site", filename)))
+                    for filename in os.listdir("output-site") if filename.startswith("page"))
+
+        run_website_reporter(1, template)
+        first = mtimes()
+
+        output = run_website_reporter(1, template, changed={'page2.html' : 'changed'})
+        second = mtimes()
+        assert output['page2.html'] == 'changed 5 <a href="page0.html">Page0</a>'
+        assert second['page2.html'] != first['page2.html']
+        assert second['page3.html'] == first['page3.html']
+
+        # removing a page changes navigation for all pages
+        output = run_website_reporter(1, template, pages=4)
+        assert output['page3.html'] == 'page 3 4 <a href="page0.html">Page0</a>'
+        assert not 'page4.html' in output
+
+def test_website_reporter_with_target():
+    with tempdir():
+        Wrapper().create_dexy_dirs()
+        template = "{{ content }} {{ root.docs|length }}"
+        run_website_reporter(1, template)
+        first = os.path.getmtime("output-site/page3.html")
+
+        output = run_website_reporter(1, template, target='page1', changed={'page1.html' : 'changed'})
+        assert output['page1.html'] == 'changed 5'
+        assert output['page2.html'] == 'page 2 5'
+        assert os.path.getmtime("output-site/page3.html") == first
@@ -3,6 +3,7 @@ from dexy.filters.templating import TemplateFilter
 from dexy.filters.templating_plugins import TemplatePlugin
 from tests.utils import wrap
 from dexy.exceptions import UserFeedback
+import os
 
 def test_jinja_invalid_attribute():
     def make_sections_doc(wrapper):
@@ -328,3 +329,51 @@ def test_jinja_filter_using_inflection():
 
         wrapper.run_docs(node)
         assert node.output_data().as_text() == "Abc def"
+
+def test_jinja_environment_shared_between_docs():
+    with wrap() as wrapper:
+        with open("macros.jinja", "w") as f:
+            f.write("{% macro hi(name) %}hi {{ name }}{% endmacro %}")
+
+        docs = [Doc("%s.txt|jinja" % name,
+                    wrapper,
+                    [Doc("macros.jinja", wrapper)],
+                    contents = "{%% from 'macros.jinja' import hi %%}{{ hi('%s') }}" % name
+                    ) for name in ('foo', 'bar')]
+
+        wrapper.run_docs(*docs)
+
+        assert str(docs[0].output_data()) == "hi foo"
+        assert str(docs[1].output_data()) == "hi bar"
+        assert len(wrapper.jinja_environments) == 1
+        assert os.listdir(wrapper.jinja_bytecode_cache().directory)
+
+def test_jinja_environments_not_kept_from_earlier_runs():
+    with wrap() as wrapper:
+        wrapper.jinja_environments['stale'] = None
+        doc = Doc("foo.txt|jinja", wrapper, [], contents="foo")
+        wrapper.run_docs(doc)
+        assert not 'stale' in wrapper.jinja_environments
+        assert len(wrapper.jinja_environments) == 1
+
+def test_jinja_bytecode_cache_keeps_delimiter_styles_apart():
+    with wrap() as wrapper:
+        with open("shared.jinja", "w") as f:
+            f.write("A<< 1 >>B{{ 2 }}")
+
+        txt = Doc("doc.txt|jinja",
+                wrapper,
+                [Doc("shared.jinja", wrapper)],
+                contents = "{% include 'shared.jinja' %}"
+                )
+
+        tex = Doc("doc.tex|jinja",
+                wrapper,
+                [Doc("shared.jinja", wrapper)],
+                contents = "<% include 'shared.jinja' %>"
+                )
+
+        wrapper.run_docs(txt, tex)
+
+        assert str(txt.output_data()) == "A<< 1 >>B2"
+        assert str(tex.output_data()) == "A1B{{ 2 }}"
@@ -37,6 +37,90 @@ def test_pygments():
         assert 'pastie.css' in env['pygments'][1].keys()
         assert 'pastie.html' in env['pygments'][1].keys()
 
+def test_run_scoped_plugin_output_is_cached():
+    cache = {}
+    env = TemplatePlugin.create_instance('dexyversion').run_cached(cache)
+    assert TemplatePlugin.create_instance('dexyversion').run_cached(cache) is env
+    assert [k[0] for k in cache] == ['DexyVersion']
+
+def test_filter_scoped_plugin_output_is_not_cached():
+    cache = {}
+    TemplatePlugin.create_instance('head').run_cached(cache)
+    TemplatePlugin.create_instance('debug').run_cached(cache)
+    assert [k[0] for k in cache] == ['Head']
+
+def test_run_scoped_plugin_output_is_cached_by_settings():
+    cache = {}
+    camelize = TemplatePlugin.create_instance('inflection')
+    camelize.update_settings({'methods' : ['camelize']})
+    underscore = TemplatePlugin.create_instance('inflection')
+    underscore.update_settings({'methods' : ['underscore']})
+    assert camelize.run_cached(cache).keys() == ['camelize']
+    assert underscore.run_cached(cache).keys() == ['underscore']
+    assert len(cache) == 2
+
+def test_markdown_state_not_shared_between_docs():
+    env = TemplatePlugin.create_instance('markdown').run_cached({})
+    convert = env['markdown'][1]
+    assert "foo.html" in convert("[foo][1]\n\n[1]: foo.html")
+    assert not "foo.html" in convert("[bar][1]")
+
+def test_plugin_output_not_kept_from_earlier_runs():
+    with wrap() as wrapper:
+        wrapper.template_plugin_output[('DexyVersion',)] = {}
+        doc = Doc("foo.txt|jinja", wrapper, [], contents="{{ DEXY_VERSION }}")
+        wrapper.run_docs(doc)
+        assert not ('DexyVersion',) in wrapper.template_plugin_output
+        assert str(doc.output_data())
+
+def test_pygments_stylesheets_cached_by_formatter_args():
+    with wrap() as wrapper:
+        docs = [Doc("%s.txt|jinja" % name, wrapper, [], contents="{{ pygments['pastie.css'] }}", **args)
+                for name, args in (('foo', {}), ('bar', {}), ('baz', {'pygments' : {'cssclass' : 'baz'}}),)]
+        wrapper.run_docs(*docs)
+
+        stylesheet_keys = [k for k in wrapper.template_plugin_output if k[0] == 'PygmentsStylesheet']
+        assert len(stylesheet_keys) == 2
+        assert str(docs[0].output_data()) == str(docs[1].output_data())
+        assert ".baz" in str(docs[2].output_data())
+
+def test_d_lookups():
+    with wrap() as wrapper:
+        os.makedirs("sub")
+        inputs = [
+                Doc("sub/foo.txt", wrapper, [], contents="foo"),
+                Doc("sub/bar.txt|ss", wrapper, [], contents="bar"),
+                Doc("other/baz-quux.txt", wrapper, [], contents="baz"),
+                ]
+        contents = """{{ d['foo.txt'] }} {{ d['/sub/foo.txt'] }}
+{{ d['other/baz'] }} {{ d['title:Baz Quux'] }}"""
+        doc = Doc("sub/page.txt|jinja", wrapper, inputs, contents=contents)
+        wrapper.run_docs(doc)
+
+        assert str(doc.output_data()) == "foo foo\nbaz baz"
+
+        # the ss filter indents each line by one space
+        d = doc.filters[-1].template_data()['d']
+        bar = d['bar.txt-ss.txt']
+        assert bar.key == "sub/bar.txt|ss"
+        assert unicode(bar) == " bar"
+
+def test_d_indexes_built_on_demand():
+    with wrap() as wrapper:
+        doc = Doc("page.txt|jinja", wrapper,
+                [Doc("foo.txt", wrapper, [], contents="foo")],
+                contents="{{ d['foo.txt'] }}")
+        wrapper.run_docs(doc)
+
+        d = doc.filters[-1].template_data()['d']
+        assert d._names_index is None
+        assert d._titles_index is None
+
+        assert unicode(d['foo.txt']) == "foo"
+        assert d._names_index is None
+        assert d.title_index("title:Foo") == 0
+        assert d._names_index is None
+
 class TestSubdirectory(TemplateFilter):
     """
     test subdir
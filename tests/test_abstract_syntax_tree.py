@@ -24,3 +24,27 @@ def test_ast():
         ast.walk()
         assert len(wrapper.roots) == 1
         assert len(wrapper.nodes) == 2
+
+def test_ast_settings_for_directory():
+    with wrap() as wrapper:
+        ast = AbstractSyntaxTree(wrapper)
+        ast.default_args_for_directory.append(("abc/def", {'foo' : 'abcdef'},))
+        ast.default_args_for_directory.append((".", {'foo' : 'root', 'bar' : 1},))
+        ast.default_args_for_directory.append(("abc", {'foo' : 'abc'},))
+        ast.environment_for_directory.append(("abc", {'x' : 1},))
+
+        assert ast.calculate_default_args_for_directory("root.txt") == {'foo' : 'root', 'bar' : 1}
+        assert ast.calculate_default_args_for_directory("abc/*.txt") == {'foo' : 'abc', 'bar' : 1}
+        assert ast.calculate_default_args_for_directory("abc/def/ghi/x.txt") == {'foo' : 'abcdef', 'bar' : 1}
+
+        # sibling directories which share a prefix are not included
+        assert ast.calculate_default_args_for_directory("abcdef/x.txt") == {'foo' : 'root', 'bar' : 1}
+        assert ast.calculate_environment_for_directory("abcdef/x.txt") == {}
+        assert ast.calculate_environment_for_directory("abc/x.txt") == {'x' : 1}
+
+        # docs in the same directory share settings
+        assert ast.calculate_default_args_for_directory("abc/a.txt") is \
+                ast.calculate_default_args_for_directory("abc/b.txt")
+
+        ast.environment_for_directory.append((".", {'y' : 2},))
+        assert ast.calculate_environment_for_directory("abc/x.txt") == {'x' : 1, 'y' : 2}
@@ -38,3 +38,35 @@ def test_batch_with_docs():
         for doc_key in batch.docs:
             assert batch.input_data(doc_key)
             assert batch.output_data(doc_key)
+
+def test_batch_data_is_reused():
+    with tempdir():
+        wrapper = Wrapper()
+        wrapper.create_dexy_dirs()
+
+        with open("hello.txt", "w") as f:
+            f.write("hello")
+
+        with open("dexy.yaml", "w") as f:
+            f.write("hello.txt|keyvalueexample")
+
+        wrapper = Wrapper()
+        wrapper.run_from_new()
+
+        batch = dexy.batch.Batch.load_most_recent(wrapper)
+        doc_key = "doc:hello.txt|keyvalueexample"
+        data = batch.output_data(doc_key)
+        assert batch.output_data(doc_key) is data
+        assert [d for d in batch if d.key == data.key] == [data]
+
+        # storage connects on first use
+        assert not data.storage._cursor
+        assert data.value('foo') == 'bar'
+
+        # other data objects for the same database share its connection
+        other_batch = dexy.batch.Batch.load_most_recent(wrapper)
+        other_data = other_batch.output_data(doc_key)
+        assert not other_data is data
+        assert other_data.value('foo') == 'bar'
+        assert other_data.storage._storage is data.storage._storage
+        assert len(wrapper.sqlite_connections) == 1
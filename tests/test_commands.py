@@ -191,3 +191,81 @@ def test_env_text(stdout):
     dexy.commands.run()
     text = stdout.getvalue()
     assert "uuid" in text
+
+### "serve"
+def test_serve_conditional_get_gzip_and_ranges():
+    from dexy.commands.serve import DexyHTTPRequestHandler
+    from dexy.commands.serve import ThreadedHTTPServer
+    import gzip
+    import httplib
+    import threading
+
+    with tempdir():
+        contents = "hello dexy " * 100
+        with open("hello.txt", "wb") as f:
+            f.write(contents)
+
+        httpd = ThreadedHTTPServer(("127.0.0.1", 0), DexyHTTPRequestHandler)
+        thread = threading.Thread(target=httpd.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        try:
+            conn = httplib.HTTPConnection("127.0.0.1", httpd.server_address[1])
+
+            def get(headers={}):
+                conn.request("GET", "/hello.txt", headers=headers)
+                response = conn.getresponse()
+                return response, response.read()
+
+            response, body = get()
+            assert response.status == 200
+            assert body == contents
+            etag = response.getheader('ETag')
+            assert etag
+
+            # same kept-alive connection is reused
+            response, body = get({'If-None-Match' : etag})
+            assert response.status == 304
+            assert body == ''
+
+            response, body = get({'If-Modified-Since' : response.getheader('Last-Modified')})
+            assert response.status == 304
+
+            response, body = get({'Range' : 'bytes=6-9'})
+            assert response.status == 206
+            assert response.getheader('Content-Range') == "bytes 6-9/%s" % len(contents)
+            assert body == "dexy"
+
+            response, body = get({'Range' : 'bytes=-4'})
+            assert body == "exy "
+
+            response, body = get({'Range' : 'bytes=5000-'})
+            assert response.status == 416
+
+            response, body = get({'Accept-Encoding' : 'gzip'})
+            assert response.status == 200
+            assert response.getheader('Content-Encoding') == 'gzip'
+            assert len(body) < len(contents)
+            assert gzip.GzipFile(fileobj=StringIO(body)).read() == contents
+            assert response.getheader('ETag') != etag
+
+            # fresh pre-compressed sidecar file is served as is
+            with open("hello.txt.gz", "wb") as f:
+                f.write("precompressed")
+            response, body = get({'Accept-Encoding' : 'gzip'})
+            assert body == "precompressed"
+
+            DexyHTTPRequestHandler.authcode = "dXNlcjpwYXNz"
+            DexyHTTPRequestHandler.realm = "Dexy"
+            response, body = get()
+            assert response.status == 401
+            assert body == "no authorization received"
+
+            response, body = get({'Authorization' : 'Basic dXNlcjpwYXNz'})
+            assert response.status == 200
+        finally:
+            DexyHTTPRequestHandler.authcode = None
+            DexyHTTPRequestHandler.realm = None
+            httpd.shutdown()
+            httpd.server_close()
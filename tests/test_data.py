@@ -1,8 +1,11 @@
 from dexy.doc import Doc
 from dexy.data import Data
+from dexy.wrapper import Wrapper
 from tests.utils import wrap
+import chardet
 import dexy.data
 import dexy.exceptions
+import dexy.storage
 import os
 
 def test_sectioned_data_setitem_delitem():
@@ -78,8 +81,77 @@ def test_generic_data_stores_string():
         data = doc.output_data()
 
         assert data.alias == 'generic'
+        assert data.data() == "hello"
         assert data._data == "hello"
 
+def test_data_released_when_consumers_have_run():
+    with wrap() as wrapper:
+        foo = Doc("foo.txt|head", wrapper, [], contents="foo")
+        bar = Doc("bar.txt|head", wrapper, [foo], contents="bar")
+
+        loaded = []
+        cache = wrapper.data_cache()
+        original_doc_ran = cache.doc_ran
+        def doc_ran(doc):
+            loaded.append((doc.key, foo.output_data()._data,))
+            original_doc_ran(doc)
+        cache.doc_ran = doc_ran
+
+        wrapper.run_docs(bar)
+
+        # foo is kept loaded until bar has run, then both are released
+        assert loaded == [("foo.txt|head", "foo\n"), ("bar.txt|head", "foo\n")]
+        assert all(data._data is None for data in foo.datas() + bar.datas())
+        assert unicode(bar.output_data()) == "bar\n"
+        assert wrapper.data_cache().total == 8
+
+def test_data_cache_evicts_least_recently_used():
+    with wrap() as wrapper:
+        docs = [Doc("doc%s.txt" % i, wrapper, [], contents="x" * 100)
+                for i in range(3)]
+        wrapper.run_docs(*docs)
+
+        wrapper.data_cache_mb = 250.0 / (1024 * 1024)
+        datas = [doc.output_data() for doc in docs]
+        datas[0].data()
+        datas[1].data()
+        datas[0].data()
+        datas[2].data()
+
+        assert datas[0]._data == "x" * 100
+        assert datas[1]._data is None
+        assert datas[2]._data == "x" * 100
+        assert wrapper.data_cache().total == 200
+
+def test_decoded_text_and_detected_encoding_are_kept():
+    with wrap() as wrapper:
+        wrapper.encoding = 'chardet'
+        text = u"Caf\xe9 cr\xe8me br\xfbl\xe9e, d\xe9j\xe0 vu. " * 20
+        doc = Doc("latin.txt", wrapper, [], contents=text.encode("latin-1"))
+        wrapper.run_docs(doc)
+
+        data = doc.output_data()
+        decoded = unicode(data)
+        assert decoded == text
+        assert unicode(data) is decoded
+
+        store = wrapper.runtime_info_store()
+        encoding = store.detected_encoding(data.storage_key, data.storage.data_file_stamp())
+        assert encoding
+
+        data.clear_data()
+        assert data._decoded is None
+        assert unicode(data) == text
+        assert unicode(data) is not decoded
+
+def test_detect_encoding_falls_back_to_all_text():
+    with wrap() as wrapper:
+        text = u"a" * (wrapper.chardet_sample_size + 10) + u"\u2603 snowman"
+        encoded = text.encode("utf-8")
+        encoding = chardet.detect(encoded)['encoding']
+        assert wrapper.detect_encoding(encoded) == 'ascii'
+        assert wrapper.decode_detected(encoded) == (encoded.decode(encoding), encoding,)
+
 def test_sectioned_data_stores_list_of_dicts():
     with wrap() as wrapper:
         contents=[
@@ -105,6 +177,82 @@ def test_sectioned_data_stores_list_of_dicts():
         assert data['Welcome']['contents'] == "This is the first section."
         assert data[0]['contents'] == "This is the first section."
 
+def test_section_lookups_use_section_index():
+    with wrap() as wrapper:
+        contents=[
+                {},
+                {
+                    "name" : "Welcome",
+                    "contents" : "This is the first section."
+                },
+                {
+                    "name" : "Goodbye",
+                    "contents" : "This is the last section."
+                }
+            ]
+
+        def sectioned_doc(wrapper):
+            return Doc("hello.txt", wrapper, [], data_type="sectioned",
+                    contents=contents)
+
+        wrapper.run_docs(sectioned_doc(wrapper))
+        data = wrapper.lookup_sections['Welcome'][0]
+        names = wrapper.section_index().section_names(
+                data.storage.data_filename(), data.storage.data_file_stamp())
+        assert names == ["Welcome", "Goodbye"]
+
+        reads = []
+        storage_class = dexy.storage.JsonSectionedStorage
+        def read_data(storage):
+            reads.append(storage.storage_key)
+            return original_read_data(storage)
+
+        original_read_data = storage_class.read_data.im_func
+        storage_class.read_data = read_data
+        try:
+            wrapper = Wrapper(log_level='DEBUG', debug=True)
+            wrapper.run_docs(sectioned_doc(wrapper))
+        finally:
+            storage_class.read_data = original_read_data
+
+        assert wrapper.nodes["doc:hello.txt"].state == 'consolidated'
+        assert sorted(wrapper.lookup_sections) == ["Goodbye", "Welcome"]
+        assert reads == []
+
+        assert wrapper.lookup_sections['Goodbye'][0]['Goodbye']['contents'] == "This is the last section."
+
+def test_keyvalue_section_lookups_use_section_index():
+    for ext in ('.sqlite3', '.json',):
+        with wrap() as wrapper:
+            def keyvalue_doc(wrapper):
+                return Doc("hello.txt|keyvalueexample", wrapper, [],
+                        contents="hello", output=True, keyvalueexample={'ext' : ext})
+
+            wrapper.run_docs(keyvalue_doc(wrapper))
+            data = wrapper.lookup_sections['foo'][0]
+            names = wrapper.section_index().section_names(
+                    data.storage.data_filename(), data.storage.data_file_stamp())
+            assert names == ["foo"]
+
+            queries = []
+            storage_class = data.storage.__class__
+            def keys(storage):
+                queries.append(storage.storage_key)
+                return original_keys(storage)
+
+            original_keys = storage_class.keys.im_func
+            storage_class.keys = keys
+            try:
+                wrapper = Wrapper(log_level='DEBUG', debug=True)
+                wrapper.run_docs(keyvalue_doc(wrapper))
+            finally:
+                storage_class.keys = original_keys
+
+            assert wrapper.nodes["doc:hello.txt|keyvalueexample"].state == 'consolidated'
+            assert wrapper.lookup_sections.keys() == ["foo"]
+            assert queries == []
+            assert wrapper.lookup_sections['foo'][0]['foo'] == "bar"
+
 def test_keyvalue_data_stores_dict():
     with wrap() as wrapper:
         doc = Doc("hello.json",
@@ -207,13 +355,13 @@ def test_generic_data():
         # Assign some text contents
         data._data = CONTENTS
         assert data.has_data()
-        assert not data.is_cached(True)
+        assert not data.is_cached()
 
         # Save data to disk
         data.save()
         assert data.has_data()
-        assert data.is_cached(True)
-        assert data.filesize(True) > 10
+        assert data.is_cached()
+        assert data.filesize() > 10
 
         # Clear data from memory
         data._data = None
@@ -1,8 +1,11 @@
 from dexy.data import Data
 from dexy.doc import Doc
 from dexy.exceptions import UserFeedback
+from dexy.utils import tempdir
+from dexy.wrapper import Wrapper
 from tests.utils import wrap
 from nose.tools import raises
+import os
 
 def test_create_doc_with_one_filter():
     with wrap() as wrapper:
@@ -49,3 +52,52 @@ def test_create_virtual_initial_artifact():
         doc = Doc("abc.txt", wrapper, [], contents="these are the contents")
         wrapper.run_docs(doc)
         assert doc.output_data().__class__.__name__ == "Generic"
+
+def test_ingest_mode_link():
+    with tempdir():
+        Wrapper().create_dexy_dirs()
+        with open("hello.txt", "w") as f:
+            f.write("hello")
+
+        def run_hello():
+            wrapper = Wrapper(ingest_mode='link')
+            doc = Doc("hello.txt|dexy", wrapper)
+            wrapper.run_docs(doc)
+            return doc
+
+        doc = run_hello()
+        cache_file = doc.initial_data.storage.data_file()
+        assert os.stat(cache_file).st_ino == os.stat("hello.txt").st_ino
+        assert str(doc.output_data()) == "hello"
+
+        doc = run_hello()
+        assert doc.state == 'consolidated'
+
+        # an edit made in place also changes the cached copy, and is detected
+        mtime = os.path.getmtime("hello.txt")
+        with open("hello.txt", "w") as f:
+            f.write("hello world")
+        os.utime("hello.txt", (mtime, mtime,))
+
+        doc = run_hello()
+        assert doc.state == 'ran'
+        assert str(doc.output_data()) == "hello world"
+
+def test_corrupt_ingest_index_is_rebuilt():
+    with tempdir():
+        Wrapper().create_dexy_dirs()
+        with open("hello.txt", "w") as f:
+            f.write("hello")
+
+        wrapper = Wrapper(ingest_mode='link')
+        wrapper.run_docs(Doc("hello.txt|dexy", wrapper))
+        index_file = wrapper.ingest_index().filepath()
+        with open(index_file, "rb") as f:
+            data = f.read()
+        with open(index_file, "wb") as f:
+            f.write(data[0:len(data) / 2])
+
+        wrapper = Wrapper(ingest_mode='link')
+        doc = Doc("hello.txt|dexy", wrapper)
+        wrapper.run_docs(doc)
+        assert str(doc.output_data()) == "hello"
@@ -1,5 +1,6 @@
 from tests.utils import wrap
 import dexy.filter
+import os
 
 def test_filters_by_tag():
     tags_filters = dexy.filter.filters_by_tag()
@@ -35,3 +36,153 @@ def test_filter_args():
         assert "foo: baz" in result
         assert "foo: bar" in result
 
+
+def test_filter_jobs_run_pure_filters_ahead():
+    import dexy.filter_pool
+    from dexy.utils import tempdir
+    from dexy.wrapper import Wrapper
+
+    with tempdir():
+        with open("dexy.yaml", "w") as f:
+            f.write("- .txt|head|ww|dexy:\n    - ww: { width: 20 }")
+
+        for i in range(6):
+            with open("doc%s.txt" % i, "w") as f:
+                f.write("\n".join("line %s of doc %s " % (j, i) * 3 for j in range(20)))
+
+        def run(filter_jobs):
+            wrapper = Wrapper(filter_jobs=filter_jobs)
+            wrapper.create_dexy_dirs()
+            wrapper.run_from_new()
+            outputs = dict((doc.key, unicode(doc.output_data()))
+                    for doc in wrapper.nodes.values() if doc.key.startswith("doc"))
+            wrapper.remove_dexy_dirs()
+            return outputs
+
+        counts = []
+        def outputs(pool, doc):
+            result = original_outputs(pool, doc)
+            counts.append(len(result))
+            return result
+
+        original_outputs = dexy.filter_pool.FilterPool.outputs
+        dexy.filter_pool.FilterPool.outputs = outputs
+        try:
+            parallel = run(3)
+        finally:
+            dexy.filter_pool.FilterPool.outputs = original_outputs
+
+        # head and ww run ahead, dexy filter is not pure
+        assert counts == [2] * 6
+        assert parallel == run(1)
+        assert "line 9 of doc 0" in parallel["doc0.txt|head|ww|dexy"]
+        assert not "line 10 of doc 0" in parallel["doc0.txt|head|ww|dexy"]
+
+def test_text_is_handed_to_next_filter_in_memory():
+    import dexy.filters.standard
+    from dexy.utils import tempdir
+    from dexy.wrapper import Wrapper
+
+    with tempdir():
+        with open("dexy.yaml", "w") as f:
+            f.write("- foo.txt|ww|head|dexy")
+
+        with open("foo.txt", "w") as f:
+            f.write("\n".join("line %s " % i * 20 for i in range(20)))
+
+        saved_while_running = []
+        def process_text(head, input_text):
+            saved_while_running.append(head.input_data.is_cached())
+            return original_process_text(head, input_text)
+
+        head_filter = dexy.filters.standard.HeadFilter
+        original_process_text = head_filter.process_text.im_func
+        head_filter.process_text = process_text
+        try:
+            wrapper = Wrapper()
+            wrapper.create_dexy_dirs()
+            wrapper.run_from_new()
+        finally:
+            head_filter.process_text = original_process_text
+
+        doc = wrapper.nodes["doc:foo.txt|ww|head|dexy"]
+        ww_data, head_data, dexy_data = [doc_filter.output_data for doc_filter in doc.filters]
+
+        # ww output is saved after the chain has run, head output is saved
+        # right away since the dexy filter isn't pure
+        assert saved_while_running == [False]
+        assert not ww_data.save_deferred and not head_data.save_deferred
+        assert ww_data.is_cached()
+        assert head_data.is_cached()
+        assert unicode(dexy_data) == unicode(head_data)
+        assert len(unicode(dexy_data).splitlines()) == 10
+
+        wrapper = Wrapper()
+        wrapper.run_from_new()
+        doc = wrapper.nodes["doc:foo.txt|ww|head|dexy"]
+        assert doc.state == 'consolidated'
+        wrapper.remove_dexy_dirs()
+
+def test_identical_pure_filter_work_is_done_once():
+    from dexy.utils import tempdir
+    from dexy.wrapper import Wrapper
+
+    with tempdir():
+        with open("dexy.yaml", "w") as f:
+            f.write("- .txt|ww|head")
+
+        text = "\n".join("the same line %s " % i * 5 for i in range(5))
+        for name in ("a.txt", "b.txt",):
+            with open(name, "w") as f:
+                f.write(text)
+        with open("c.txt", "w") as f:
+            f.write(text + " but different")
+
+        for cache_backend in ('files', 'pack',):
+            wrapper = Wrapper(cache_backend=cache_backend)
+            wrapper.create_dexy_dirs()
+            wrapper.run_from_new()
+
+            assert len(wrapper.work_outputs) == 0
+            a, b, c = [wrapper.nodes["doc:%s.txt|ww|head" % n] for n in "abc"]
+            assert unicode(a.output_data()) == unicode(b.output_data())
+            assert unicode(a.output_data()) != unicode(c.output_data())
+
+            for i in range(2):
+                a_data = a.filters[i].output_data
+                b_data = b.filters[i].output_data
+                c_data = c.filters[i].output_data
+                if cache_backend == 'pack':
+                    pack = wrapper.pack()
+                    a_entry = pack.last[a_data.storage.data_filename()]
+                    assert pack.last[b_data.storage.data_filename()] == a_entry
+                    assert pack.last[c_data.storage.data_filename()] != a_entry
+                else:
+                    a_stat = os.stat(a_data.storage.this_data_file())
+                    b_stat = os.stat(b_data.storage.this_data_file())
+                    assert a_stat.st_ino == b_stat.st_ino
+                    assert a_stat.st_nlink == 2
+
+            wrapper.remove_dexy_dirs()
+
+def test_needs_workspace():
+    from dexy.utils import tempdir
+    from dexy.wrapper import Wrapper
+    import os
+
+    for needs_workspace in (True, False,):
+        with tempdir():
+            with open("dexy.yaml", "w") as f:
+                f.write("foo.txt|jinja:\n    - jinja: { needs-workspace: %s, workspace-includes: [.txt] }\n    - bar.txt" % needs_workspace)
+
+            for name in ("foo.txt", "bar.txt",):
+                with open(name, "w") as f:
+                    f.write(name)
+
+            wrapper = Wrapper()
+            wrapper.create_dexy_dirs()
+            wrapper.run_from_new()
+
+            f = wrapper.nodes["doc:foo.txt|jinja"].filters[0]
+            assert os.path.exists(f.work_input_filepath())
+            assert os.path.exists(os.path.join(f.workspace(), "bar.txt")) == needs_workspace
@@ -0,0 +1,105 @@
+from dexy.glob_index import GlobIndex
+import fnmatch
+import time
+
+FILEMAP_PATHS = [
+        "foo.txt",
+        ".txt",
+        "bar.py",
+        "Makefile",
+        "docs/index.md",
+        "docs/guide.txt",
+        "docs/api/module.txt",
+        "docs/api/module.py",
+        "src/foo.tar.gz",
+        "src/a.b.txt",
+        "src/x.",
+        ]
+
+PATTERNS = [
+        "*.txt",
+        "*.py",
+        "*.gz",
+        "*.tar.gz",
+        "*.",
+        "Make*",
+        "docs/*",
+        "docs/*.txt",
+        "docs/api/*.py",
+        "src/*",
+        "*/*.txt",
+        "*.t?t",
+        "*[.]txt",
+        "*.[pt]*",
+        "foo.txt",
+        "nothing.txt",
+        "*",
+        ]
+
+def fnmatch_all(filemap, pattern):
+    return sorted(p for p in filemap if fnmatch.fnmatch(p, pattern))
+
+def test_glob_index_matches_fnmatch():
+    filemap = dict((path, {}) for path in FILEMAP_PATHS)
+    index = GlobIndex(filemap)
+    for pattern in PATTERNS:
+        assert index.matches(pattern) == fnmatch_all(filemap, pattern), pattern
+
+def test_glob_index_candidates():
+    filemap = dict((path, {}) for path in FILEMAP_PATHS)
+    index = GlobIndex(filemap)
+    assert index.candidates("foo.txt") == ["foo.txt"]
+    assert index.candidates("*.py") == ["bar.py", "docs/api/module.py"]
+    assert index.candidates("docs/api/*") == ["docs/api/module.py", "docs/api/module.txt"]
+    assert len(index.candidates("*")) == len(FILEMAP_PATHS)
+
+def test_glob_index_is_current():
+    filemap = dict((path, {}) for path in FILEMAP_PATHS)
+    index = GlobIndex(filemap)
+    assert index.is_current(filemap)
+    assert not index.is_current(dict(filemap))
+    filemap['new.txt'] = {}
+    assert not index.is_current(filemap)
+
+def test_glob_index_100k_files__slow():
+    n_dirs = 1000
+    n_files = 100
+    exts = [".txt", ".py", ".md", ".html", ".json"]
+
+    filemap = {}
+    for i in range(n_dirs):
+        for j in range(n_files):
+            path = "dir%s/sub%s/file%s%s" % (i, i % 10, j, exts[j % len(exts)])
+            filemap[path] = {}
+
+    patterns = []
+    for i in range(200):
+        if i % 4 == 0:
+            patterns.append("dir%s/*%s" % (i, exts[i % len(exts)]))
+        elif i % 4 == 1:
+            patterns.append("dir%s/sub*/file1*" % i)
+        elif i % 4 == 2:
+            patterns.append("*file%s.json" % i)
+        else:
+            patterns.append("dir%s*.md" % i)
+
+    # fnmatch against every path is slow, so only time a sample of patterns
+    sample = patterns[::7]
+    start = time.time()
+    expected = [fnmatch_all(filemap, pattern) for pattern in sample]
+    elapsed_fnmatch = (time.time() - start) * len(patterns) / len(sample)
+
+    start = time.time()
+    index = GlobIndex(filemap)
+    elapsed_build = time.time() - start
+
+    start = time.time()
+    actual = [index.matches(pattern) for pattern in patterns]
+    elapsed_index = time.time() - start
+
+    print "%s patterns over %s files" % (len(patterns), len(filemap))
+    print "fnmatch against every path in %0.3fs (estimated)" % elapsed_fnmatch
+    print "built index in %0.3fs, matched in %0.3fs" % (elapsed_build, elapsed_index)
+
+    assert actual[::7] == expected
+    assert elapsed_build + elapsed_index < elapsed_fnmatch
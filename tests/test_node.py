@@ -38,16 +38,17 @@ def test_node_arg_caching():
         assert node.sorted_arg_string() == '[["baz", 123], ["foo", "bar"]]'
 
         assert os.path.exists(wrapper.artifacts_dir)
-        assert not os.path.exists(wrapper.node_argstrings_filename())
-        wrapper.save_node_argstrings()
-        assert os.path.exists(wrapper.node_argstrings_filename())
-        wrapper.load_node_argstrings()
+        store = wrapper.runtime_info_store()
+        assert not os.path.exists(store.filepath())
+        wrapper.save_node_args_digests()
+        assert os.path.exists(store.filepath())
+        store.load()
         assert not node.check_args_changed()
 
         node.args['baz'] = 456
         assert node.check_args_changed()
-        wrapper.save_node_argstrings()
-        wrapper.load_node_argstrings()
+        wrapper.save_node_args_digests()
+        store.load()
         assert not node.check_args_changed()
 
 SCRIPT_YAML = """
@@ -0,0 +1,132 @@
+from dexy.doc import Doc
+from dexy.exceptions import UserFeedback
+from dexy.pack import Pack
+from dexy.utils import tempdir
+from dexy.wrapper import Wrapper
+from tests.utils import wrap
+import os
+
+def cache_files(wrapper):
+    filenames = []
+    for cache_dir in (wrapper.this_cache_dir(), wrapper.last_cache_dir(),):
+        for dirpath, dirnames, files in os.walk(cache_dir):
+            filenames.extend(files)
+    return filenames
+
+def run_hello_docs():
+    wrapper = Wrapper(log_level='DEBUG', cache_backend='pack')
+    hello_py = Doc("hello.py|pyg", wrapper)
+    doc_txt = Doc("doc.txt|jinja", wrapper, [hello_py])
+    wrapper.run_docs(doc_txt)
+    return wrapper, hello_py, doc_txt
+
+def test_pack_cache_backend():
+    with tempdir():
+        with open("hello.py", "w") as f:
+            f.write("print 1+2\n")
+
+        with open("doc.txt", "w") as f:
+            f.write("highlighted: {{ d['hello.py|pyg'] }}")
+
+        wrapper = Wrapper(cache_backend='pack')
+        wrapper.create_dexy_dirs()
+
+        wrapper, hello_py, doc_txt = run_hello_docs()
+        assert str(doc_txt.output_data()) == "highlighted: %s" % hello_py.output_data()
+        assert hello_py.state == 'ran'
+        assert doc_txt.state == 'ran'
+        assert cache_files(wrapper) == []
+
+        wrapper, hello_py, doc_txt = run_hello_docs()
+        assert str(doc_txt.output_data()) == "highlighted: %s" % hello_py.output_data()
+        assert hello_py.state == 'consolidated'
+        assert doc_txt.state == 'consolidated'
+        assert cache_files(wrapper) == []
+
+        doc_txt.output_data().output_to_file("doc-copy.txt")
+        with open("doc-copy.txt", "r") as f:
+            assert f.read() == "highlighted: %s" % hello_py.output_data()
+
+        # pretend doc.txt was modified after it was cached
+        later = os.stat("doc.txt").st_mtime + 10
+        os.utime("doc.txt", (later, later,))
+
+        wrapper, hello_py, doc_txt = run_hello_docs()
+        assert hello_py.state == 'consolidated'
+        assert doc_txt.state == 'ran'
+
+def test_pack_sqlite3_storage():
+    with wrap() as wrapper:
+        wrapper.cache_backend = 'pack'
+        wrapper.to_walked()
+        wrapper.to_checked()
+
+        doc = Doc("doc.sqlite3", wrapper, [], contents={'foo' : 'bar'})
+        data = doc.initial_data
+        data.setup()
+        data.storage.connect()
+        data.append('foo', 'bar')
+        data.save()
+
+        assert wrapper.pack().contains(data.storage.data_filename(), True)
+        assert not os.path.exists(data.storage.this_data_file())
+        assert data.value('foo') == 'bar'
+
+def test_pack_compacts_dead_entries():
+    with wrap() as wrapper:
+        wrapper.cache_backend = 'pack'
+        pack = wrapper.pack()
+        pack.max_packed_size = 100
+        pack.max_pack_file_size = 1000
+
+        for i in range(100):
+            pack.write("entry-%s" % i, "x" * 100)
+        pack.this_to_last()
+        pack.write("entry-0", "y" * 100)
+        pack.drop_last()
+        pack.save()
+
+        assert len(pack.pack_filenames()) == 1
+
+        pack = Pack(wrapper)
+        pack.load()
+        assert pack.read("entry-0", True) == "y" * 100
+        assert not pack.contains("entry-1", True)
+
+def test_pack_compaction_keeps_shared_entries_shared():
+    with wrap() as wrapper:
+        wrapper.cache_backend = 'pack'
+        pack = wrapper.pack()
+        pack.max_packed_size = 100
+        pack.max_pack_file_size = 10000
+
+        pack.write("source", "s" * 100)
+        for i in range(10):
+            pack.share("copy-%s" % i, "source")
+        for i in range(20):
+            pack.write("dead-%s" % i, "x" * 100)
+
+        pack.this_to_last()
+        pack.share("copy-in-this", "source")
+        pack.move_to_this("source")
+        pack.drop_last()
+        assert len(pack.live_entries()) == 1
+
+        pack.save()
+
+        pack = Pack(wrapper)
+        pack.load()
+        total = sum(os.path.getsize(os.path.join(pack.pack_dir(), f))
+                for f in pack.pack_filenames())
+        assert total == 100
+        assert pack.read("copy-in-this", True) == "s" * 100
+        assert pack.this["copy-in-this"][0:2] == pack.this["source"][0:2]
+
+def test_invalid_cache_backend():
+    with wrap() as wrapper:
+        wrapper.cache_backend = 'foo'
+        try:
+            wrapper.pack()
+            assert False, 'should raise UserFeedback'
+        except UserFeedback as e:
+            assert "not a valid cache backend" in e.message
@@ -0,0 +1,139 @@
+from tests.utils import wrap
+import datetime
+import dexy.data
+import os
+import sqlite3
+import time
+
+def sqlite3_data(wrapper, storage_key="abc000"):
+    settings = {
+            'canonical-name' : 'doc.sqlite3'
+            }
+    data = dexy.data.KeyValue("doc.sqlite3", ".sqlite3", storage_key, settings, wrapper)
+    data.setup_storage()
+    data.storage.connect()
+    return data
+
+def test_sqlite3_append_is_buffered():
+    with wrap() as wrapper:
+        wrapper.to_walked()
+        wrapper.to_checked()
+
+        data = sqlite3_data(wrapper)
+        data.append('foo', 'bar')
+        assert len(data.storage._pending) == 1
+
+        # reads see pending rows
+        assert data.value('foo') == 'bar'
+        assert len(data.storage._pending) == 0
+
+def test_sqlite3_append_rejects_unbindable_values():
+    with wrap() as wrapper:
+        wrapper.to_walked()
+        wrapper.to_checked()
+
+        data = sqlite3_data(wrapper)
+
+        try:
+            data.append('foo', '\xe2\x81\x82')
+            assert False, 'should raise ProgrammingError'
+        except sqlite3.ProgrammingError:
+            pass
+
+        data.append('foo', u'\u2042')
+        assert data.keys() == ['foo']
+
+        try:
+            data.append('bar', object())
+            assert False, 'should raise InterfaceError'
+        except sqlite3.InterfaceError:
+            pass
+
+def test_sqlite3_append_uses_registered_adapters():
+    class Point(object):
+        def __init__(self, x, y):
+            self.x, self.y = x, y
+
+    sqlite3.register_adapter(Point, lambda p: "%s;%s" % (p.x, p.y))
+    try:
+        with wrap() as wrapper:
+            wrapper.to_walked()
+            wrapper.to_checked()
+
+            data = sqlite3_data(wrapper)
+            data.append('date', datetime.date(2014, 1, 2))
+            data.append('point', Point(1, 2))
+            data.append('flag', True)
+            assert data.value('date') == '2014-01-02'
+            assert data.value('point') == '1;2'
+            assert data.value('flag') == '1'
+    finally:
+        del sqlite3.adapters[(Point, sqlite3.PrepareProtocol)]
+
+def test_sqlite3_persist_renames_working_file():
+    with wrap() as wrapper:
+        wrapper.to_walked()
+        wrapper.to_checked()
+
+        data = sqlite3_data(wrapper)
+        data.append('foo', 'bar')
+        data.save()
+
+        assert not os.path.exists(data.storage.working_file())
+        assert os.path.exists(data.storage.this_data_file())
+        assert data.storage.connected_to == 'existing'
+        assert data.value('foo') == 'bar'
+
+        plan = data.storage._cursor.execute(
+                "EXPLAIN QUERY PLAN SELECT value from kvstore where key = ?",
+                ('foo',)).fetchall()
+        assert 'kvstore_key' in unicode(plan)
+
+def test_sqlite3_100k_keys__slow():
+    n = 100000
+    with wrap() as wrapper:
+        wrapper.to_walked()
+        wrapper.to_checked()
+
+        # keys shaped like pydoc and xxml output
+        keys = []
+        for i in range(n/2):
+            keys.append("dexy.module%s.Class%s.method:source" % (i % 97, i))
+            keys.append("section-%s:html-source" % i)
+
+        data = sqlite3_data(wrapper)
+
+        start = time.time()
+        for key in keys:
+            data.append(key, u"value for %s" % key)
+        data.save()
+        elapsed_write = time.time() - start
+
+        start = time.time()
+        for key in keys[::100]:
+            data.value(key)
+        elapsed_value = time.time() - start
+
+        start = time.time()
+        for key in keys[::1000]:
+            data.like("%s%%" % key.split(":")[0])
+        elapsed_like = time.time() - start
+
+        print "wrote %s keys in %0.3fs" % (n, elapsed_write)
+        print "%s value() lookups in %0.3fs" % (n/100, elapsed_value)
+        print "%s like() lookups in %0.3fs" % (n/1000, elapsed_like)
+
+        assert len(data.keys()) == n
+
+def test_shared_sqlite_connections_are_closed():
+    with wrap() as wrapper:
+        connection = wrapper.sqlite_connection("shared.sqlite3")
+        assert wrapper.sqlite_connection("./shared.sqlite3") is connection
+
+        wrapper.close_sqlite_connections()
+        assert wrapper.sqlite_connections == {}
+        try:
+            connection.execute("SELECT 1")
+            assert False, 'should raise ProgrammingError'
+        except sqlite3.ProgrammingError:
+            pass
@@ -5,6 +5,10 @@ from nose.tools import raises
 from dexy.utils import s
 from dexy.utils import split_path
 from dexy.utils import iter_paths
+from dexy.utils import publish_file
+from dexy.utils import tempdir
+from dexy.exceptions import UserFeedback
+import os
 
 def test_iter_path():
     full_path = "/foo/bar/baz"
@@ -47,3 +51,68 @@ class InactiveDexyFilter(Filter):
 def test_inactive_filters_skip():
     with runfilter("inactive", "hello"):
         pass
+
+def test_publish_file():
+    with tempdir():
+        with open("source.txt", "w") as f:
+            f.write("hello")
+
+        for mode in ('copy', 'link', 'reflink',):
+            dest = "%s.txt" % mode
+            used_mode = publish_file("source.txt", dest, mode)
+            assert used_mode in (mode, 'copy',)
+            with open(dest, "r") as f:
+                assert f.read() == "hello"
+
+        assert os.stat("link.txt").st_ino == os.stat("source.txt").st_ino
+
+        # an existing hard link is replaced, not written through
+        with open("other.txt", "w") as f:
+            f.write("other")
+        publish_file("other.txt", "link.txt", 'copy')
+        with open("source.txt", "r") as f:
+            assert f.read() == "hello"
+        with open("link.txt", "r") as f:
+            assert f.read() == "other"
+
+@raises(UserFeedback)
+def test_publish_file_invalid_mode():
+    with tempdir():
+        publish_file("source.txt", "dest.txt", 'foo')
+
+def test_save_and_load_pickle():
+    from dexy.utils import load_pickle
+    from dexy.utils import save_pickle
+    from dexy.wrapper import Wrapper
+
+    with tempdir():
+        wrapper = Wrapper()
+        assert load_pickle(wrapper, "index.pickle", {}) == {}
+
+        save_pickle(wrapper, "index.pickle", {'foo' : 'bar'})
+        assert load_pickle(wrapper, "index.pickle") == {'foo' : 'bar'}
+        assert os.listdir(".") == ["index.pickle"]
+
+        # truncated files are treated as missing
+        with open("index.pickle", "rb") as f:
+            data = f.read()
+        with open("index.pickle", "wb") as f:
+            f.write(data[0:len(data) / 2])
+        assert load_pickle(wrapper, "index.pickle", {}) == {}
+
+def test_atomic_file_left_alone_on_error():
+    from dexy.utils import atomic_file
+
+    with tempdir():
+        with open("dest.txt", "w") as f:
+            f.write("old")
+        try:
+            with atomic_file("dest.txt") as f:
+                f.write("partial")
+                raise ValueError()
+        except ValueError:
+            pass
+
+        assert os.listdir(".") == ["dest.txt"]
+        with open("dest.txt", "r") as f:
+            assert f.read() == "old"
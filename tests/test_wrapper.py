@@ -7,8 +7,14 @@ from tests.utils import capture_stdout
 from tests.utils import tempdir
 from tests.utils import wrap
 from dexy.wrapper import Wrapper
+import dexy.ast_cache
 import dexy.batch
+import dexy.cache_index
+import dexy.data
+import dexy.runtime_info
+import dexy.utils
 import os
+import time
 
 def test_deprecated_dot_dexy_file():
     with tempdir():
@@ -158,6 +164,81 @@ def test_ran():
             assert node.state == 'consolidated'
         wrapper.validate_state('ran')
 
+def test_run_saves_state_when_raising_in_debug_mode():
+    import dexy.filters.standard
+
+    with tempdir():
+        with open("dexy.yaml", "w") as f:
+            f.write("- foo.txt\n- bar.txt|head")
+
+        for name in ("foo.txt", "bar.txt",):
+            with open(name, "w") as f:
+                f.write(name)
+
+        def process_text(head, input_text):
+            raise UserFeedback("head failed")
+
+        head_filter = dexy.filters.standard.HeadFilter
+        original_process_text = head_filter.process_text.im_func
+        head_filter.process_text = process_text
+        try:
+            wrapper = Wrapper(debug=True, cache_backend='pack')
+            wrapper.create_dexy_dirs()
+            try:
+                wrapper.run_from_new()
+                assert False, 'should raise UserFeedback'
+            except UserFeedback:
+                pass
+        finally:
+            head_filter.process_text = original_process_text
+
+        assert wrapper.state == 'error'
+        assert wrapper.work_outputs == {}
+        assert not wrapper.data_cache().loaded
+        assert os.path.exists(wrapper.pack().index_filepath())
+
+def test_cache_files_stay_in_place():
+    with tempdir():
+        with open("dexy.yaml", "w") as f:
+            f.write("- foo.txt|dexy\n- bar.txt|dexy")
+
+        for name in ("foo.txt", "bar.txt",):
+            with open(name, "w") as f:
+                f.write(name)
+
+        def cache_files():
+            files = {}
+            for dirpath, dirnames, filenames in os.walk(".dexy/this"):
+                for filename in filenames:
+                    filepath = os.path.join(dirpath, filename)
+                    files[filepath] = os.stat(filepath).st_ino
+            return files
+
+        wrapper = Wrapper()
+        wrapper.create_dexy_dirs()
+        wrapper.run_from_new()
+        first = cache_files()
+        assert first
+
+        wrapper = Wrapper()
+        wrapper.run_from_new()
+        for node in wrapper.roots:
+            assert node.state == 'consolidated'
+        assert cache_files() == first
+        assert not os.path.exists(wrapper.last_cache_dir())
+
+        # files belonging to docs which are no longer part of the run are
+        # removed after the next successful run
+        with open("dexy.yaml", "w") as f:
+            f.write("- foo.txt|dexy")
+
+        wrapper = Wrapper()
+        wrapper.run_from_new()
+        remaining = cache_files()
+        assert remaining
+        assert all(first.get(filepath) == ino for filepath, ino in remaining.iteritems())
+        assert len(remaining) < len(first)
+
 def test_explicit_configs():
     wrapper = Wrapper()
     wrapper.configs = "foo.txt bar.txt   abc/def/foo.txt "
@@ -399,3 +480,172 @@ def test_run_target_ba():
         assert wrapper.nodes['bundle:baz'].state == 'ran'
         assert wrapper.nodes['bundle:foob'].state == 'uncached'
         assert wrapper.nodes['bundle:foobar'].state == 'uncached'
+
+def test_cache_index():
+    with tempdir():
+        with open("dexy.yaml", "w") as f:
+            f.write("- foo.txt|dexy\n- bar.txt|dexy")
+
+        for name in ("foo.txt", "bar.txt",):
+            with open(name, "w") as f:
+                f.write(name)
+
+        wrapper = Wrapper()
+        wrapper.create_dexy_dirs()
+        wrapper.run_from_new()
+        entries = wrapper.cache_index().entries
+        assert entries
+
+        # index matches what is on disk
+        index = dexy.cache_index.CacheIndex(wrapper)
+        index.scan()
+        assert index.entries == entries
+
+        # next run loads the saved index instead of scanning
+        def scan():
+            raise Exception("should not scan")
+
+        index = dexy.cache_index.CacheIndex(wrapper)
+        index.scan = scan
+        index.load()
+        assert index.entries == entries
+
+        wrapper = Wrapper()
+        wrapper._cache_index = index
+        wrapper.run_from_new()
+        for node in wrapper.roots:
+            assert node.state == 'consolidated'
+
+        # saved index is removed while running, so an interrupted run
+        # leads to a scan
+        wrapper = Wrapper()
+        wrapper.to_valid()
+        wrapper.to_walked()
+        wrapper.to_checked()
+        assert not os.path.exists(index.filepath())
+
+        index = dexy.cache_index.CacheIndex(wrapper)
+        index.load()
+        assert index.entries == entries
+
+def test_runtime_info_store():
+    with tempdir():
+        with open("dexy.yaml", "w") as f:
+            f.write("- foo.txt|dexy\n- bar.txt|dexy")
+
+        for name in ("foo.txt", "bar.txt",):
+            with open(name, "w") as f:
+                f.write(name)
+
+        wrapper = Wrapper()
+        wrapper.create_dexy_dirs()
+        wrapper.run_from_new()
+        hashids = set(doc.hashid for doc in wrapper.reachable_docs())
+        store = dexy.runtime_info.RuntimeInfoStore(wrapper)
+        store.load()
+        assert set(store.runtime) == hashids
+        assert set(store.args) == set(wrapper.nodes)
+        assert all(len(digest) == 32 for digest in store.args.values())
+
+        with open("dexy.yaml", "w") as f:
+            f.write("- foo.txt|dexy")
+
+        wrapper = Wrapper()
+        wrapper.run_from_new()
+        for node in wrapper.roots:
+            assert node.state == 'consolidated'
+        store.load()
+        assert set(store.runtime) == set(doc.hashid for doc in wrapper.reachable_docs())
+        assert len(store.runtime) < len(hashids)
+        assert set(store.args) == set(wrapper.nodes)
+
+def test_ast_cache():
+    with tempdir():
+        with open("dexy.yaml", "w") as f:
+            f.write("- foo.txt|dexy\n- bar|dexy")
+
+        with open("foo.txt", "w") as f:
+            f.write("foo")
+
+        wrapper = Wrapper()
+        wrapper.create_dexy_dirs()
+        wrapper.to_valid()
+        wrapper.to_walked()
+        assert os.path.exists(dexy.ast_cache.AstCache(wrapper).filepath())
+
+        def restored():
+            wrapper = Wrapper()
+            wrapper.to_valid()
+            wrapper.filemap = wrapper.map_files()
+            digests = [(f, dexy.utils.md5_hash(open(f).read())) for f in ("dexy.yaml",)]
+            ast = AbstractSyntaxTree(wrapper)
+            if dexy.ast_cache.AstCache(wrapper).restore(ast, digests):
+                assert ast.lookup_table == wrapper.parse_configs().lookup_table
+                return True
+
+        assert restored()
+
+        # a file the parser looked for now exists
+        with open("bar", "w") as f:
+            f.write("bar")
+        assert not restored()
+
+        # the config is parsed again and a new snapshot saved
+        wrapper = Wrapper()
+        wrapper.run_from_new()
+        assert restored()
+
+        with open("dexy.yaml", "w") as f:
+            f.write("- foo.txt|dexy")
+        assert not restored()
+
+def test_lookup_tables_are_sets_of_data():
+    wrapper = Wrapper()
+    settings = { 'canonical-name' : 'foo.txt' }
+    data = dexy.data.Generic("foo.txt", ".txt", "abc000", settings, wrapper)
+    same_data = dexy.data.Generic("foo.txt", ".txt", "abc000", settings, wrapper)
+    other_data = dexy.data.Generic("foo.txt", ".txt", "def000", settings, wrapper)
+
+    for d in (data, same_data, other_data,):
+        wrapper.add_data_to_lookup_sections("Welcome", d)
+
+    datas = wrapper.lookup_sections["Welcome"]
+    assert len(datas) == 2
+    assert datas[0] is data
+    assert datas[1] is other_data
+    assert same_data in datas
+    assert list(datas) == [data, other_data]
+
+def test_lookup_sections_100k__slow():
+    wrapper = Wrapper()
+    n_datas = 1000
+    section_names = ["section-%s" % i for i in range(100)]
+
+    datas = []
+    for i in range(n_datas):
+        settings = { 'canonical-name' : "doc%s.txt" % i }
+        datas.append(dexy.data.Generic("doc%s.txt" % i, ".txt", "%032d-000" % i, settings, wrapper))
+
+    # the lookup table as a dict of lists
+    start = time.time()
+    lookup_lists = {}
+    for data in datas:
+        for section_name in section_names:
+            if not section_name in lookup_lists:
+                lookup_lists[section_name] = []
+            if not data in lookup_lists[section_name]:
+                lookup_lists[section_name].append(data)
+    elapsed_lists = time.time() - start
+
+    start = time.time()
+    for data in datas:
+        for section_name in section_names:
+            wrapper.add_data_to_lookup_sections(section_name, data)
+    elapsed_sets = time.time() - start
+
+    print "%s sections in lists in %0.3fs, in sets in %0.3fs" % (
+            n_datas * len(section_names), elapsed_lists, elapsed_sets)
+
+    for section_name in section_names:
+        assert list(wrapper.lookup_sections[section_name]) == lookup_lists[section_name]
+    assert elapsed_sets < elapsed_lists